@@ -33,7 +33,7 @@ import GraphStateNode from "./GraphStateNode";
 import "./App.css";
 
 import JobStatusTable from "./JobsOverview";
-import type { Jobs, WorkerInfo } from "./types";
+import type { Eta, Jobs, WorkerInfo } from "./types";
 
 const elk = new ELK();
 
@@ -61,6 +61,18 @@ async function fetchJobs(experiment: string | null) {
 	return data;
 }
 
+async function fetchEta(experiment: string | null) {
+	if (experiment === null) {
+		return;
+	}
+	const res = await fetch("/api/v1/eta" + "?experiment=" + experiment);
+	if (!res.ok) {
+		throw new Error(`HTTP error! Status: ${res.status}`);
+	}
+	const data = await res.json();
+	return data;
+}
+
 async function fetchWorkers() {
 	const res = await fetch("/api/v1/workers");
 	if (!res.ok) {
@@ -471,6 +483,7 @@ const App = () => {
 	const [experiment, setExperiment] = useState<string | null>(null);
 	const [workerInfo, setWorkerInfo] = useState<WorkerInfo[]>([]);
 	const [jobs, setJobs] = useState<Jobs | null>(null);
+	const [eta, setEta] = useState<Eta | null>(null);
 
 	useEffect(() => {
 		const interval = setInterval(() => {
@@ -523,6 +536,9 @@ const App = () => {
 		fetchJobs(experiment).then((jobs) => {
 			setJobs(jobs);
 		});
+		fetchEta(experiment).then((eta) => {
+			setEta(eta);
+		});
 	}, [experiment, workerInfo]);
 
 	return experiment === null ? (
@@ -533,7 +549,7 @@ const App = () => {
 				<LayoutFlow experiment={experiment} workerInfo={workerInfo} />
 			</Card>
 			<hr />
-			<JobStatusTable workerInfo={workerInfo} jobs={jobs} />
+			<JobStatusTable workerInfo={workerInfo} jobs={jobs} eta={eta} />
 		</ReactFlowProvider>
 	);
 };
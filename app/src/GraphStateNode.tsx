@@ -23,6 +23,7 @@ const statusColors: { [key: string]: string } = {
 	completed: "green",
 	failed: "red",
 	cached: "purple",
+	blocked: "darkred",
 	default: "orange",
 };
 
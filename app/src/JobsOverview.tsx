@@ -1,18 +1,33 @@
 import { useEffect, useState } from "react";
 import { Card, ProgressBar, Table } from "react-bootstrap";
-import type { Jobs, WorkerInfo } from "./types";
+import type { Eta, Jobs, WorkerInfo } from "./types";
+
+const formatDuration = (seconds: number) => {
+	const h = Math.floor(seconds / 3600);
+	const m = Math.floor((seconds % 3600) / 60);
+	const s = Math.round(seconds % 60);
+	if (h > 0) return `${h}h ${m}m`;
+	if (m > 0) return `${m}m ${s}s`;
+	return `${s}s`;
+};
 
 const JobStatusTable = ({
 	workerInfo,
 	jobs,
-}: { workerInfo: WorkerInfo[] | null; jobs: Jobs | null }) => {
+	eta,
+}: { workerInfo: WorkerInfo[] | null; jobs: Jobs | null; eta: Eta | null }) => {
 	const [totalJobs, setTotalJobs] = useState(0);
 
 	useEffect(() => {
 		if (!jobs) return;
 
 		const total =
-			jobs.pending + jobs.running + jobs.completed + jobs.cached + jobs.failed;
+			jobs.pending +
+			jobs.running +
+			jobs.completed +
+			jobs.cached +
+			jobs.failed +
+			jobs.blocked;
 		console.log("Total Jobs: ", total);
 		setTotalJobs(total);
 	}, [jobs]);
@@ -22,6 +37,7 @@ const JobStatusTable = ({
 		completed: "success",
 		running: "info",
 		cached: "secondary",
+		blocked: "warning",
 	};
 
 	const jobStatusLabels = {
@@ -30,6 +46,7 @@ const JobStatusTable = ({
 		running: "Running",
 		pending: "Pending",
 		cached: "Cached",
+		blocked: "Blocked",
 	};
 
 	return (
@@ -75,6 +92,12 @@ const JobStatusTable = ({
 						<td>Workers Online</td>
 						<td>{workerInfo?.length}</td>
 					</tr>
+					<tr>
+						<td>Estimated Time Remaining</td>
+						<td title={eta?.critical_path.join(" → ")}>
+							{eta?.remaining != null ? formatDuration(eta.remaining) : "unknown"}
+						</td>
+					</tr>
 					{Object.keys(jobStatusLabels).map((status) => (
 						<tr key={status}>
 							<td
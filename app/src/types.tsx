@@ -33,4 +33,15 @@ export interface Jobs {
 	completed: number;
 	cached: number;
 	failed: number;
+	blocked: number;
+}
+
+export interface Eta {
+	remaining: number | null;
+	work: number;
+	critical_path: string[];
+	critical_path_duration: number;
+	workers: number;
+	unknown: string[];
+	estimates: Record<string, number>;
 }
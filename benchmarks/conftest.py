@@ -0,0 +1,35 @@
+import os
+import pathlib
+
+import dvc.cli
+import git
+import networkx as nx
+import pytest
+import yaml
+
+
+@pytest.fixture
+def db_url(tmp_path) -> str:
+    return f"sqlite:///{tmp_path / 'paraffin.db'}"
+
+
+@pytest.fixture
+def dvc_proj(tmp_path) -> pathlib.Path:
+    """Factory for a DVC repository with a `dvc.yaml` of no-op stages."""
+
+    def func(graph: nx.DiGraph) -> pathlib.Path:
+        stages = {}
+        for stage in nx.topological_sort(graph):
+            stages[stage.name] = {
+                "cmd": f"echo {stage.name} > outs/{stage.name}",
+                "deps": [f"outs/{parent.name}" for parent in graph.predecessors(stage)],
+                "outs": [f"outs/{stage.name}"],
+            }
+        os.chdir(tmp_path)
+        git.Repo.init()
+        dvc.cli.main(["init", "--quiet"])
+        pathlib.Path("dvc.yaml").write_text(yaml.safe_dump({"stages": stages}))
+        git.Repo().index.commit("Initial commit")
+        return tmp_path
+
+    return func
@@ -0,0 +1,65 @@
+"""Synthetic pipelines for benchmarking the paraffin scheduler."""
+
+import networkx as nx
+
+from paraffin.db import save_graph_to_db
+from paraffin.executor import SimulatedStage
+
+
+def wide_graph(size: int) -> nx.DiGraph:
+    """A single root stage with `size - 1` independent children."""
+    root = SimulatedStage("root")
+    graph = nx.DiGraph()
+    graph.add_node(root)
+    for idx in range(size - 1):
+        graph.add_edge(root, SimulatedStage(f"leaf_{idx}"))
+    return graph
+
+
+def deep_graph(size: int) -> nx.DiGraph:
+    """A linear chain of `size` stages."""
+    stages = [SimulatedStage(f"step_{idx}") for idx in range(size)]
+    graph = nx.DiGraph()
+    graph.add_node(stages[0])
+    nx.add_path(graph, stages)
+    return graph
+
+
+def grouped_graph(size: int, group_size: int = 10) -> nx.DiGraph:
+    """ZnTrack style groups, each a fan-in of `group_size - 1` stages."""
+    graph = nx.DiGraph()
+    for group in range(max(size // group_size, 1)):
+        result = SimulatedStage(
+            f"grp_{group}_Sum",
+            cmd=f"zntrack run module.Sum --name grp_{group}_Sum",
+        )
+        graph.add_node(result)
+        for idx in range(group_size - 1):
+            name = f"grp_{group}_Node" + (f"_{idx}" if idx else "")
+            graph.add_edge(
+                SimulatedStage(name, cmd=f"zntrack run module.Node --name {name}"),
+                result,
+            )
+    return graph
+
+
+GRAPHS = {"wide": wide_graph, "deep": deep_graph, "grouped": grouped_graph}
+
+
+def submit(graph: nx.DiGraph, db_url: str) -> None:
+    """Save the graph as a new experiment."""
+    save_graph_to_db(
+        graph,
+        queues={},
+        commit="HEAD",
+        origin="local",
+        machine="local",
+        cache=False,
+        db_url=db_url,
+    )
+
+
+def stages_per_second(benchmark, size: int) -> None:
+    """Report the throughput of the benchmarked function."""
+    if benchmark.stats is not None:
+        benchmark.extra_info["stages_per_second"] = size / benchmark.stats.stats.mean
@@ -0,0 +1,74 @@
+"""Building stage graphs from DVC and for the web UI."""
+
+import os
+import pathlib
+
+import pytest
+import yaml
+from fastapi.testclient import TestClient
+
+from benchmarks.graphs import GRAPHS, stages_per_second, submit
+from paraffin.db import db_to_graph
+from paraffin.utils import build_elk_hierarchy, get_stage_graph
+
+
+@pytest.mark.parametrize("force", [False, True])
+@pytest.mark.parametrize("size", [100, 500])
+@pytest.mark.parametrize("shape", GRAPHS)
+def test_get_stage_graph(benchmark, dvc_proj, shape, size, force):
+    dvc_proj(GRAPHS[shape](size))
+
+    graph = benchmark(get_stage_graph, names=None, force=force, single_item=False)
+    assert len(graph) == size
+    stages_per_second(benchmark, size)
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_get_stage_status(benchmark, dvc_proj, jobs):
+    """Stages with large data dependencies, where hashing dominates."""
+    dvc_proj(GRAPHS["wide"](50))
+    data = pathlib.Path("data")
+    data.mkdir()
+    pipeline = yaml.safe_load(pathlib.Path("dvc.yaml").read_text())
+    for name, stage in pipeline["stages"].items():
+        (data / name).write_bytes(os.urandom(4_000_000))
+        stage["deps"].append(f"data/{name}")
+    pathlib.Path("dvc.yaml").write_text(yaml.safe_dump(pipeline))
+
+    def setup():
+        # DVC caches the hashes by modification time
+        for path in data.iterdir():
+            os.utime(path)
+
+    benchmark.pedantic(
+        get_stage_graph,
+        kwargs={"names": None, "force": False, "single_item": False, "jobs": jobs},
+        setup=setup,
+        rounds=5,
+    )
+
+
+@pytest.mark.parametrize("size", [100, 1000])
+@pytest.mark.parametrize("shape", GRAPHS)
+def test_build_elk_hierarchy(benchmark, db_url, shape, size):
+    submit(GRAPHS[shape](size), db_url)
+    graph = db_to_graph(db_url, experiment_id=1)
+
+    benchmark(build_elk_hierarchy, graph)
+
+
+@pytest.mark.parametrize(
+    "endpoint", ["graph", "jobs", "eta", "job?name=grp_0_Sum&", "workers?"]
+)
+@pytest.mark.parametrize("size", [100, 1000])
+def test_api_latency(benchmark, db_url, monkeypatch, endpoint, size):
+    from paraffin.ui.app import app
+
+    submit(GRAPHS["grouped"](size), db_url)
+    monkeypatch.setenv("PARAFFIN_DB", db_url)
+    client = TestClient(app)
+    url = f"/api/v1/{endpoint}"
+    url += "experiment=1" if url.endswith(("?", "&")) else "?experiment=1"
+
+    response = benchmark(client.get, url)
+    assert response.status_code == 200
@@ -0,0 +1,104 @@
+"""Load test the database scheduler with simulated stages."""
+
+import os
+import threading
+
+import pytest
+
+from benchmarks.graphs import GRAPHS, stages_per_second, submit
+from paraffin.aio import run_workers
+from paraffin.cli import spawn_worker
+from paraffin.executor import SimulatedExecutor
+from paraffin.pipelined import spawn_pipelined_worker
+
+# The scale of a large campaign takes minutes per graph,
+#  set PARAFFIN_LARGE_BENCHMARKS=1 to run it.
+LARGE = pytest.mark.skipif(
+    not os.environ.get("PARAFFIN_LARGE_BENCHMARKS"),
+    reason="set PARAFFIN_LARGE_BENCHMARKS=1 to run",
+)
+
+
+@pytest.mark.parametrize(
+    ("size", "threads"),
+    [(200, 1), (200, 8), (200, 32), pytest.param(100_000, 256, marks=LARGE)],
+)
+@pytest.mark.parametrize("shape", GRAPHS)
+def test_simulated_workers(benchmark, tmp_path, shape, size, threads):
+    graph = GRAPHS[shape](size)
+    executor = SimulatedExecutor(duration=0.01, lock_time=0.001)
+    rounds = iter(range(1_000_000))
+
+    def setup():
+        db_url = f"sqlite:///{tmp_path / f'paraffin-{next(rounds)}.db'}"
+        submit(graph, db_url)
+        return (db_url,), {}
+
+    def run(db_url):
+        workers = {}
+        pool = [
+            threading.Thread(
+                target=spawn_worker,
+                args=("bench", ["default"], None, None, 1, db_url, workers),
+                kwargs={"executor": executor},
+            )
+            for _ in range(threads)
+        ]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+
+    benchmark.pedantic(run, setup=setup, rounds=1)
+    stages_per_second(benchmark, size)
+
+
+@pytest.mark.parametrize("jobs", [8, 32])
+@pytest.mark.parametrize("shape", GRAPHS)
+def test_async_workers(benchmark, tmp_path, shape, jobs):
+    size = 200
+    graph = GRAPHS[shape](size)
+    executor = SimulatedExecutor(duration=0.01, lock_time=0.001)
+    rounds = iter(range(1_000_000))
+
+    def setup():
+        db_url = f"sqlite:///{tmp_path / f'paraffin-{next(rounds)}.db'}"
+        submit(graph, db_url)
+        return (db_url,), {}
+
+    def run(db_url):
+        run_workers("bench", ["default"], None, None, 1, db_url, jobs, {}, executor)
+
+    benchmark.pedantic(run, setup=setup, rounds=1)
+    stages_per_second(benchmark, size)
+
+
+@pytest.mark.parametrize("threads", [1, 8])
+@pytest.mark.parametrize("shape", GRAPHS)
+def test_pipelined_workers(benchmark, tmp_path, shape, threads):
+    size = 200
+    graph = GRAPHS[shape](size)
+    executor = SimulatedExecutor(duration=0.01, lock_time=0.001)
+    rounds = iter(range(1_000_000))
+
+    def setup():
+        db_url = f"sqlite:///{tmp_path / f'paraffin-{next(rounds)}.db'}"
+        submit(graph, db_url)
+        return (db_url,), {}
+
+    def run(db_url):
+        pool = [
+            threading.Thread(
+                target=spawn_pipelined_worker,
+                args=("bench", ["default"], None, None, 1, db_url, {}),
+                kwargs={"executor": executor},
+            )
+            for _ in range(threads)
+        ]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+
+    benchmark.pedantic(run, setup=setup, rounds=1)
+    stages_per_second(benchmark, size)
@@ -0,0 +1,74 @@
+"""Throughput of submitting, claiming and completing stages."""
+
+import pytest
+
+from benchmarks.graphs import GRAPHS, stages_per_second, submit
+from paraffin.db import complete_job, get_job, register_worker, update_job_status
+
+SIZES = [100, 1000]
+
+
+@pytest.mark.parametrize("size", SIZES)
+@pytest.mark.parametrize("shape", GRAPHS)
+def test_submit(benchmark, db_url, shape, size):
+    graph = GRAPHS[shape](size)
+
+    benchmark(submit, graph, db_url)
+    stages_per_second(benchmark, size)
+
+
+@pytest.mark.parametrize("size", [100])
+@pytest.mark.parametrize("shape", GRAPHS)
+def test_claim_and_complete(benchmark, tmp_path, shape, size):
+    """Process a whole experiment the way a single worker does."""
+    graph = GRAPHS[shape](size)
+    rounds = iter(range(1_000_000))
+
+    def setup():
+        db_url = f"sqlite:///{tmp_path / f'paraffin-{next(rounds)}.db'}"
+        submit(graph, db_url)
+        worker_id = register_worker("bench", "local", db_url, cwd="", pid=0)
+        return (db_url, worker_id), {}
+
+    def run(db_url, worker_id):
+        while job := get_job(db_url=db_url, worker_id=worker_id):
+            stage, _ = job
+            complete_job(
+                stage.id, lock={"cmd": stage.cmd}, db_url=db_url, worker_id=worker_id
+            )
+
+    benchmark.pedantic(run, setup=setup, rounds=3)
+    stages_per_second(benchmark, size)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_get_job_latency(benchmark, db_url, size):
+    """Time to find the next ready stage in a large pending experiment."""
+    submit(GRAPHS["grouped"](size), db_url)
+    worker_id = register_worker("bench", "local", db_url, cwd="", pid=0)
+
+    def run():
+        stage, _ = get_job(db_url=db_url, worker_id=worker_id)
+        # release the stage again for the next round
+        update_job_status(
+            stage.name, experiment_id=1, status="pending", db_url=db_url, force=False
+        )
+
+    benchmark(run)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_get_job_by_name_latency(benchmark, db_url, size):
+    """Time to find the next ancestor of a targeted stage, e.g. `worker --stage`."""
+    graph = GRAPHS["deep"](size)
+    submit(graph, db_url)
+    worker_id = register_worker("bench", "local", db_url, cwd="", pid=0)
+    target = list(graph)[-1].name
+
+    def run():
+        stage, _ = get_job(db_url=db_url, worker_id=worker_id, stage_name=target)
+        update_job_status(
+            stage.name, experiment_id=1, status="pending", db_url=db_url, force=False
+        )
+
+    benchmark(run)
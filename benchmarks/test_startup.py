@@ -0,0 +1,25 @@
+"""Startup time of the command line interface."""
+
+import subprocess
+import sys
+
+import pytest
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "import paraffin.cli",
+        "import paraffin.db",
+        "from paraffin.cli import app\n"
+        "app(['worker', '--help'], standalone_mode=False)",
+    ],
+)
+def test_startup(benchmark, code):
+    benchmark.pedantic(
+        subprocess.run,
+        args=([sys.executable, "-c", code],),
+        kwargs={"check": True},
+        rounds=5,
+        iterations=1,
+    )
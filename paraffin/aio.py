@@ -0,0 +1,324 @@
+"""Worker that runs many stages concurrently in a single event loop.
+
+`paraffin.cli.spawn_worker` uses one thread per job and `run_command` two
+more per subprocess. For many concurrent lightweight stages, `run_workers`
+instead claims the stages in a single loop and supervises their subprocesses
+with asyncio. The database is still accessed through the synchronous
+functions in `paraffin.db`, which run in a thread pool of at most `THREADS`
+threads, independent of the number of jobs. Waiting for identical stages
+in `prepare_job` and for the stages themselves does not hold a thread.
+"""
+
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+from paraffin.cli import MAX_WAIT, checkout_job, find_or_claim, finish_job, uses_cache
+from paraffin.db import (
+    can_make_progress,
+    close_worker,
+    complete_job,
+    get_job,
+    get_next_in_chain,
+    register_worker,
+    update_worker,
+    wait_for_jobs,
+)
+
+if t.TYPE_CHECKING:
+    from paraffin.db.models import Stage
+    from paraffin.executor import Executor
+    from paraffin.prefetch import Prefetcher
+
+log = logging.getLogger(__name__)
+
+# threads for the synchronous database and DVC calls of all jobs
+THREADS = 16
+
+
+async def prepare_job(
+    stage: "Stage", db: str, executor: "Executor"
+) -> tuple[dict | None, str | None]:
+    """Look up the lock of a claimed stage like `paraffin.cli.prepare_job`.
+
+    Waiting for an identical stage that runs elsewhere does not hold a
+    thread of the pool.
+    """
+    stage_lock, cached_lock = None, None
+    if uses_cache(stage):
+        stage_lock, dependency_hash = await asyncio.to_thread(
+            executor.get_lock, stage.name
+        )
+        while True:
+            ready, cached_lock = await asyncio.to_thread(
+                find_or_claim, stage, dependency_hash, db
+            )
+            if ready:
+                break
+            log.info(f"Waiting for a stage identical to '{stage.name}' to finish.")
+            await asyncio.sleep(1)
+    return stage_lock, cached_lock
+
+
+async def run_job(
+    stage: "Stage",
+    worker_id: int,
+    db: str,
+    executor: "Executor",
+    prefetcher: "Prefetcher | None" = None,
+):
+    """Run or checkout a claimed stage like `paraffin.cli.run_job`.
+
+    Only the stage itself is reproduced in the event loop, with
+    `Executor.repro_async`. The other steps run in threads.
+    """
+    result = None
+    if prefetcher is not None:
+        result = await asyncio.to_thread(prefetcher.wait, stage.id)
+    if result is None:
+        stage_lock, cached_lock = await prepare_job(stage, db, executor)
+        result = await asyncio.to_thread(
+            checkout_job, stage, stage_lock, cached_lock, executor=executor
+        )
+    if result is None:
+        log.info(f"Running job '{stage.name}'")
+        result = await executor.repro_async(stage.name, force=stage.force)
+    await asyncio.to_thread(
+        finish_job, stage, result, worker_id=worker_id, db=db, executor=executor
+    )
+
+
+async def _run_chain(
+    stage: "Stage",
+    worker_id: int,
+    db: str,
+    executor: "Executor",
+    workers: dict,
+    prefetcher: "Prefetcher | None",
+    **filters,
+) -> None:
+    """Run a claimed stage and the following stages of its chain."""
+    while True:
+        workers[worker_id] = stage.id
+        await run_job(stage, worker_id, db, executor, prefetcher)
+        workers[worker_id] = None
+        job_obj = await asyncio.to_thread(
+            get_next_in_chain,
+            db_url=db,
+            stage_id=stage.id,
+            worker_id=worker_id,
+            **filters,
+        )
+        if job_obj is None:
+            return
+        stage, _ = job_obj
+
+
+async def _release(
+    done: set[asyncio.Task],
+    running: dict[asyncio.Task, int],
+    free: list[int],
+    workers: dict,
+    db: str,
+) -> None:
+    """Free the workers of finished jobs and fail the stages of broken jobs.
+
+    An error, e.g. while storing the result of a stage, only fails the
+    stage the job was running, the other jobs continue.
+    """
+    for task in done:
+        worker_id = running.pop(task)
+        error = task.exception()
+        if error is not None:
+            log.error(f"Worker {worker_id} failed: {error!r}")
+            if workers[worker_id] is not None:
+                await asyncio.to_thread(
+                    complete_job,
+                    stage_id=workers[worker_id],
+                    status="failed",
+                    lock={},
+                    stdout="",
+                    stderr=f"Worker failed: {error!r}",
+                    db_url=db,
+                    worker_id=worker_id,
+                )
+        workers[worker_id] = None
+        await asyncio.to_thread(update_worker, worker_id, status="idle", db_url=db)
+        free.append(worker_id)
+
+
+async def _run_workers(
+    name: str,
+    queues: list[str],
+    experiment: str | None,
+    stage_name: str | None,
+    timeout: float,
+    db: str,
+    jobs: int,
+    workers: dict,
+    executor: "Executor",
+    affinity: bool,
+    locality_wait: float | None,
+    prefetcher: "Prefetcher | None",
+    max_wait: float,
+) -> None:
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(THREADS, thread_name_prefix="paraffin-aio")
+    )
+    # every concurrent job is a worker in the database, like with threads
+    free = []
+    for _ in range(jobs):
+        worker_id = await asyncio.to_thread(
+            register_worker,
+            name=name,
+            machine=socket.gethostname(),
+            db_url=db,
+            cwd=os.getcwd(),
+            pid=os.getpid(),
+        )
+        workers[worker_id] = None
+        free.append(worker_id)
+    log.info(f"Listening on queues: {queues}")
+
+    running: dict[asyncio.Task, int] = {}
+    last_seen = datetime.datetime.now()
+    drained_since = None
+    try:
+        while True:
+            job_obj = None
+            if free:
+                job_obj = await asyncio.to_thread(
+                    get_job,
+                    db_url=db,
+                    queues=queues,
+                    worker_id=free[-1],
+                    experiment=experiment,
+                    stage_name=stage_name,
+                    affinity=affinity,
+                    locality_wait=locality_wait,
+                )
+            if job_obj is not None:
+                stage, _ = job_obj
+                worker_id = free.pop()
+                workers[worker_id] = stage.id
+                await asyncio.to_thread(
+                    update_worker, worker_id, status="running", db_url=db
+                )
+                task = asyncio.create_task(
+                    _run_chain(
+                        stage,
+                        worker_id,
+                        db,
+                        executor,
+                        workers,
+                        prefetcher,
+                        queues=queues,
+                        experiment=experiment,
+                        stage_name=stage_name,
+                    )
+                )
+                running[task] = worker_id
+                last_seen = datetime.datetime.now()
+                drained_since = None
+                continue
+
+            if running:
+                # poll for new stages once a second while there are free slots
+                done, _ = await asyncio.wait(
+                    running,
+                    timeout=1 if free else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                await _release(done, running, free, workers, db)
+                last_seen = datetime.datetime.now()
+                continue
+
+            if (datetime.datetime.now() - last_seen).total_seconds() >= max_wait:
+                log.info(f"No stage claimed for {max_wait} seconds - exiting.")
+                break
+            if await asyncio.to_thread(
+                can_make_progress,
+                db_url=db,
+                queues=queues,
+                experiment=experiment,
+                stage_name=stage_name,
+            ):
+                drained_since = None
+                await asyncio.to_thread(wait_for_jobs, db_url=db, timeout=1)
+                continue
+            # the timeout only starts once the queues are drained
+            drained_since = drained_since or datetime.datetime.now()
+            remaining_seconds = (
+                timeout - (datetime.datetime.now() - drained_since).seconds
+            )
+            if remaining_seconds <= 0:
+                log.info("No more stages can be run - exiting.")
+                break
+            await asyncio.to_thread(wait_for_jobs, db_url=db, timeout=1)
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+
+def run_workers(
+    name: str,
+    queues: list[str],
+    experiment: str | None,
+    stage_name: str | None,
+    timeout: float,
+    db: str,
+    jobs: int,
+    workers: dict,
+    executor: "Executor | None" = None,
+    affinity: bool = False,
+    locality_wait: float | None = None,
+    prefetcher: "Prefetcher | None" = None,
+    max_wait: float = MAX_WAIT,
+) -> None:
+    """Run up to ``jobs`` stages concurrently in an event loop until drained.
+
+    The arguments are the same as for `paraffin.cli.spawn_worker`.
+    Stages that are still running when the loop exits are marked as
+    failed and the workers are closed.
+    """
+    if executor is None:
+        from paraffin.executor import DVCExecutor
+
+        executor = DVCExecutor()
+    try:
+        asyncio.run(
+            _run_workers(
+                name,
+                queues,
+                experiment,
+                stage_name,
+                timeout,
+                db,
+                jobs,
+                workers,
+                executor,
+                affinity,
+                locality_wait,
+                prefetcher,
+                max_wait,
+            )
+        )
+    finally:
+        for worker_id, stage_id in list(workers.items()):
+            if stage_id is not None:
+                complete_job(
+                    stage_id=stage_id,
+                    status="failed",
+                    lock={},
+                    stdout="",
+                    stderr="Worker exited.",
+                    db_url=db,
+                    worker_id=worker_id,
+                )
+            close_worker(id=worker_id, db_url=db)
+            workers.pop(worker_id)
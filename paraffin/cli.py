@@ -1,36 +1,32 @@
 import datetime
 import logging
 import os
+import pathlib
 import socket
 import threading
 import time
 import typing as t
 import webbrowser
 
-import git
 import typer
-import uvicorn
-
-from paraffin.db import (
-    close_worker,
-    complete_job,
-    find_cached_job,
-    get_job,
-    register_worker,
-    save_graph_to_db,
-    update_worker,
-)
-from paraffin.stage import checkout, get_lock, repro
-from paraffin.ui.app import app as webapp
-from paraffin.utils import (
-    detect_zntrack,
-    get_custom_queue,
-    get_stage_graph,
-    update_gitignore,
-)
+
+from paraffin.profiling import CONCURRENT, WorkerProfiler, profile
+
+if t.TYPE_CHECKING:
+    from paraffin.db.models import Stage
+    from paraffin.executor import Executor
+    from paraffin.prefetch import Prefetcher
+
+# The commands import their dependencies when they are run, so that short-lived
+#  workers and `--help` do not pay for importing DVC or the web UI,
+#  see `tests/test_imports.py`.
 
 log = logging.getLogger(__name__)
 
+# seconds a worker waits for the running stages of other workers without
+#  claiming a stage itself, in case they never finish
+MAX_WAIT = 24 * 60 * 60
+
 app = typer.Typer()
 
 
@@ -42,7 +38,28 @@ def spawn_worker(
     timeout: float,
     db: str,
     workers: dict,
+    profiler: WorkerProfiler | None = None,
+    executor: "Executor | None" = None,
+    affinity: bool = False,
+    locality_wait: float | None = None,
+    prefetcher: "Prefetcher | None" = None,
+    max_wait: float = MAX_WAIT,
 ):
+    from paraffin.db import (
+        can_make_progress,
+        close_worker,
+        complete_job,
+        get_job,
+        get_next_in_chain,
+        register_worker,
+        update_worker,
+        wait_for_jobs,
+    )
+
+    if executor is None:
+        from paraffin.executor import DVCExecutor
+
+        executor = DVCExecutor()
     worker_id = register_worker(
         name=name,
         machine=socket.gethostname(),
@@ -54,24 +71,45 @@ def spawn_worker(
     log.info(f"Listening on queues: {queues}")
 
     last_seen = datetime.datetime.now()
+    drained_since = None
+    job_obj = None
     try:
         while True:
-            job_obj = get_job(
-                db_url=db,
-                queues=queues,
-                worker_id=worker_id,
-                experiment=experiment,
-                stage_name=stage_name,
-            )
+            if job_obj is None:
+                with profile(profiler, f"worker-{worker_id}-poll", dump=False):
+                    job_obj = get_job(
+                        db_url=db,
+                        queues=queues,
+                        worker_id=worker_id,
+                        experiment=experiment,
+                        stage_name=stage_name,
+                        affinity=affinity,
+                        locality_wait=locality_wait,
+                    )
 
             if job_obj is None:
+                if (datetime.datetime.now() - last_seen).total_seconds() >= max_wait:
+                    log.info(f"No stage claimed for {max_wait} seconds - exiting.")
+                    break
+                if can_make_progress(
+                    db_url=db,
+                    queues=queues,
+                    experiment=experiment,
+                    stage_name=stage_name,
+                ):
+                    drained_since = None
+                    log.info("Waiting for running stages to finish.")
+                    wait_for_jobs(db_url=db, timeout=1)
+                    continue
+                # the timeout only starts once the queues are drained
+                drained_since = drained_since or datetime.datetime.now()
                 remaining_seconds = (
-                    timeout - (datetime.datetime.now() - last_seen).seconds
+                    timeout - (datetime.datetime.now() - drained_since).seconds
                 )
                 if remaining_seconds <= 0:
-                    log.info("Timeout reached - exiting.")
+                    log.info("No more stages can be run - exiting.")
                     break
-                time.sleep(1)
+                wait_for_jobs(db_url=db, timeout=1)
                 log.info(
                     "No more job found"
                     f" - sleeping until closing in {remaining_seconds} seconds"
@@ -80,62 +118,30 @@ def spawn_worker(
 
             stage, job = job_obj
             last_seen = datetime.datetime.now()
+            drained_since = None
 
-            update_worker(worker_id, status="running", db_url=db)
-            workers[worker_id] = stage.id
-
-            # This will search the DB and not rely on DVC run cache to determine if
-            #  the job is cached so this can easily work across directories
-            cached_job = None
-            if stage.cache and detect_zntrack({"cmd": stage.cmd}) and not stage.force:
-                stage_lock, dependency_hash = get_lock(stage.name)
-                cached_job = find_cached_job(deps_cache=dependency_hash, db_url=db)
-            if cached_job is not None:
-                log.info(f"Job '{stage.name}' is cached and dvc.lock is available.")
-                returncode, stdout, stderr = checkout(
-                    stage_lock, cached_job.lockfile_content, stage.name
-                )
-                if returncode == 404:
-                    # TODO: we need to ensure that all deps nodes are checked out!
-                    #  this will be important when clone / push.
-                    # TODO: this can be the cause for a lock issue!
-                    log.warning(
-                        f"Unable to checkout GIT tracked files for job '{stage.name}'"
-                    )
-                    log.info(f"Running job '{stage.name}'")
-                    returncode, stdout, stderr = repro(
-                        stage.name, force=stage.force
-                    )  # TODO: this is not tested in CI,
-                    #  because it did not raise an error
-            else:
-                log.info(f"Running job '{stage.name}'")
-                # TODO: we need to ensure that all deps nodes are checked out!
-                #  this will be important when clone / push.
-                # TODO: this can be the cause for a lock issue!
-                returncode, stdout, stderr = repro(stage.name, force=stage.force)
-            if returncode != 0:
-                complete_job(
-                    stage_id=stage.id,  # TODO: should later be job.id
-                    status="failed",
-                    lock={},
-                    stdout=stdout,
-                    stderr=stderr,
-                    db_url=db,
-                    worker_id=worker_id,
-                )
-            else:
-                stage_lock, _ = get_lock(stage.name)
-                complete_job(
-                    stage_id=stage.id,  # TODO: should later be job.id
-                    status="completed",
-                    lock=stage_lock,
-                    stdout=stdout,
-                    stderr=stderr,
-                    db_url=db,
+            with profile(profiler, f"job-{job.id}-{stage.name}"):
+                update_worker(worker_id, status="running", db_url=db)
+                workers[worker_id] = stage.id
+                run_job(
+                    stage,
                     worker_id=worker_id,
+                    db=db,
+                    executor=executor,
+                    prefetcher=prefetcher,
                 )
             job_obj = None
-            update_worker(worker_id, status="idle", db_url=db)
+            # linear chains of stages are run without polling in between
+            job_obj = get_next_in_chain(
+                db_url=db,
+                stage_id=stage.id,
+                worker_id=worker_id,
+                queues=queues,
+                experiment=experiment,
+                stage_name=stage_name,
+            )
+            if job_obj is None:
+                update_worker(worker_id, status="idle", db_url=db)
 
     finally:
         if job_obj is not None:
@@ -153,6 +159,228 @@ def spawn_worker(
         workers.pop(worker_id)
 
 
+def run_job(
+    stage: "Stage",
+    worker_id: int,
+    db: str,
+    executor: "Executor",
+    prefetcher: "Prefetcher | None" = None,
+) -> None:
+    """Run or checkout a claimed stage and store the result in the database.
+
+    The stage fails if its inputs can not be prefetched, see
+    `paraffin.prefetch.Prefetcher.wait`.
+    """
+    result = None
+    if prefetcher is not None:
+        result = prefetcher.wait(stage.id)
+    if result is None:
+        stage_lock, cached_lock = prepare_job(stage, db=db, executor=executor)
+        result = execute_job(stage, stage_lock, cached_lock, executor=executor)
+    finish_job(stage, result, worker_id=worker_id, db=db, executor=executor)
+
+
+def uses_cache(stage: "Stage") -> bool:
+    """Check if a stage is looked up in the paraffin cache, see `prepare_job`."""
+    from paraffin.utils import detect_zntrack
+
+    return stage.cache and detect_zntrack({"cmd": stage.cmd}) and not stage.force
+
+
+def find_or_claim(
+    stage: "Stage", dependency_hash: str, db: str
+) -> tuple[bool, str | None]:
+    """Look up an identical stage in the paraffin cache or claim to compute it.
+
+    Returns
+    -------
+    tuple[bool, str | None]
+        False if an identical stage is still running elsewhere, otherwise
+        True and the lockfile content of the cached stage, if any.
+    """
+    from paraffin.db import claim_dependency_hash, find_cached_job
+
+    cached_lock = find_cached_job(deps_cache=dependency_hash, db_url=db)
+    if cached_lock is not None:
+        return True, cached_lock
+    claimed = claim_dependency_hash(
+        db_url=db, dependency_hash=dependency_hash, stage_id=stage.id
+    )
+    return claimed, None
+
+
+def prepare_job(
+    stage: "Stage", db: str, executor: "Executor"
+) -> tuple[dict | None, str | None]:
+    """Look up the lock of a claimed stage in the paraffin cache.
+
+    Returns
+    -------
+    tuple[dict | None, str | None]
+        The lock of the stage and the lockfile content of an identical
+        cached stage, if the stage uses the paraffin cache.
+    """
+    from paraffin.db import wait_for_jobs
+
+    # This will search the DB and not rely on DVC run cache to determine if
+    #  the job is cached so this can easily work across directories
+    stage_lock, cached_lock = None, None
+    if uses_cache(stage):
+        stage_lock, dependency_hash = executor.get_lock(stage.name)
+        # identical stages, e.g. in other experiments, are only run once
+        while True:
+            ready, cached_lock = find_or_claim(stage, dependency_hash, db)
+            if ready:
+                break
+            log.info(f"Waiting for a stage identical to '{stage.name}' to finish.")
+            wait_for_jobs(db_url=db, timeout=1)
+    return stage_lock, cached_lock
+
+
+def checkout_job(
+    stage: "Stage",
+    stage_lock: dict | None,
+    cached_lock: str | None,
+    executor: "Executor",
+) -> tuple[int, str, str] | None:
+    """Checkout a cached stage, see `prepare_job`.
+
+    Returns None if the stage has to be reproduced instead.
+    """
+    if cached_lock is None:
+        return None
+    log.info(f"Job '{stage.name}' is cached and dvc.lock is available.")
+    returncode, stdout, stderr = executor.checkout(stage_lock, cached_lock, stage.name)
+    if returncode == 404:
+        log.warning(f"Unable to checkout GIT tracked files for job '{stage.name}'")
+        # TODO: this is not tested in CI, because it did not raise an error
+        return None
+    return returncode, stdout, stderr
+
+
+def execute_job(
+    stage: "Stage",
+    stage_lock: dict | None,
+    cached_lock: str | None,
+    executor: "Executor",
+) -> tuple[int, str, str]:
+    """Checkout a cached stage or reproduce it, see `prepare_job`."""
+    result = checkout_job(stage, stage_lock, cached_lock, executor)
+    if result is None:
+        log.info(f"Running job '{stage.name}'")
+        # the outputs of parents that ran in other clones are only in place
+        #  with `--prefetch`, see `paraffin.prefetch`
+        result = executor.repro(stage.name, force=stage.force)
+    return result
+
+
+def finish_job(
+    stage: "Stage",
+    result: tuple[int, str, str],
+    worker_id: int,
+    db: str,
+    executor: "Executor",
+) -> None:
+    """Store the result of `execute_job` and the lock of the stage."""
+    from paraffin.db import complete_job
+
+    returncode, stdout, stderr = result
+    if returncode != 0:
+        complete_job(
+            stage_id=stage.id,  # TODO: should later be job.id
+            status="failed",
+            lock={},
+            stdout=stdout,
+            stderr=stderr,
+            db_url=db,
+            worker_id=worker_id,
+        )
+    else:
+        stage_lock, _ = executor.read_lock(stage.name)
+        complete_job(
+            stage_id=stage.id,  # TODO: should later be job.id
+            status="completed",
+            lock=stage_lock,
+            stdout=stdout,
+            stderr=stderr,
+            db_url=db,
+            worker_id=worker_id,
+        )
+
+
+def _check_worker_options(
+    use_asyncio: bool, profile: bool, pipeline: bool, jobs: int
+) -> None:
+    if use_asyncio and profile:
+        raise typer.BadParameter("'--profile' can not be used with '--async'.")
+    if use_asyncio and pipeline:
+        raise typer.BadParameter("'--pipeline' can not be used with '--async'.")
+    if profile and jobs > 1 and not CONCURRENT:
+        raise typer.BadParameter(
+            "'--profile' can only be used with '--jobs 1' on Python 3.12 and later,"
+            " where only one thread can be profiled at a time."
+        )
+
+
+def _start_prefetcher(
+    executor: "Executor | None",
+    db: str,
+    queues: list[str],
+    experiment: str | None,
+    stage_name: str | None,
+) -> "Prefetcher":
+    from paraffin.prefetch import Prefetcher
+
+    if executor is None:
+        from paraffin.executor import DVCExecutor
+
+        executor = DVCExecutor()
+    return Prefetcher(executor, db, queues, experiment, stage_name).start()
+
+
+def _get_worker_target(pipeline: bool) -> t.Callable:
+    if not pipeline:
+        return spawn_worker
+    from paraffin.pipelined import spawn_pipelined_worker
+
+    return spawn_pipelined_worker
+
+
+def _spawn_workers(
+    target: t.Callable, jobs: int, delay: float, args: tuple, kwargs: dict
+) -> None:
+    """Run ``target`` in ``jobs`` threads until all of them exited."""
+    threads = []
+    for _ in range(jobs):
+        thread = threading.Thread(target=target, args=args, kwargs=kwargs, daemon=True)
+        threads.append(thread)
+        thread.start()
+        time.sleep(delay)
+
+    for thread in threads:
+        thread.join()
+
+
+def _close_workers(workers: dict, db: str) -> None:
+    """Mark the stages of the remaining workers as failed and close them."""
+    from paraffin.db import close_worker, complete_job
+
+    for worker_id, job_id in workers.items():
+        # pipelined workers claim the next stage while running one
+        for stage_id in list(job_id) if isinstance(job_id, frozenset) else [job_id]:
+            if stage_id is not None:
+                complete_job(
+                    stage_id=stage_id,
+                    status="failed",
+                    lock={},
+                    stdout="",
+                    stderr="Worker exited.",
+                    db_url=db,
+                    worker_id=worker_id,
+                )
+        close_worker(id=worker_id, db_url=db)
+
+
 @app.command()
 def ui(
     port: int = 8000,
@@ -164,6 +392,11 @@ def ui(
     ),
 ):
     """Start the Paraffin web UI."""
+    import git
+    import uvicorn
+
+    from paraffin.ui.app import app as webapp
+
     if not all:
         try:
             repo = git.Repo(search_parent_directories=True)
@@ -199,8 +432,14 @@ def worker(
         0,
         "--timeout",
         "-t",
-        help="Timeout in seconds before exiting"
-        " the worker if no more jobs are in the queue.",
+        help="Timeout in seconds before exiting the worker once no stage"
+        " in its queues can be run anymore, e.g. to wait for new submissions.",
+    ),
+    max_wait: float = typer.Option(
+        MAX_WAIT,
+        "--max-wait",
+        help="Exit the worker after this many seconds without claiming a stage,"
+        " even if stages in its queues wait for stages running elsewhere.",
     ),
     db: str = typer.Option(
         "sqlite:///paraffin.db", help="Database URL.", envvar="PARAFFIN_DB"
@@ -209,39 +448,109 @@ def worker(
     delay_between_workers: float = typer.Option(
         0.1, help="Delay between starting workers.", hidden=True
     ),
+    profile_dir: t.Optional[pathlib.Path] = typer.Option(
+        None,
+        "--profile",
+        help="Write a cProfile of every job to this directory."
+        " Send SIGUSR1 to the worker to dump a snapshot of all running jobs.",
+    ),
+    use_asyncio: bool = typer.Option(
+        False,
+        "--async",
+        help="Run the jobs in a single event loop instead of one thread each."
+        " Use this with a large number of jobs for lightweight stages.",
+    ),
+    forkserver: bool = typer.Option(
+        False,
+        "--forkserver",
+        help="Reproduce the stages in forks of a process that imported DVC"
+        " and the ZnTrack nodes once, instead of starting new processes.",
+    ),
+    affinity: bool = typer.Option(
+        False,
+        "--affinity",
+        help="Prefer the children of the last stage and stages of the groups"
+        " that already ran on this machine, whose inputs are likely cached.",
+    ),
+    locality_wait: t.Optional[float] = typer.Option(
+        None,
+        "--locality-wait",
+        help="Leave stages whose inputs were produced on another machine to the"
+        " workers there for this many seconds after they became ready.",
+    ),
+    prefetch: bool = typer.Option(
+        False,
+        "--prefetch",
+        help="Checkout the outputs of stages that ran in other clones of the"
+        " repository in the background, before the stages that need them run.",
+    ),
+    pipeline: bool = typer.Option(
+        False,
+        "--pipeline",
+        help="Claim and prepare the next stage while a stage runs and store the"
+        " results in the background. Use this for many short stages.",
+    ),
 ):
     """Start a paraffin worker to process the queued DVC stages."""
+    _check_worker_options(use_asyncio, profile_dir is not None, pipeline, jobs)
     queues = queues.split(",")
     logging.basicConfig(level=logging.INFO)
-    threads = []
+
+    executor = None
+    if forkserver:
+        from paraffin.executor import ForkServerExecutor
+
+        executor = ForkServerExecutor()
+
+    prefetcher = None
+    if prefetch:
+        prefetcher = _start_prefetcher(executor, db, queues, experiment, stage)
+
+    profiler = None
+    if profile_dir is not None:
+        profiler = WorkerProfiler(profile_dir)
+        profiler.install_signal_handler()
 
     workers = {}
     try:
-        for i in range(jobs):
-            t = threading.Thread(
-                target=spawn_worker,
-                args=(name, queues, experiment, stage, timeout, db, workers),
-                daemon=True,
-            )
-            threads.append(t)
-            t.start()
-            time.sleep(delay_between_workers)
+        if use_asyncio:
+            from paraffin.aio import run_workers
 
-        for t in threads:
-            t.join()
+            run_workers(
+                name,
+                queues,
+                experiment,
+                stage,
+                timeout,
+                db,
+                jobs,
+                workers,
+                executor,
+                affinity,
+                locality_wait,
+                prefetcher,
+                max_wait,
+            )
+        else:
+            _spawn_workers(
+                _get_worker_target(pipeline),
+                jobs,
+                delay_between_workers,
+                args=(name, queues, experiment, stage, timeout, db, workers, profiler),
+                kwargs={
+                    "executor": executor,
+                    "affinity": affinity,
+                    "locality_wait": locality_wait,
+                    "prefetcher": prefetcher,
+                    "max_wait": max_wait,
+                },
+            )
     finally:
-        for worker_id, job_id in workers.items():
-            if job_id is not None:
-                complete_job(
-                    stage_id=job_id,
-                    status="failed",
-                    lock={},
-                    stdout="",
-                    stderr="Worker exited.",
-                    db_url=db,
-                    worker_id=worker_id,
-                )
-            close_worker(id=worker_id, db_url=db)
+        _close_workers(workers, db)
+        if profiler is not None:
+            profiler.close()
+        if prefetcher is not None:
+            prefetcher.close()
 
 
 @app.command()
@@ -274,8 +583,31 @@ def submit(
         " changed dependencies. See https://dvc.org/doc/command-reference/repro#-s"
         " for more information.",
     ),
+    update: t.Optional[int] = typer.Option(
+        None,
+        "--update",
+        help="Update the given experiment instead of creating a new one."
+        " Only new and changed stages and their descendants are rerun.",
+    ),
+    jobs: t.Optional[int] = typer.Option(
+        None,
+        "--jobs",
+        "-j",
+        help="Number of threads to check the status of the stages."
+        " Defaults to the number of CPUs.",
+    ),
 ):
     """Run DVC stages in parallel."""
+    import git
+
+    from paraffin.db import save_graph_to_db, update_experiment
+    from paraffin.utils import (
+        get_capture_config,
+        get_custom_queue,
+        get_stage_graph,
+        update_gitignore,
+    )
+
     if verbose:
         logging.basicConfig(level=logging.DEBUG)
 
@@ -299,10 +631,33 @@ def submit(
             log.debug(f"Creating new experiment based on commit '{commit}'")
 
     log.debug("Getting stage graph")
-    graph = get_stage_graph(names=names, force=force, single_item=single_item)
+    graph = get_stage_graph(
+        names=names, force=force, single_item=single_item, jobs=jobs
+    )
 
     custom_queues = get_custom_queue()
     update_gitignore(line="paraffin.db")
+    if update is not None:
+        try:
+            result = update_experiment(
+                graph,
+                experiment_id=update,
+                queues=custom_queues,
+                commit=commit.hexsha,
+                cache=cache,
+                db_url=db,
+                capture=get_capture_config(),
+                remove_missing=not names,
+            )
+        except ValueError as err:
+            typer.echo(err)
+            raise typer.Exit(1)
+        typer.echo(
+            f"Updated experiment {update}: {len(result['added'])} added,"
+            f" {len(result['reset'])} reset and {len(result['removed'])}"
+            " removed stages."
+        )
+        return
     save_graph_to_db(
         graph,
         queues=custom_queues,
@@ -311,4 +666,73 @@ def submit(
         machine=socket.gethostname(),
         cache=cache,
         db_url=db,
+        capture=get_capture_config(),
     )
+
+
+@app.command()
+def gc(
+    older_than: int = typer.Option(
+        30, help="Remove the logs of experiments older than this many days."
+    ),
+    delete: bool = typer.Option(
+        False,
+        "--delete",
+        help="Delete experiments older than '--older-than' instead of only"
+        " their logs, as well as offline workers.",
+    ),
+    unreachable: bool = typer.Option(
+        False,
+        "--unreachable",
+        help="Delete experiments of this repository based on commits"
+        " that are not reachable from any branch or tag.",
+    ),
+    archive: t.Optional[pathlib.Path] = typer.Option(
+        None,
+        help="Append the deleted experiments with their logs"
+        " to this file, e.g. 'paraffin-archive.jsonl.gz'.",
+    ),
+    db: str = typer.Option(
+        "sqlite:///paraffin.db", help="Database URL.", envvar="PARAFFIN_DB"
+    ),
+):
+    """Remove old experiments and logs and reclaim space in the database."""
+    import git
+
+    from paraffin.db.gc import (
+        archive_experiments,
+        delete_experiments,
+        delete_offline_workers,
+        delete_unused_blobs,
+        find_experiments,
+        prune_logs,
+        vacuum,
+    )
+
+    before = datetime.datetime.now() - datetime.timedelta(days=older_than)
+    if delete or unreachable:
+        origin, commits = None, None
+        if unreachable:
+            repo = git.Repo(search_parent_directories=True)
+            try:
+                origin = repo.remotes.origin.url
+            except AttributeError:
+                origin = "local"
+            commits = set(repo.git.rev_list("--all").split())
+        experiments = find_experiments(
+            db_url=db,
+            before=before if delete else None,
+            origin=origin,
+            commits=commits,
+        )
+        if archive is not None:
+            archive_experiments(db_url=db, experiment_ids=experiments, path=archive)
+        n_experiments = delete_experiments(db_url=db, experiment_ids=experiments)
+        n_workers = delete_offline_workers(db_url=db, before=before)
+        typer.echo(
+            f"Deleted {n_experiments} experiments and {n_workers} offline workers."
+        )
+    jobs = prune_logs(db_url=db, before=before)
+    blobs = delete_unused_blobs(db_url=db)
+    vacuum(db_url=db)
+    typer.echo(f"Removed the logs of {jobs} jobs and {blobs} unused blobs.")
@@ -1,21 +1,32 @@
 from paraffin.db.app import (
+    can_make_progress,
+    claim_dependency_hash,
     close_worker,
     complete_job,
     db_to_graph,
     find_cached_job,
+    get_experiment_eta,
     get_job,
     get_job_dump,
     get_jobs,
+    get_next_in_chain,
+    get_upstream_locks,
+    has_spare_stages,
     list_experiments,
     list_workers,
     register_worker,
     save_graph_to_db,
+    update_experiment,
     update_job_status,
     update_worker,
+    wait_for_jobs,
 )
 
 __all__ = [
+    "can_make_progress",
+    "claim_dependency_hash",
     "db_to_graph",
+    "get_experiment_eta",
     "get_job_dump",
     "get_jobs",
     "list_experiments",
@@ -25,7 +36,12 @@ __all__ = [
     "complete_job",
     "find_cached_job",
     "get_job",
+    "get_next_in_chain",
+    "get_upstream_locks",
+    "has_spare_stages",
     "register_worker",
     "save_graph_to_db",
+    "update_experiment",
     "update_worker",
+    "wait_for_jobs",
 ]
@@ -1,22 +1,134 @@
 import datetime
 import fnmatch
+import functools
 import json
+import logging
+import os
+import socket
+import statistics
+import threading
+import time
+import typing as t
+from collections import defaultdict
 
 import networkx as nx
-from dvc.stage.cache import _get_cache_hash
+from sqlalchemy import Engine, make_url
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import (
     Session,
-    SQLModel,
     create_engine,
+    delete,
+    func,
     or_,
     select,
+    text,
+    update,
 )
 
-from paraffin.db.models import Experiment, Job, Stage, StageDependency, Worker
-from paraffin.lock import clean_lock
-from paraffin.stage import PipelineStageDC
+from paraffin.db.blobs import get_blob, get_blobs, put_blob
+from paraffin.db.migrations import migrate
+from paraffin.db.models import (
+    CacheEntry,
+    Experiment,
+    InFlight,
+    Job,
+    Stage,
+    StageDependency,
+    Worker,
+)
+from paraffin.lock import clean_lock, generalize_cmd
 from paraffin.utils import get_group
 
+if t.TYPE_CHECKING:
+    from paraffin.stage import PipelineStageDC
+
+log = logging.getLogger(__name__)
+
+# channel used for LISTEN / NOTIFY on PostgreSQL
+CHANNEL = "paraffin"
+# only one thread may create the engine and migrate the database
+_ENGINE_LOCK = threading.Lock()
+
+
+def get_engine(db_url: str) -> Engine:
+    """Create the engine and migrate the database, once per process.
+
+    Reusing the engine keeps a connection pool per database instead of
+    opening a new connection for every query.
+    """
+    url = make_url(db_url)
+    if url.get_backend_name() == "sqlite" and url.database not in (None, ":memory:"):
+        # relative paths must not point to another file after a `chdir`
+        url = url.set(database=os.path.abspath(url.database))
+    with _ENGINE_LOCK:
+        return _get_engine(url.render_as_string(hide_password=False))
+
+
+@functools.cache
+def _get_engine(db_url: str) -> Engine:
+    engine = create_engine(db_url)
+    migrate(engine)
+    return engine
+
+
+def notify(session: Session) -> None:
+    """Wake up workers waiting in `wait_for_jobs` once the session is committed."""
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(text(f"NOTIFY {CHANNEL}"))
+
+
+def wait_for_jobs(db_url: str, timeout: float) -> None:
+    """Block until new jobs might be available or the timeout is reached.
+
+    On PostgreSQL, this returns as soon as another process changed the
+    status of a stage. Other databases are polled.
+    """
+    engine = get_engine(db_url)
+    if engine.dialect.name != "postgresql":
+        time.sleep(timeout)
+        return
+    connection = engine.raw_connection()
+    try:
+        driver = connection.driver_connection
+        driver.autocommit = True
+        try:
+            driver.execute(f"LISTEN {CHANNEL}")
+            for _ in driver.notifies(timeout=timeout, stop_after=1):
+                pass
+        finally:
+            driver.execute(f"UNLISTEN {CHANNEL}")
+            driver.autocommit = False
+    except Exception:
+        # the connection must not go back to the pool in an unknown state
+        connection.invalidate()
+        raise
+    finally:
+        connection.close()
+
+
+def _stage_settings(
+    node: "PipelineStageDC", queues: dict[str, str], capture: dict[str, dict] | None
+) -> dict:
+    """Return the queue and capture settings of a stage from `paraffin.yaml`."""
+    queue = "default"
+    # use fnmatch to match the node name with the custom queues
+    for pattern, q in queues.items():
+        if fnmatch.fnmatch(node.name, pattern):
+            queue = q
+            break
+    # match the capture settings against the node name or its queue
+    capture_config = {}
+    for pattern, config in (capture or {}).items():
+        if fnmatch.fnmatch(node.name, pattern) or fnmatch.fnmatch(queue, pattern):
+            capture_config = config
+            break
+    return {
+        "queue": queue,
+        "capture_stdout": capture_config.get("stdout", True),
+        "capture_stderr": capture_config.get("stderr", True),
+        "capture_limit": capture_config.get("limit"),
+    }
+
 
 def save_graph_to_db(
     graph: nx.DiGraph,
@@ -26,31 +138,26 @@ def save_graph_to_db(
     machine: str,
     cache: bool,
     db_url: str,
+    capture: dict[str, dict] | None = None,
 ) -> None:
-    engine = create_engine(db_url)
-    SQLModel.metadata.create_all(engine)
+    engine = get_engine(db_url)
     with Session(engine) as session:
         experiment = Experiment(base=commit, origin=origin, machine=machine)
         session.add(experiment)
         session.commit()
+        stages = {}
         for node in nx.topological_sort(graph):
             node: PipelineStageDC
-            queue = "default"
-            # use fnmatch to match the node name with the custom queues
-            for pattern, q in queues.items():
-                if fnmatch.fnmatch(node.name, pattern):
-                    queue = q
-                    break
             status = "pending" if node.changed else "cached"
 
-            job = Stage(
+            job = stages[node] = Stage(
                 cmd=json.dumps(node.cmd),
                 name=node.name,
-                queue=queue,
                 status=status,
                 experiment_id=experiment.id,
                 cache=cache,
                 force=node.force,
+                **_stage_settings(node, queues, capture),
             )
             # if completed, we can look for the lock and dependency_hash
             if status == "completed":
@@ -67,11 +174,287 @@ def save_graph_to_db(
                 ).one()
                 session.add(StageDependency(parent_id=parent_job.id, child_id=job.id))
 
+        session.flush()
+        for node, head in _find_chains(graph, stages).items():
+            stages[node].chain_id = stages[head].id
+        notify(session)
+        session.commit()
+
+
+def _find_chains(graph: nx.DiGraph, stages: dict) -> dict:
+    """Map the stages of linear chains to the first stage of their chain.
+
+    A stage continues the chain of its parent if it is the only child of
+    its only parent and both are in the same queue. A worker that completed
+    a stage of a chain claims the next one directly, see `get_next_in_chain`.
+    """
+    heads = {}
+    for node in nx.topological_sort(graph):
+        parents = list(graph.predecessors(node))
+        if len(parents) != 1 or graph.out_degree(parents[0]) != 1:
+            continue
+        if stages[parents[0]].queue != stages[node].queue:
+            continue
+        heads[node] = heads.setdefault(parents[0], parents[0])
+    return heads
+
+
+def _update_chains(
+    graph: nx.DiGraph, stages: dict[str, Stage], stored: t.Iterable[Stage]
+) -> None:
+    """Assign the stages of an updated graph to their new chains.
+
+    The ``stored`` stages that are no longer part of the graph are not
+    chained anymore, see `_find_chains`.
+    """
+    for stage in stored:
+        stage.chain_id = None
+    heads = _find_chains(graph, {node: stages[node.name] for node in graph})
+    for node, head in heads.items():
+        stages[node.name].chain_id = stages[head.name].id
+
+
+def keep_cache_entries(session: Session, stages: list[Stage]) -> None:
+    """Keep the lockfiles of completed stages for the paraffin cache."""
+    entries = {
+        stage.dependency_hash: stage.lockfile_hash
+        for stage in stages
+        if stage.status == "completed" and stage.dependency_hash and stage.lockfile_hash
+    }
+    for dependency_hash, lockfile_hash in entries.items():
+        if session.get(CacheEntry, dependency_hash) is None:
+            session.add(
+                CacheEntry(dependency_hash=dependency_hash, lockfile_hash=lockfile_hash)
+            )
+
+
+def _reset_stage(session: Session, stage: Stage) -> None:
+    """Reset a stage to 'pending', keeping its result for the paraffin cache."""
+    keep_cache_entries(session, [stage])
+    stage.status = "pending"
+    stage.lockfile_hash = None
+    stage.dependency_hash = ""
+    stage.started_at = None
+    stage.finished_at = None
+
+
+def _descendants(parents):
+    """Select the ids of all descendants of the stages.
+
+    ``parents`` is a list of stage ids or a statement selecting them. The
+    descendants are queried with a recursive CTE, to be used as a subquery.
+    """
+    descendants = (
+        select(StageDependency.child_id.label("id"))
+        .where(StageDependency.parent_id.in_(parents))
+        .cte(recursive=True)
+    )
+    descendants = descendants.union(
+        select(StageDependency.child_id).where(
+            StageDependency.parent_id == descendants.c.id
+        )
+    )
+    return select(descendants.c.id)
+
+
+def _update_blocked(session: Session, experiment_id: int) -> None:
+    """Mark the pending and cached descendants of failed stages as 'blocked'.
+
+    Blocked stages can not run, so they are not scanned by `get_job`.
+    Their previous status is kept in `Stage.unblocked_status`. Stages that
+    were blocked but no longer have a failed ancestor, e.g. because it was
+    queued again, get their previous status back.
+    This has to be called whenever the status of a stage changes to or
+    from 'failed'.
+    """
+    failed = (
+        select(Stage.id)
+        .where(Stage.experiment_id == experiment_id)
+        .where(Stage.status == "failed")
+    )
+    session.execute(
+        update(Stage)
+        .where(Stage.experiment_id == experiment_id)
+        .where(Stage.status == "blocked")
+        .where(Stage.id.not_in(_descendants(failed)))
+        .values(
+            status=func.coalesce(Stage.unblocked_status, "pending"),
+            unblocked_status=None,
+        )
+    )
+    # both columns are set from the values before the update
+    session.execute(
+        update(Stage)
+        .where(Stage.experiment_id == experiment_id)
+        .where(Stage.id.in_(_descendants(failed)))
+        .where(or_(Stage.status == "pending", Stage.status == "cached"))
+        .values(status="blocked", unblocked_status=Stage.status)
+    )
+
+
+def _remove_stage(session: Session, stage: Stage) -> None:
+    """Delete a stage with its jobs and dependencies."""
+    keep_cache_entries(session, [stage])
+    session.execute(
+        delete(StageDependency).where(
+            or_(
+                StageDependency.parent_id == stage.id,
+                StageDependency.child_id == stage.id,
+            )
+        )
+    )
+    session.execute(delete(Job).where(Job.stage_id == stage.id))
+    session.execute(delete(InFlight).where(InFlight.stage_id == stage.id))
+    session.delete(stage)
+
+
+def _sync_dependencies(
+    session: Session, graph: nx.DiGraph, stages: dict[str, Stage], ids: list[int]
+) -> None:
+    """Update the dependencies between the stages to the edges of the graph."""
+    graph_ids = {stage.id for stage in stages.values()}
+    edges = {
+        (stages[parent.name].id, stages[child.name].id) for parent, child in graph.edges
+    }
+    for dependency in session.exec(
+        select(StageDependency).where(
+            or_(StageDependency.parent_id.in_(ids), StageDependency.child_id.in_(ids))
+        )
+    ).all():
+        edge = (dependency.parent_id, dependency.child_id)
+        if edge in edges:
+            edges.remove(edge)
+        elif edge[0] in graph_ids and edge[1] in graph_ids:
+            session.delete(dependency)
+    for parent_id, child_id in edges:
+        session.add(StageDependency(parent_id=parent_id, child_id=child_id))
+
+
+def update_experiment(
+    graph: nx.DiGraph,
+    experiment_id: int,
+    queues: dict[str, str],
+    commit: str,
+    cache: bool,
+    db_url: str,
+    capture: dict[str, dict] | None = None,
+    remove_missing: bool = True,
+) -> dict[str, list[str]]:
+    """Update an existing experiment to a new stage graph.
+
+    Stages are matched by name. A stage is reset to 'pending' if its command
+    changed, DVC reports it as changed, it is forced or one of its parents
+    is reset or new. All other stages, in particular completed ones,
+    are kept. Running stages are never modified.
+
+    Parameters
+    ----------
+    graph : nx.DiGraph
+        The new stage graph, see `paraffin.utils.get_stage_graph`.
+    experiment_id : int
+        The experiment to update.
+    queues : dict[str, str]
+        The custom queues from `paraffin.yaml`.
+    commit : str
+        The commit the experiment is now based on.
+    cache : bool
+        Use the paraffin cache for the stages.
+    db_url : str
+        The database URL.
+    capture : dict[str, dict] | None
+        The capture settings from `paraffin.yaml`.
+    remove_missing : bool
+        Remove stages that are not part of the new graph.
+
+    Returns
+    -------
+    dict[str, list[str]]
+        The names of the "added", "reset" and "removed" stages.
+
+    Raises
+    ------
+    ValueError
+        If the experiment does not exist.
+    """
+    engine = get_engine(db_url)
+    result = {"added": [], "reset": [], "removed": []}
+    with Session(engine) as session:
+        if session.get(Experiment, experiment_id) is None:
+            raise ValueError(f"Experiment {experiment_id} does not exist.")
+        # Writing first takes the database lock on SQLite and the stages are
+        #  locked on PostgreSQL, so workers can not claim them meanwhile.
+        session.execute(
+            update(Experiment)
+            .where(Experiment.id == experiment_id)
+            .values(base=commit, updated_at=datetime.datetime.now())
+        )
+        stored = {
+            stage.name: stage
+            for stage in session.exec(
+                select(Stage)
+                .where(Stage.experiment_id == experiment_id)
+                .with_for_update()
+            ).all()
+        }
+        stages: dict[str, Stage] = {}
+        rerun: set[str] = set()
+        for node in nx.topological_sort(graph):
+            node: PipelineStageDC
+            cmd = json.dumps(node.cmd)
+            settings = _stage_settings(node, queues, capture)
+            stage = stored.get(node.name)
+            if stage is None:
+                stage = Stage(
+                    cmd=cmd,
+                    name=node.name,
+                    status="pending" if node.changed else "cached",
+                    experiment_id=experiment_id,
+                    cache=cache,
+                    force=node.force,
+                    **settings,
+                )
+                result["added"].append(node.name)
+                rerun.add(node.name)
+            elif stage.status == "running":
+                log.warning(f"Stage '{node.name}' is running and was not updated.")
+            else:
+                stage.sqlmodel_update(settings)
+                stage.cache = cache
+                if (
+                    stage.cmd != cmd
+                    or node.changed
+                    or node.force
+                    or any(parent.name in rerun for parent in graph.predecessors(node))
+                ):
+                    rerun.add(node.name)
+                    if stage.status != "pending":
+                        _reset_stage(session, stage)
+                        result["reset"].append(node.name)
+                    stage.cmd = cmd
+                    stage.force = node.force
+                    stage.updated_at = datetime.datetime.now()
+            session.add(stage)
+            stages[node.name] = stage
+        session.flush()
+
+        _sync_dependencies(
+            session, graph, stages, [stage.id for stage in stored.values()]
+        )
+        if remove_missing:
+            for name, stage in stored.items():
+                if name not in stages and stage.status != "running":
+                    _remove_stage(session, stage)
+                    result["removed"].append(name)
+
+        _update_chains(graph, stages, stored.values())
+        _update_blocked(session, experiment_id)
+        notify(session)
         session.commit()
+    return result
 
 
 def list_experiments(db_url: str, commit: str | None) -> list[dict]:
-    engine = create_engine(db_url)
+    engine = get_engine(db_url)
     with Session(engine) as session:
         if commit is not None:
             exps = session.exec(
@@ -106,11 +489,15 @@ def db_to_graph(db_url: str, experiment_id: int = 1) -> nx.DiGraph:
     Create a directed graph from the database for a specific experiment,
       resolving Job objects to dictionaries.
     """
-    engine = create_engine(db_url)
+    engine = get_engine(db_url)
     with Session(engine) as session:
         # Create the graph using the open session
         graph = session_to_graph(session, experiment_id)
 
+        locks = get_blobs(
+            session, (data["data"].lockfile_hash for _, data in graph.nodes(data=True))
+        )
+
         # Resolve Job objects to dictionaries
         resolved_graph = nx.DiGraph()
         for job_id, node_data in graph.nodes(data=True):
@@ -121,8 +508,8 @@ def db_to_graph(db_url: str, experiment_id: int = 1) -> nx.DiGraph:
                 cmd=json.loads(stage.cmd),
                 status=stage.status,
                 queue=stage.queue,
-                lock=json.loads(stage.lockfile_content)
-                if stage.lockfile_content
+                lock=json.loads(locks[stage.lockfile_hash])
+                if stage.lockfile_hash
                 else None,
                 dependency_hash=stage.dependency_hash,
                 group=get_group(stage.name)[0],
@@ -140,33 +527,218 @@ def get_job(
     queues: list | None = None,
     experiment: int | None = None,
     stage_name: str | None = None,
+    affinity: bool = False,
+    locality_wait: float | None = None,
 ) -> tuple[Stage, Job] | None:
     """
     Get the next job where status is 'pending' and all parents are 'completed'.
+
+    With ``affinity``, the children of the last stage of the worker and
+    stages of groups that already ran on its machine are preferred, so
+    their inputs are more likely to be cached locally.
+    With ``locality_wait``, stages whose inputs were produced on other
+    machines are left to the workers there for the given number of seconds,
+    see `_apply_locality`.
     """
-    engine = create_engine(db_url)
+    engine = get_engine(db_url)
     with Session(engine) as session:
         worker = session.exec(select(Worker).where(Worker.id == worker_id)).one()
         if stage_name is None:
             stages = _fetch_pending_jobs(session, experiment, queues)
         else:
             stages = _fetch_jobs_by_name(session, experiment, queues, stage_name)
+        if affinity:
+            stages = _sort_by_affinity(session, stages, worker)
+        if locality_wait is not None:
+            stages = _apply_locality(session, stages, worker, locality_wait)
 
         for stage in stages:
-            if _all_parents_completed(stage):
-                # TODO check if the number of workers on the
-                #  job are less than max_workers
-                job = stage.attach_job(worker)
-                session.add(job)
-                session.add(stage)
-                session.commit()
-                session.refresh(job)
-                session.refresh(stage)
-                return stage, job
+            if _all_parents_completed(stage) and _claim_stage(session, stage):
+                return _attach_job(session, stage, worker)
 
     return None
 
 
+def _sort_by_affinity(
+    session: Session, stages: list[Stage], worker: Worker
+) -> list[Stage]:
+    """Sort the stages by their affinity to the worker.
+
+    The children of the last stage of the worker come first, followed by
+    the stages of groups that already ran on the machine of the worker.
+    """
+    if len(stages) < 2:
+        return stages
+    last = session.exec(
+        select(Job.stage_id).where(Job.worker_id == worker.id).order_by(Job.id.desc())
+    ).first()
+    children = set()
+    if last is not None:
+        children = set(
+            session.exec(
+                select(StageDependency.child_id).where(
+                    StageDependency.parent_id == last
+                )
+            ).all()
+        )
+    # stages without a group, e.g. 'A', share the empty group
+    groups = {stage.id: tuple(get_group(stage.name)[0]) for stage in stages}
+    prefixes = {"_".join(group) + "_" for group in groups.values() if group}
+    ran = set()
+    if prefixes:
+        # only the names that might belong to the groups of the candidates
+        names = session.exec(
+            select(Stage.name)
+            .distinct()
+            .join(Job, Job.stage_id == Stage.id)
+            .join(Worker, Worker.id == Job.worker_id)
+            .where(Worker.machine == worker.machine)
+            .where(Stage.experiment_id.in_({stage.experiment_id for stage in stages}))
+            .where(
+                or_(
+                    *(
+                        Stage.name.startswith(prefix, autoescape=True)
+                        for prefix in prefixes
+                    )
+                )
+            )
+        ).all()
+        ran = {tuple(get_group(name)[0]) for name in names}
+
+    def key(stage: Stage) -> int:
+        if stage.id in children:
+            return 0
+        if groups[stage.id] and groups[stage.id] in ran:
+            return 1
+        return 2
+
+    return sorted(stages, key=key)
+
+
+def _apply_locality(
+    session: Session, stages: list[Stage], worker: Worker, wait: float
+) -> list[Stage]:
+    """Defer the stages whose inputs were produced on other machines.
+
+    The outputs of a stage are on the machine of the worker of its last
+    finished job. Stages with inputs on the machine of the worker come
+    first. Stages with all inputs on other machines that still have online
+    workers are skipped until ``wait`` seconds after they became ready.
+    """
+    if not stages:
+        return stages
+    rows = session.exec(
+        select(
+            StageDependency.child_id,
+            Job.stage_id,
+            Job.id,
+            Job.finished_at,
+            Worker.machine,
+        )
+        .join(Job, Job.stage_id == StageDependency.parent_id)
+        .join(Worker, Worker.id == Job.worker_id)
+        .where(StageDependency.child_id.in_([stage.id for stage in stages]))
+        .where(Job.finished_at.is_not(None))
+    ).all()
+    last_jobs = {}
+    for child_id, parent_id, job_id, finished_at, machine in rows:
+        if job_id > last_jobs.get((child_id, parent_id), (0,))[0]:
+            last_jobs[(child_id, parent_id)] = (job_id, finished_at, machine)
+    producers = defaultdict(set)
+    # when the last parent finished
+    ready_since = defaultdict(lambda: datetime.datetime.min)
+    for (child_id, _), (_, finished_at, machine) in last_jobs.items():
+        producers[child_id].add(machine)
+        ready_since[child_id] = max(ready_since[child_id], finished_at)
+    online = set(
+        session.exec(select(Worker.machine).where(Worker.status != "offline")).all()
+    )
+
+    local, remote = [], []
+    # the jobs were finished on other machines, see `_now`
+    deadline = _now(session) - datetime.timedelta(seconds=wait)
+    for stage in stages:
+        machines = producers[stage.id]
+        if not machines or worker.machine in machines:
+            local.append(stage)
+        elif not machines & online or ready_since[stage.id] < deadline:
+            remote.append(stage)
+    return local + remote
+
+
+def _now(session: Session) -> datetime.datetime:
+    """Return the current time for the start and end of jobs.
+
+    On PostgreSQL, workers on many machines share the clock of the database
+    server, so the times of their jobs can be compared despite clock skew.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        return session.exec(select(func.localtimestamp())).one()
+    return datetime.datetime.now()
+
+
+def _attach_job(session: Session, stage: Stage, worker: Worker) -> tuple[Stage, Job]:
+    """Create the job of a claimed stage and commit it."""
+    # TODO check if the number of workers on the
+    #  job are less than max_workers
+    job = stage.attach_job(worker)
+    job.started_at = stage.started_at = _now(session)
+    session.add(job)
+    session.add(stage)
+    session.commit()
+    session.refresh(job)
+    session.refresh(stage)
+    return stage, job
+
+
+def get_next_in_chain(
+    db_url: str,
+    stage_id: int,
+    worker_id: int,
+    queues: list | None = None,
+    experiment: int | None = None,
+    stage_name: str | None = None,
+) -> tuple[Stage, Job] | None:
+    """Claim the next stage in the chain of a completed stage.
+
+    Workers call this after completing a stage, so linear chains of stages
+    run on one worker without scanning for ready stages in between.
+    The arguments are the same as for `get_job`.
+
+    Returns
+    -------
+    tuple[Stage, Job] | None
+        The claimed stage and its job or None if the stage is not part of
+        a chain or the next stage is not ready.
+    """
+    engine = get_engine(db_url)
+    with Session(engine) as session:
+        stage = session.get(Stage, stage_id)
+        if stage is None or stage.chain_id is None or stage.status != "completed":
+            return None
+        statement = (
+            select(Stage)
+            .join(StageDependency, StageDependency.child_id == Stage.id)
+            .where(StageDependency.parent_id == stage_id)
+            .where(Stage.chain_id == stage.chain_id)
+            .where(or_(Stage.status == "pending", Stage.status == "cached"))
+        )
+        if queues:
+            statement = statement.where(Stage.queue.in_(queues))
+        if stage_name is not None:
+            statement = statement.where(
+                Stage.id.in_(_ancestors(experiment, stage_name))
+            )
+        child = session.exec(statement).first()
+        # the chain might have been changed by `update_experiment`
+        if child is None or not _all_parents_completed(child):
+            return None
+        if not _claim_stage(session, child):
+            return None
+        worker = session.get_one(Worker, worker_id)
+        return _attach_job(session, child, worker)
+
+
 def _fetch_pending_jobs(
     session: Session, experiment: int | None, queues: list | None
 ) -> list[Stage]:
@@ -175,14 +747,72 @@ def _fetch_pending_jobs(
     filtered by experiment and queues.
     """
     statement = select(Stage).where(
-        or_(Stage.status == "pending", Stage.status == "cached")
+        or_(Stage.status == "pending", Stage.status == "cached"),
+        Stage.id.not_in(_waiting()),
     )
     if experiment:
         statement = statement.where(Stage.experiment_id == experiment)
     if queues:
         statement = statement.where(Stage.queue.in_(queues))
-    statement = statement.with_for_update()
-    return session.exec(statement).all()
+    return session.exec(statement.order_by(Stage.id)).all()
+
+
+def _waiting():
+    """Select the ids of stages with a parent that is not completed.
+
+    Excluding these in the database avoids loading the parents of every
+    pending stage in `_all_parents_completed`.
+    """
+    return (
+        select(StageDependency.child_id)
+        .join(Stage, Stage.id == StageDependency.parent_id)
+        .where(Stage.status != "completed")
+    )
+
+
+def _claim_stage(session: Session, stage: Stage) -> bool:
+    """Mark the stage as running, unless another worker claimed it first.
+
+    The status is changed with a conditional UPDATE, so only one of many
+    concurrent workers can succeed. On PostgreSQL, stages that are
+    currently being claimed by another worker are skipped instead of
+    waiting for their row lock.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        statement = (
+            select(Stage.id)
+            .where(Stage.id == stage.id)
+            .with_for_update(skip_locked=True)
+        )
+        if session.exec(statement).first() is None:
+            return False
+    result = session.execute(
+        update(Stage)
+        .where(Stage.id == stage.id)
+        .where(or_(Stage.status == "pending", Stage.status == "cached"))
+        .values(status="running")
+    )
+    return result.rowcount == 1
+
+
+@functools.lru_cache(maxsize=128)
+def _ancestors(experiment: int | None, job_name: str):
+    """Select the ids of the stages with the given name and all their ancestors.
+
+    The ancestors are queried with a recursive CTE over `StageDependency`
+    that is used as a subquery, so the ids are never bound as parameters.
+    Only the statement is cached, the database evaluates it on every poll.
+    """
+    targets = select(Stage.id).where(Stage.name == job_name)
+    if experiment:
+        targets = targets.where(Stage.experiment_id == experiment)
+    ancestors = targets.cte("ancestors", recursive=True)
+    ancestors = ancestors.union(
+        select(StageDependency.parent_id).where(
+            StageDependency.child_id == ancestors.c.id
+        )
+    )
+    return select(ancestors.c.id)
 
 
 def _fetch_jobs_by_name(
@@ -191,25 +821,14 @@ def _fetch_jobs_by_name(
     """
     Fetch jobs by name, including their predecessors, and filter by status and queues.
     """
-    graph = session_to_graph(session, experiment)
-    statement = select(Stage).where(Stage.name == job_name)
-    if experiment:
-        statement = statement.where(Stage.experiment_id == experiment)
-    jobs = session.exec(statement).all()
-
-    results = []
-    for job in jobs:
-        predecessors = nx.ancestors(graph, job.id)
-        results.extend(
-            [graph.nodes[node]["data"] for node in graph.nodes if node in predecessors]
-        )
-        results.append(job)
-
-    # Filter results that are not "pending" or "cached"
-    results = [job for job in results if job.status in ["pending", "cached"]]
+    statement = select(Stage).where(
+        Stage.id.in_(_ancestors(experiment, job_name)),
+        or_(Stage.status == "pending", Stage.status == "cached"),
+        Stage.id.not_in(_waiting()),
+    )
     if queues:
-        results = [job for job in results if job.queue in queues]
-    return results
+        statement = statement.where(Stage.queue.in_(queues))
+    return session.exec(statement.order_by(Stage.id)).all()
 
 
 def _all_parents_completed(stage: Stage) -> bool:
@@ -219,6 +838,166 @@ def _all_parents_completed(stage: Stage) -> bool:
     return all(parent.status == "completed" for parent in stage.parents)
 
 
+def _candidates(
+    queues: list | None,
+    experiment: int | None,
+    stage_name: str | None,
+):
+    """Select the ids of the stages a worker selects in `get_job`, ready or not."""
+    candidates = select(Stage.id).where(
+        or_(Stage.status == "pending", Stage.status == "cached")
+    )
+    if stage_name is not None:
+        candidates = candidates.where(Stage.id.in_(_ancestors(experiment, stage_name)))
+    elif experiment:
+        candidates = candidates.where(Stage.experiment_id == experiment)
+    if queues:
+        candidates = candidates.where(Stage.queue.in_(queues))
+    return candidates
+
+
+def can_make_progress(
+    db_url: str,
+    queues: list | None = None,
+    experiment: int | None = None,
+    stage_name: str | None = None,
+) -> bool:
+    """Check if a worker could still claim a stage in the future.
+
+    This is the case if one of the stages the worker selects with the
+    same arguments in `get_job` is ready, or if it is a descendant of a
+    running stage and of no failed stage. Running stages whose worker is
+    gone do not count, see `_worker_exited`. Stages behind a failed stage
+    are usually blocked already, see `_update_blocked`.
+    """
+    engine = get_engine(db_url)
+    with Session(engine) as session:
+        candidates = _candidates(queues, experiment, stage_name)
+        if session.exec(candidates).first() is None:
+            return False
+
+        if session.exec(candidates.where(Stage.id.not_in(_waiting()))).first():
+            return True
+
+        experiments = select(Stage.experiment_id).where(Stage.id.in_(candidates))
+        running = [
+            stage.id
+            for stage in session.exec(
+                select(Stage)
+                .where(Stage.status == "running")
+                .where(Stage.experiment_id.in_(experiments))
+            ).all()
+            if not _worker_exited(stage)
+        ]
+        if not running:
+            return False
+        failed = (
+            select(Stage.id)
+            .where(Stage.status == "failed")
+            .where(Stage.experiment_id.in_(experiments))
+        )
+        waiting = candidates.where(Stage.id.in_(_descendants(running))).where(
+            Stage.id.not_in(_descendants(failed))
+        )
+        return session.exec(waiting).first() is not None
+
+
+def has_spare_stages(
+    db_url: str,
+    queues: list | None = None,
+    experiment: int | None = None,
+    stage_name: str | None = None,
+) -> bool:
+    """Check if more stages are ready than workers are idle.
+
+    The stages are selected like in `get_job`. Idle workers are counted
+    regardless of their queues. Pipelined workers only claim a stage ahead
+    of time if no idle worker could run it instead.
+    """
+    engine = get_engine(db_url)
+    with Session(engine) as session:
+        idle = session.exec(
+            select(func.count(Worker.id)).where(Worker.status == "idle")
+        ).one()
+        ready = session.exec(
+            _candidates(queues, experiment, stage_name)
+            .where(Stage.id.not_in(_waiting()))
+            .limit(idle + 1)
+        ).all()
+        return len(ready) > idle
+
+
+def get_upstream_locks(
+    db_url: str,
+    machine: str,
+    cwd: str,
+    stage_id: int | None = None,
+    queues: list | None = None,
+    experiment: int | None = None,
+    stage_name: str | None = None,
+) -> dict[str, str]:
+    """Return the locks of parents whose outputs were produced in other clones.
+
+    Parameters
+    ----------
+    db_url : str
+        The database URL.
+    machine : str
+        The machine of the clone the outputs are needed in.
+    cwd : str
+        The directory of the clone the outputs are needed in.
+    stage_id : int | None
+        Return the parents of this stage. Otherwise, return the parents
+        of the stages a worker selects with the same arguments in
+        `get_job` that are ready or only wait for running stages.
+
+    Returns
+    -------
+    dict[str, str]
+        The lockfile contents of the completed parents by name. The outputs
+        of a stage are in the clone of the worker of its last finished job.
+    """
+    engine = get_engine(db_url)
+    with Session(engine) as session:
+        if stage_id is not None:
+            children = [stage_id]
+        else:
+            unfinished = (
+                select(StageDependency.child_id)
+                .join(Stage, Stage.id == StageDependency.parent_id)
+                .where(Stage.status.not_in(["completed", "running"]))
+            )
+            children = _candidates(queues, experiment, stage_name).where(
+                Stage.id.not_in(unfinished)
+            )
+        rows = session.exec(
+            select(Stage.name, Stage.lockfile_hash, Job.id, Worker.machine, Worker.cwd)
+            .join(StageDependency, StageDependency.parent_id == Stage.id)
+            .join(Job, Job.stage_id == Stage.id)
+            .join(Worker, Worker.id == Job.worker_id)
+            .where(StageDependency.child_id.in_(children))
+            .where(Stage.status == "completed")
+            .where(Stage.lockfile_hash.is_not(None))
+            .where(Job.finished_at.is_not(None))
+        ).all()
+        last_jobs = {}
+        for name, lockfile_hash, job_id, *clone in rows:
+            if job_id > last_jobs.get(name, (0,))[0]:
+                last_jobs[name] = (job_id, lockfile_hash, tuple(clone))
+        return {
+            name: get_blob(session, lockfile_hash)
+            for name, (_, lockfile_hash, clone) in last_jobs.items()
+            if clone != (machine, cwd)
+        }
+
+
+def _truncate(output: str, limit: int | None) -> str:
+    """Keep the end of the output, which usually contains the errors."""
+    if limit is None or len(output) <= limit:
+        return output
+    return f"[{len(output) - limit} characters truncated]\n" + output[-limit:]
+
+
 def complete_job(
     stage_id: int,
     lock: dict,
@@ -228,38 +1007,49 @@ def complete_job(
     stderr: str = "",
     stdout: str = "",
 ):
-    engine = create_engine(db_url)
+    engine = get_engine(db_url)
     with Session(engine) as session:
         statement = select(Stage).where(Stage.id == stage_id)
         results = session.exec(statement)
         stage = results.one()
         stage.status = status
-        stage.lockfile_content = json.dumps(lock)
+        stage.lockfile_hash = put_blob(session, json.dumps(lock))
         # TODO: this only works for a single worker
+        #  a stage that was reset might have older jobs of the same worker
         job = session.exec(
             select(Job)
             .where(Job.stage_id == stage_id)
             .where(Job.worker_id == worker_id)
-        ).one()
-        job.finished_at = datetime.datetime.now()
+            .order_by(Job.id.desc())
+        ).first()
+        job.finished_at = _now(session)
         if stage.capture_stderr:
-            job.stderr = stderr
+            stderr = _truncate(stderr, stage.capture_limit)
+            job.stderr_hash = put_blob(session, stderr, zstd=True)
         if stage.capture_stdout:
-            job.stdout = stdout
-        stage.finished_at = datetime.datetime.now()
+            stdout = _truncate(stdout, stage.capture_limit)
+            job.stdout_hash = put_blob(session, stdout, zstd=True)
+        stage.finished_at = job.finished_at
         # We only write the dependency_hash to the database
         #  once the job has finished successfully!
         if status == "completed":
+            from dvc.stage.cache import _get_cache_hash
+
             stage.dependency_hash = _get_cache_hash(clean_lock(lock), key=False)
+        # identical stages waiting in `claim_dependency_hash` can continue
+        session.execute(delete(InFlight).where(InFlight.stage_id == stage_id))
         session.add(stage)
         session.add(job)
+        if status == "failed":
+            _update_blocked(session, stage.experiment_id)
+        notify(session)
         session.commit()
 
 
 def update_job_status(
     job_name: str, experiment_id: int, status: str, db_url: str, force: bool
 ) -> int:
-    engine = create_engine(db_url)
+    engine = get_engine(db_url)
     with Session(engine) as session:
         statement = (
             select(Stage)
@@ -274,12 +1064,14 @@ def update_job_status(
         if force:
             job.force = True
         session.add(job)
+        _update_blocked(session, experiment_id)
+        notify(session)
         session.commit()
     return 0
 
 
 def get_job_dump(job_name: str, experiment_id: int, db_url: str) -> dict[str, str]:
-    engine = create_engine(db_url)
+    engine = get_engine(db_url)
     with Session(engine) as session:
         statement = (
             select(Stage)
@@ -289,24 +1081,109 @@ def get_job_dump(job_name: str, experiment_id: int, db_url: str) -> dict[str, st
         results = session.exec(statement)
         stage = results.one()
         data = stage.model_dump()
-        if len(stage.jobs) == 1:
-            data.update({"worker": stage.jobs[0].worker.model_dump()})
+        data["lockfile_content"] = get_blob(session, stage.lockfile_hash)
+        if stage.jobs:
+            job = max(stage.jobs, key=lambda job: job.id)
+            data.update({"worker": job.worker.model_dump()})
+            data["stdout"] = get_blob(session, job.stdout_hash)
+            data["stderr"] = get_blob(session, job.stderr_hash)
         return data
 
 
-def find_cached_job(db_url: str, deps_cache: str = "") -> Stage | None:
-    engine = create_engine(db_url)
+def find_cached_job(db_url: str, deps_cache: str = "") -> str | None:
+    """Return the lockfile of a completed stage with the given dependency hash."""
+    engine = get_engine(db_url)
     with Session(engine) as session:
-        statement = select(Stage).where(Stage.dependency_hash == deps_cache)
-        results = session.exec(statement)
-        if res := results.first():
-            session.refresh(res)
-            return res
+        statement = select(Stage.lockfile_hash).where(
+            Stage.dependency_hash == deps_cache
+        )
+        if key := session.exec(statement).first():
+            return get_blob(session, key)
+        # the stage might have been removed by `paraffin gc`
+        if entry := session.get(CacheEntry, deps_cache):
+            return get_blob(session, entry.lockfile_hash)
     return None
 
 
+def _worker_exited(stage: Stage) -> bool:
+    """Check if the worker of the last job of a running stage is gone.
+
+    This is the case if the worker is offline or if it ran on this machine
+    and its process no longer exists. Workers on other machines that were
+    killed are only detected once they are marked as offline.
+    """
+    if not stage.jobs:
+        return False
+    worker = max(stage.jobs, key=lambda job: job.id).worker
+    if worker.status == "offline":
+        return True
+    if worker.machine != socket.gethostname() or worker.pid <= 0:
+        return False
+    try:
+        os.kill(worker.pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def claim_dependency_hash(db_url: str, dependency_hash: str, stage_id: int) -> bool:
+    """Register a running stage as the one computing a dependency hash.
+
+    Identical stages, e.g. in other experiments of a parameter sweep, wait
+    for the registered stage and check out its result instead of running
+    at the same time. The entry is removed by `complete_job`. Entries of
+    stages that are no longer running or whose worker exited, e.g.
+    because it was killed, are replaced, see `_worker_exited`.
+
+    Returns
+    -------
+    bool
+        False if an identical stage is running or has completed since
+        the paraffin cache was checked.
+    """
+    engine = get_engine(db_url)
+    while True:
+        with Session(engine) as session:
+            entry = session.get(InFlight, dependency_hash)
+            if entry is not None:
+                if entry.stage_id == stage_id:
+                    return True
+                owner = session.get(Stage, entry.stage_id)
+                if (
+                    owner is not None
+                    and owner.status == "running"
+                    and not _worker_exited(owner)
+                ):
+                    return False
+                log.warning(f"Replacing the stale claim of stage {entry.stage_id}.")
+                session.execute(
+                    delete(InFlight)
+                    .where(InFlight.dependency_hash == dependency_hash)
+                    .where(InFlight.stage_id == entry.stage_id)
+                )
+                session.commit()
+                continue
+            session.add(InFlight(dependency_hash=dependency_hash, stage_id=stage_id))
+            try:
+                session.flush()
+            except IntegrityError:
+                # another worker claimed the same hash at the same time
+                session.rollback()
+                continue
+            completed = session.exec(
+                select(Stage.id).where(Stage.dependency_hash == dependency_hash)
+            ).first()
+            if completed is not None:
+                session.rollback()
+                return False
+            session.commit()
+            return True
+
+
 def register_worker(name: str, machine: str, db_url: str, cwd: str, pid: int) -> int:
-    engine = create_engine(db_url)
+    engine = get_engine(db_url)
     with Session(engine) as session:
         worker = Worker(name=name, machine=machine, cwd=cwd, pid=pid)
         session.add(worker)
@@ -315,7 +1192,7 @@ def register_worker(name: str, machine: str, db_url: str, cwd: str, pid: int) ->
 
 
 def update_worker(id: int, status: str, db_url: str) -> None:
-    engine = create_engine(db_url)
+    engine = get_engine(db_url)
     with Session(engine) as session:
         worker = session.exec(select(Worker).where(Worker.id == id)).one()
         worker.status = status
@@ -325,7 +1202,7 @@ def update_worker(id: int, status: str, db_url: str) -> None:
 
 
 def close_worker(id: int, db_url: str) -> None:
-    engine = create_engine(db_url)
+    engine = get_engine(db_url)
     with Session(engine) as session:
         worker = session.exec(select(Worker).where(Worker.id == id)).one()
         worker.status = "offline"
@@ -336,7 +1213,7 @@ def close_worker(id: int, db_url: str) -> None:
 
 
 def list_workers(db_url: str, id: int | None = None) -> list[dict]:
-    engine = create_engine(db_url)
+    engine = get_engine(db_url)
     with Session(engine) as session:
         if id is None:
             statement = select(Worker).where(Worker.status != "offline")
@@ -353,13 +1230,137 @@ def list_workers(db_url: str, id: int | None = None) -> list[dict]:
 
 def get_jobs(db_url: str, experiment_id: int) -> dict[str, int]:
     """Get the number of jobs in each status for a specific experiment."""
-    engine = create_engine(db_url)
+    engine = get_engine(db_url)
     with Session(engine) as session:
         statement = select(Stage).where(Stage.experiment_id == experiment_id)
         jobs = session.exec(statement).all()
 
-        status = {"pending": 0, "running": 0, "completed": 0, "cached": 0, "failed": 0}
+        status = {
+            "pending": 0,
+            "running": 0,
+            "completed": 0,
+            "cached": 0,
+            "failed": 0,
+            "blocked": 0,
+        }
         for job in jobs:
             status[job.status] += 1
 
         return status
+
+
+def _stage_shape(stage: Stage) -> str:
+    """Key for stages that run the same computation under a different name."""
+    return json.dumps(generalize_cmd(json.loads(stage.cmd)))
+
+
+def get_stage_durations(session: Session, stages: list[Stage]) -> dict[int, float]:
+    """Estimate the runtime of each stage in seconds from past jobs.
+
+    The estimate is the median duration of finished jobs of completed
+    stages with the same name. If there is no such job, stages with the
+    same generalized command (e.g. the same ZnTrack Node class) are used,
+    and as a last resort the median over all finished jobs.
+    Stages without any history are omitted.
+    """
+    statement = (
+        select(Stage.name, Stage.cmd, Job.started_at, Job.finished_at)
+        .join(Job, Job.stage_id == Stage.id)
+        .where(Stage.status == "completed")
+        .where(Job.finished_at != None)  # noqa: E711
+    )
+    by_name = defaultdict(list)
+    by_shape = defaultdict(list)
+    everything = []
+    for name, cmd, started_at, finished_at in session.exec(statement):
+        duration = (finished_at - started_at).total_seconds()
+        by_name[name].append(duration)
+        by_shape[json.dumps(generalize_cmd(json.loads(cmd)))].append(duration)
+        everything.append(duration)
+
+    durations = {}
+    for stage in stages:
+        if samples := by_name.get(stage.name):
+            durations[stage.id] = statistics.median(samples)
+        elif samples := by_shape.get(_stage_shape(stage)):
+            durations[stage.id] = statistics.median(samples)
+        elif everything:
+            durations[stage.id] = statistics.median(everything)
+    return durations
+
+
+def get_experiment_eta(db_url: str, experiment_id: int) -> dict:
+    """Estimate the remaining runtime of an experiment.
+
+    Returns the estimated remaining seconds, the total remaining work,
+    the critical path through the unfinished stages and the per-stage
+    estimates. The remaining time is bounded from below by the critical
+    path and by the remaining work divided over the online workers.
+    """
+    engine = get_engine(db_url)
+    with Session(engine) as session:
+        stages = session.exec(
+            select(Stage).where(Stage.experiment_id == experiment_id)
+        ).all()
+        edges = session.exec(
+            select(StageDependency.parent_id, StageDependency.child_id)
+            .join(Stage, Stage.id == StageDependency.child_id)
+            .where(Stage.experiment_id == experiment_id)
+        ).all()
+        running_jobs = session.exec(
+            select(Job.stage_id, Job.started_at)
+            .join(Stage, Stage.id == Job.stage_id)
+            .where(Stage.experiment_id == experiment_id)
+            .where(Stage.status == "running")
+            .where(Job.finished_at == None)  # noqa: E711
+        ).all()
+        n_workers = len(
+            session.exec(select(Worker.id).where(Worker.status != "offline")).all()
+        )
+        durations = get_stage_durations(session, stages)
+        now = _now(session)
+
+    started = dict(running_jobs)
+    remaining = {}
+    unknown = []
+    for stage in stages:
+        if stage.status in ["completed", "cached", "failed", "blocked"]:
+            remaining[stage.id] = 0.0
+        elif stage.id not in durations:
+            remaining[stage.id] = 0.0
+            unknown.append(stage.name)
+        elif stage.status == "running" and stage.id in started:
+            elapsed = (now - started[stage.id]).total_seconds()
+            remaining[stage.id] = max(durations[stage.id] - elapsed, 0.0)
+        else:
+            remaining[stage.id] = durations[stage.id]
+
+    graph = nx.DiGraph()
+    graph.add_nodes_from(remaining)
+    graph.add_edges_from(edges)
+    # longest path through the DAG, weighted by the remaining stage durations
+    finish = {}
+    previous = {}
+    for node in nx.topological_sort(graph):
+        parent = max(graph.predecessors(node), key=finish.get, default=None)
+        finish[node] = remaining[node] + finish.get(parent, 0.0)
+        previous[node] = parent
+    node = max(finish, key=finish.get, default=None)
+    path = []
+    while node is not None:
+        if remaining[node] > 0:
+            path.append(node)
+        node = previous[node]
+
+    names = {stage.id: stage.name for stage in stages}
+    work = sum(remaining.values())
+    critical_path = finish[path[0]] if path else 0.0
+    return {
+        "remaining": None if unknown else max(critical_path, work / max(n_workers, 1)),
+        "work": work,
+        "critical_path": [names[node] for node in reversed(path)],
+        "critical_path_duration": critical_path,
+        "workers": n_workers,
+        "unknown": unknown,
+        "estimates": {names[key]: value for key, value in durations.items()},
+    }
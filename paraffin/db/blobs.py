@@ -0,0 +1,112 @@
+"""Storage for lockfiles and captured logs.
+
+Lockfiles and logs can be large, so they are not stored in the `Stage` and
+`Job` rows that are queried by the scheduler. Instead, they are compressed and
+stored in the `Blob` table, keyed by the SHA-256 of their content. The rows
+only reference the hash, which also deduplicates identical lockfiles and logs.
+
+Blobs are compressed with zlib or, if the optional ``zstandard`` package is
+installed, logs are compressed with zstd. The codec is detected from the data
+when reading, but zstd compressed logs can only be read where ``zstandard``
+is installed.
+"""
+
+import hashlib
+import typing as t
+import zlib
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select
+
+from paraffin.db.models import Blob
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# zlib streams start with 0x78 and can not be confused with zstd frames
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def compress(raw: bytes, zstd: bool = False) -> bytes:
+    """Compress with zstd if requested and available, otherwise with zlib."""
+    if zstd and zstandard is not None:
+        return zstandard.ZstdCompressor().compress(raw)
+    return zlib.compress(raw)
+
+
+def decompress(data: bytes) -> bytes:
+    """Decompress data written by `compress`."""
+    if data.startswith(_ZSTD_MAGIC):
+        if zstandard is None:
+            raise ImportError(
+                "Reading zstd compressed logs requires the 'zstandard' package."
+                " Install it with 'pip install paraffin[zstd]'."
+            )
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def put_blob(session: Session, content: str, zstd: bool = False) -> str | None:
+    """Store the content and return its hash.
+
+    Parameters
+    ----------
+    session : Session
+        The session to add the blob to. The blob is committed with it.
+    content : str
+        The content to store.
+    zstd : bool
+        Compress with zstd if ``zstandard`` is installed. This is used for
+        logs, while lockfiles, which every worker must be able to read,
+        are always compressed with zlib.
+
+    Returns
+    -------
+    str | None
+        The hash of the content or None if the content is empty.
+    """
+    if not content:
+        return None
+    raw = content.encode()
+    key = hashlib.sha256(raw).hexdigest()
+    data = compress(raw, zstd=zstd)
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        # Identical content might be stored by another worker at the same time.
+        #  Updating the existing row locks it, so `paraffin gc` can not
+        #  delete it before this transaction is committed.
+        statement = postgresql.insert(Blob).values(hash=key, data=data)
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=[Blob.hash], set_={"hash": statement.excluded.hash}
+            )
+        )
+    elif dialect == "sqlite":
+        session.execute(
+            sqlite.insert(Blob).values(hash=key, data=data).on_conflict_do_nothing()
+        )
+    elif session.get(Blob, key) is None:
+        session.add(Blob(hash=key, data=data))
+    return key
+
+
+def _decode(blob: Blob) -> str:
+    return decompress(blob.data).decode()
+
+
+def get_blob(session: Session, key: str | None) -> str:
+    """Return the content stored under the hash or an empty string for None."""
+    if key is None:
+        return ""
+    return _decode(session.get_one(Blob, key))
+
+
+def get_blobs(session: Session, keys: t.Iterable[str | None]) -> dict[str, str]:
+    """Return the content stored under each of the hashes."""
+    keys = {key for key in keys if key is not None}
+    if not keys:
+        return {}
+    blobs = session.exec(select(Blob).where(Blob.hash.in_(keys))).all()
+    return {blob.hash: _decode(blob) for blob in blobs}
@@ -0,0 +1,301 @@
+"""Retention of old experiments and logs and reclaiming space in the database."""
+
+import datetime
+import gzip
+import json
+import logging
+import pathlib
+
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, delete, or_, select, text, union, update
+
+from paraffin.db.app import get_engine, keep_cache_entries
+from paraffin.db.blobs import get_blob
+from paraffin.db.models import (
+    Blob,
+    CacheEntry,
+    Experiment,
+    InFlight,
+    Job,
+    Stage,
+    StageDependency,
+    Worker,
+)
+
+log = logging.getLogger(__name__)
+
+
+def prune_logs(db_url: str, before: datetime.datetime, batch_size: int = 1000) -> int:
+    """Remove the logs of finished jobs of experiments created before a date.
+
+    The jobs are updated in batches, each in a short transaction,
+    so running workers are not blocked.
+
+    Returns
+    -------
+    int
+        The number of jobs whose logs were removed.
+    """
+    engine = get_engine(db_url)
+    pruned = 0
+    while True:
+        with Session(engine) as session:
+            ids = session.exec(
+                select(Job.id)
+                .join(Stage, Stage.id == Job.stage_id)
+                .join(Experiment, Experiment.id == Stage.experiment_id)
+                .where(Experiment.created_at < before)
+                .where(Job.finished_at.is_not(None))
+                .where(or_(Job.stdout_hash.is_not(None), Job.stderr_hash.is_not(None)))
+                .limit(batch_size)
+            ).all()
+            if not ids:
+                return pruned
+            session.execute(
+                update(Job)
+                .where(Job.id.in_(ids))
+                .values(stdout_hash=None, stderr_hash=None)
+            )
+            session.commit()
+            pruned += len(ids)
+
+
+def find_experiments(
+    db_url: str,
+    before: datetime.datetime | None = None,
+    origin: str | None = None,
+    commits: set[str] | None = None,
+) -> list[int]:
+    """Select experiments for archiving and deletion.
+
+    Parameters
+    ----------
+    db_url : str
+        The database URL.
+    before : datetime.datetime | None
+        Select experiments created before this date.
+    origin : str | None
+        The origin of the current repository, see ``commits``.
+    commits : set[str] | None
+        Select experiments of the given origin that are not based on
+        one of these commits, e.g. because the branch was deleted.
+
+    Returns
+    -------
+    list[int]
+        The ids of the selected experiments.
+    """
+    engine = get_engine(db_url)
+    with Session(engine) as session:
+        experiments = session.exec(select(Experiment)).all()
+    selected = []
+    for experiment in experiments:
+        if before is not None and experiment.created_at < before:
+            selected.append(experiment.id)
+        elif (
+            commits is not None
+            and experiment.origin == origin
+            and experiment.base not in commits
+        ):
+            selected.append(experiment.id)
+    return selected
+
+
+def _dump_stage(session: Session, stage: Stage) -> dict:
+    lock = get_blob(session, stage.lockfile_hash)
+    data = stage.model_dump(mode="json", exclude={"lockfile_hash"})
+    data["lock"] = json.loads(lock) if lock else None
+    data["parents"] = [parent.name for parent in stage.parents]
+    data["jobs"] = []
+    for job in stage.jobs:
+        job_data = job.model_dump(mode="json", exclude={"stdout_hash", "stderr_hash"})
+        job_data["stdout"] = get_blob(session, job.stdout_hash)
+        job_data["stderr"] = get_blob(session, job.stderr_hash)
+        job_data["worker"] = job.worker.model_dump(mode="json")
+        data["jobs"].append(job_data)
+    return data
+
+
+def archive_experiments(
+    db_url: str, experiment_ids: list[int], path: str | pathlib.Path
+) -> None:
+    """Append the experiments with their stages, jobs and logs to a file.
+
+    The file contains one JSON document per experiment and is compressed
+    with gzip, e.g. ``paraffin-archive.jsonl.gz``.
+    """
+    engine = get_engine(db_url)
+    with gzip.open(path, "at") as f:
+        for experiment_id in experiment_ids:
+            with Session(engine) as session:
+                experiment = session.get_one(Experiment, experiment_id)
+                data = experiment.model_dump(mode="json")
+                data["stages"] = [
+                    _dump_stage(session, stage) for stage in experiment.stages
+                ]
+            f.write(json.dumps(data) + "\n")
+
+
+def delete_experiments(
+    db_url: str, experiment_ids: list[int], batch_size: int = 1000
+) -> int:
+    """Delete experiments with their stages and jobs.
+
+    The stages are deleted in batches, each in a short transaction, so
+    running workers are not blocked. The stages that could still be
+    claimed are first marked as 'blocked' in a single transaction, so
+    workers do not run stages whose parents were already deleted.
+    Experiments with running stages are skipped. The lockfiles of
+    completed stages are kept for the paraffin cache.
+
+    Returns
+    -------
+    int
+        The number of deleted experiments.
+    """
+    engine = get_engine(db_url)
+    deleted = 0
+    for experiment_id in experiment_ids:
+        with Session(engine) as session:
+            # Writing first takes the database lock on SQLite and the
+            #  stages are locked on PostgreSQL, so workers can not claim
+            #  the stages meanwhile.
+            session.execute(
+                update(Experiment)
+                .where(Experiment.id == experiment_id)
+                .values(updated_at=datetime.datetime.now())
+            )
+            running = session.exec(
+                select(Stage.id)
+                .where(Stage.experiment_id == experiment_id)
+                .where(Stage.status == "running")
+            ).first()
+            if running is not None:
+                log.warning(f"Skipping experiment {experiment_id} with running stages.")
+                continue
+            session.execute(
+                update(Stage)
+                .where(Stage.experiment_id == experiment_id)
+                .where(or_(Stage.status == "pending", Stage.status == "cached"))
+                .values(status="blocked", unblocked_status=Stage.status)
+            )
+            session.commit()
+        while True:
+            with Session(engine) as session:
+                stages = session.exec(
+                    select(Stage)
+                    .where(Stage.experiment_id == experiment_id)
+                    .where(Stage.status != "running")
+                    .limit(batch_size)
+                    .with_for_update()
+                ).all()
+                if not stages:
+                    break
+                keep_cache_entries(session, stages)
+                ids = [stage.id for stage in stages]
+                session.execute(
+                    delete(StageDependency).where(
+                        or_(
+                            StageDependency.parent_id.in_(ids),
+                            StageDependency.child_id.in_(ids),
+                        )
+                    )
+                )
+                session.execute(delete(Job).where(Job.stage_id.in_(ids)))
+                session.execute(delete(InFlight).where(InFlight.stage_id.in_(ids)))
+                session.execute(delete(Stage).where(Stage.id.in_(ids)))
+                session.commit()
+        with Session(engine) as session:
+            remaining = session.exec(
+                select(Stage.id).where(Stage.experiment_id == experiment_id)
+            ).first()
+            if remaining is not None:
+                log.warning(f"Experiment {experiment_id} was started during deletion.")
+                continue
+            session.execute(delete(Experiment).where(Experiment.id == experiment_id))
+            session.commit()
+            deleted += 1
+    return deleted
+
+
+def delete_offline_workers(db_url: str, before: datetime.datetime) -> int:
+    """Delete offline workers last seen before a date without remaining jobs.
+
+    Returns
+    -------
+    int
+        The number of deleted workers.
+    """
+    engine = get_engine(db_url)
+    with Session(engine) as session:
+        result = session.execute(
+            delete(Worker)
+            .where(Worker.status == "offline")
+            .where(Worker.last_seen < before)
+            .where(Worker.id.not_in(select(Job.worker_id)))
+        )
+        session.commit()
+        return result.rowcount
+
+
+def delete_unused_blobs(db_url: str, batch_size: int = 1000) -> int:
+    """Delete blobs that are no longer referenced by any stage or job.
+
+    Returns
+    -------
+    int
+        The number of deleted blobs.
+    """
+    engine = get_engine(db_url)
+    used = union(
+        select(Stage.lockfile_hash).where(Stage.lockfile_hash.is_not(None)),
+        select(Job.stdout_hash).where(Job.stdout_hash.is_not(None)),
+        select(Job.stderr_hash).where(Job.stderr_hash.is_not(None)),
+        select(CacheEntry.lockfile_hash),
+    )
+    # the references are checked again when deleting, in case a worker
+    #  referenced one of the blobs after the batch was selected
+    batch = select(Blob.hash).where(Blob.hash.not_in(used)).limit(batch_size)
+    statement = delete(Blob).where(Blob.hash.in_(batch)).where(Blob.hash.not_in(used))
+    deleted = 0
+    while True:
+        with Session(engine) as session:
+            try:
+                result = session.execute(statement)
+                session.commit()
+            except IntegrityError:
+                # a worker referenced one of the blobs while it was deleted,
+                #  it will be excluded from the next batch.
+                session.rollback()
+                continue
+            if not result.rowcount:
+                return deleted
+            deleted += result.rowcount
+
+
+def vacuum(db_url: str, pages: int = 1000) -> None:
+    """Return the space of deleted rows to the file system or the database.
+
+    SQLite databases are shrunk incrementally by ``pages`` at a time,
+    so running workers are not locked out. Databases created
+    before incremental vacuum was enabled are rewritten once.
+    On PostgreSQL, a regular VACUUM is run, which does not lock the tables.
+    """
+    engine = get_engine(db_url)
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as connection:
+            if connection.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+                log.info("Enabling incremental vacuum, this rewrites the database.")
+                connection.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+                connection.execute(text("VACUUM"))
+                return
+            while connection.execute(text("PRAGMA freelist_count")).scalar():
+                # every returned row corresponds to one step of the vacuum
+                connection.execute(
+                    text(f"PRAGMA incremental_vacuum({pages})")
+                ).fetchall()
+                connection.commit()
+    elif engine.dialect.name == "postgresql":
+        with engine.connect() as connection:
+            connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+            connection.execute(text("VACUUM ANALYZE blob, job"))
@@ -0,0 +1,125 @@
+"""Schema migrations for databases created by older versions of paraffin.
+
+New databases are created from the models in `paraffin.db.models` and marked
+as up to date. For existing databases, every migration in `MIGRATIONS` that
+has not been applied yet is run in order. To change the schema, update the
+models and append a migration that brings an existing database to the same
+state.
+"""
+
+import logging
+import typing as t
+
+from sqlalchemy import Connection, Engine, inspect, select, text
+from sqlmodel import Session, SQLModel
+
+from paraffin.db.blobs import put_blob
+from paraffin.db.models import SchemaVersion
+
+log = logging.getLogger(__name__)
+
+# arbitrary key for the PostgreSQL advisory lock held during migrations
+_LOCK_KEY = 72351
+
+
+def _add_indexes(connection: Connection) -> None:
+    """Create the indexes of the models that are missing in the database."""
+    inspector = inspect(connection)
+    for table in SQLModel.metadata.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for index in table.indexes:
+            # columns added by later migrations create their own indexes
+            if {column.name for column in index.columns} <= columns:
+                index.create(connection, checkfirst=True)
+
+
+def _drop_length_limits(connection: Connection) -> None:
+    """Remove the length limit of `stage.cmd` and `worker.cwd`."""
+    if connection.dialect.name == "postgresql":
+        # SQLite does not enforce the length of VARCHAR columns
+        connection.execute(text("ALTER TABLE stage ALTER COLUMN cmd TYPE VARCHAR"))
+        connection.execute(text("ALTER TABLE worker ALTER COLUMN cwd TYPE VARCHAR"))
+
+
+def _move_to_blobs(connection: Connection) -> None:
+    """Move lockfiles and logs into the blob table."""
+    session = Session(bind=connection)
+    columns = {
+        "stage": {"lockfile_content": "lockfile_hash"},
+        "job": {"stdout": "stdout_hash", "stderr": "stderr_hash"},
+    }
+    for table, renamed in columns.items():
+        for old, new in renamed.items():
+            connection.execute(
+                text(f"ALTER TABLE {table} ADD COLUMN {new} VARCHAR REFERENCES blob")
+            )
+            last_id = 0
+            # in batches, the content of all rows might not fit into memory
+            while rows := connection.execute(
+                text(
+                    f"SELECT id, {old} FROM {table} WHERE id > :last_id"
+                    f" AND {old} != '' ORDER BY id LIMIT 1000"
+                ),
+                {"last_id": last_id},
+            ).all():
+                for row_id, content in rows:
+                    connection.execute(
+                        text(f"UPDATE {table} SET {new} = :key WHERE id = :id"),
+                        {"key": put_blob(session, content), "id": row_id},
+                    )
+                last_id = rows[-1][0]
+            connection.execute(text(f"ALTER TABLE {table} DROP COLUMN {old}"))
+
+
+def _add_capture_limit(connection: Connection) -> None:
+    """Add the `stage.capture_limit` column."""
+    connection.execute(text("ALTER TABLE stage ADD COLUMN capture_limit INTEGER"))
+
+
+def _add_chain_id(connection: Connection) -> None:
+    """Add the `stage.chain_id` column."""
+    connection.execute(text("ALTER TABLE stage ADD COLUMN chain_id INTEGER"))
+    _add_indexes(connection)
+
+
+def _add_unblocked_status(connection: Connection) -> None:
+    """Add the `stage.unblocked_status` column."""
+    connection.execute(text("ALTER TABLE stage ADD COLUMN unblocked_status VARCHAR"))
+
+
+MIGRATIONS: list[t.Callable[[Connection], None]] = [
+    _add_indexes,
+    _drop_length_limits,
+    _move_to_blobs,
+    _add_capture_limit,
+    _add_chain_id,
+    _add_unblocked_status,
+]
+
+
+def get_version(connection: Connection) -> int:
+    """Return the number of migrations applied to the database."""
+    version = connection.execute(select(SchemaVersion.version)).scalar()
+    return version or 0
+
+
+def migrate(engine: Engine) -> None:
+    """Create the tables and apply all pending migrations."""
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            # many workers might start at the same time
+            connection.execute(text(f"SELECT pg_advisory_xact_lock({_LOCK_KEY})"))
+        is_new = not inspect(connection).has_table("stage")
+        if is_new and connection.dialect.name == "sqlite":
+            # allows `paraffin gc` to free space without rewriting the database
+            connection.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+        SQLModel.metadata.create_all(connection)
+        version = len(MIGRATIONS) if is_new else get_version(connection)
+        for migration in MIGRATIONS[version:]:
+            log.info(f"Migrating database: {migration.__doc__}")
+            migration(connection)
+        if is_new or version < len(MIGRATIONS):
+            connection.execute(SchemaVersion.__table__.delete())
+            connection.execute(
+                SchemaVersion.__table__.insert().values(version=len(MIGRATIONS))
+            )
@@ -1,7 +1,43 @@
 from datetime import datetime
 from typing import List, Literal, Optional
 
-from sqlmodel import Field, Relationship, SQLModel, String, UniqueConstraint
+from sqlmodel import (
+    Field,
+    LargeBinary,
+    Relationship,
+    SQLModel,
+    String,
+    UniqueConstraint,
+)
+
+
+class SchemaVersion(SQLModel, table=True):
+    """The migrations in `paraffin.db.migrations` applied to this database."""
+
+    id: int = Field(default=1, primary_key=True)
+    version: int = Field(default=0)
+
+
+class Blob(SQLModel, table=True):
+    """Compressed lockfiles and logs, addressed by the SHA-256 of the content."""
+
+    hash: str = Field(primary_key=True, max_length=64)
+    data: bytes = Field(sa_type=LargeBinary)
+
+
+class CacheEntry(SQLModel, table=True):
+    """Lockfiles of deleted stages that are still used by the paraffin cache."""
+
+    dependency_hash: str = Field(primary_key=True)
+    lockfile_hash: str = Field(foreign_key="blob.hash")
+
+
+class InFlight(SQLModel, table=True):
+    """Dependency hashes of running stages, see `paraffin.db.claim_dependency_hash`."""
+
+    dependency_hash: str = Field(primary_key=True)
+    stage_id: int = Field(foreign_key="stage.id", index=True)
+    created_at: datetime = Field(default_factory=datetime.now)
 
 
 class Worker(SQLModel, table=True):
@@ -12,7 +48,7 @@ class Worker(SQLModel, table=True):
         sa_type=String, default="idle", index=True
     )
     last_seen: datetime = Field(default_factory=datetime.now)
-    cwd: str = Field(default="", max_length=255)  # Current working directory
+    cwd: str = Field(default="")  # Current working directory
     pid: int = Field(default=0)  # Process ID
     started_at: datetime = Field(default_factory=datetime.now)
     finished_at: Optional[datetime] = None
@@ -23,7 +59,8 @@ class Worker(SQLModel, table=True):
 
 class StageDependency(SQLModel, table=True):
     parent_id: int = Field(foreign_key="stage.id", primary_key=True)
-    child_id: int = Field(foreign_key="stage.id", primary_key=True)
+    # parent_id is covered by the primary key index
+    child_id: int = Field(foreign_key="stage.id", primary_key=True, index=True)
 
     # Unique constraint to prevent duplicate dependencies
     __table_args__ = (
@@ -33,7 +70,7 @@ class StageDependency(SQLModel, table=True):
 
 class Experiment(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    base: str = Field()
+    base: str = Field(index=True)
     origin: str = Field(default="local")
     machine: str = Field(default="local")
     created_at: datetime = Field(default_factory=datetime.now)
@@ -45,10 +82,11 @@ class Experiment(SQLModel, table=True):
 
 class Job(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    stage_id: int = Field(foreign_key="stage.id")
-    worker_id: int = Field(foreign_key="worker.id")
-    stderr: str = Field(default="")
-    stdout: str = Field(default="")
+    stage_id: int = Field(foreign_key="stage.id", index=True)
+    worker_id: int = Field(foreign_key="worker.id", index=True)
+    # Captured output, see `paraffin.db.blobs`
+    stderr_hash: Optional[str] = Field(default=None, foreign_key="blob.hash")
+    stdout_hash: Optional[str] = Field(default=None, foreign_key="blob.hash")
     started_at: datetime = Field(default_factory=datetime.now)
     finished_at: Optional[datetime] = None
 
@@ -59,22 +97,31 @@ class Job(SQLModel, table=True):
 
 class Stage(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    name: str = Field(max_length=100)
-    cmd: str = Field(max_length=255)  # Command to execute
-    status: Literal["pending", "running", "completed", "cached", "failed"] = Field(
-        sa_type=String, default="pending"
-    )
-    queue: str = Field(default="default", max_length=100)
-    lockfile_content: str = Field(default="")  # JSON string of lockfile
-    dependency_hash: str = Field(default="")  # Hash of the dependencies
-    experiment_id: int = Field(foreign_key="experiment.id")
+    name: str = Field(max_length=100, index=True)
+    cmd: str = Field()  # Command to execute
+    # stages with a failed ancestor are "blocked", see `paraffin.db.app._update_blocked`
+    status: Literal[
+        "pending", "running", "completed", "cached", "failed", "blocked"
+    ] = Field(sa_type=String, default="pending", index=True)
+    # the status of a blocked stage before it was blocked
+    unblocked_status: Optional[str] = Field(default=None, sa_type=String)
+    queue: str = Field(default="default", max_length=100, index=True)
+    # JSON string of the lockfile, see `paraffin.db.blobs`
+    lockfile_hash: Optional[str] = Field(default=None, foreign_key="blob.hash")
+    # Hash of the dependencies
+    dependency_hash: str = Field(default="", index=True)
+    experiment_id: int = Field(foreign_key="experiment.id", index=True)
     capture_stderr: bool = Field(default=True)
     capture_stdout: bool = Field(default=True)
+    # Maximum number of characters kept from the end of stdout / stderr
+    capture_limit: Optional[int] = Field(default=None)
     started_at: Optional[datetime] = None
     finished_at: Optional[datetime] = None
     cache: bool = Field(default=False)  # Use the paraffin cache for this job
     force: bool = Field(default=False)  # Rerun the job even if cached
     max_workers: int = Field(default=1)  # Maximum number of workers for this job
+    # id of the first stage of a linear chain, see `paraffin.db.save_graph_to_db`
+    chain_id: Optional[int] = Field(default=None, index=True)
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
 
@@ -100,6 +147,7 @@ class Stage(SQLModel, table=True):
 
     def attach_job(self, worker: Worker) -> Job:
         self.status = "running"
+        self.started_at = datetime.now()
         job = Job(stage_id=self.id, worker_id=worker.id)
         self.jobs.append(job)
         return job
@@ -0,0 +1,224 @@
+"""Backends that execute the stages claimed by a paraffin worker."""
+
+import abc
+import asyncio
+import dataclasses
+import fnmatch
+import random
+import threading
+import time
+import typing as t
+
+from dvc.lock import LockError
+from dvc.stage.cache import _get_cache_hash
+
+from paraffin.lock import clean_lock
+from paraffin.stage import (
+    checkout,
+    get_lock,
+    prefetch,
+    read_lock,
+    repro,
+    repro_async,
+    retry,
+)
+
+if t.TYPE_CHECKING:
+    from paraffin.forkserver import ForkServer
+
+
+@dataclasses.dataclass(frozen=True)
+class SimulatedStage:
+    """Stand-in for `paraffin.stage.PipelineStageDC` without a DVC repository.
+
+    A graph of these can be passed to `paraffin.db.save_graph_to_db` to
+    submit a pipeline for the `SimulatedExecutor`.
+    """
+
+    name: str
+    cmd: str = "true"
+    changed: bool = True
+    force: bool = False
+
+
+class Executor(abc.ABC):
+    """Interface between the paraffin worker and the pipeline tool.
+
+    The worker only interacts with the DVC repository through these methods,
+    so they can be replaced, e.g. to simulate a pipeline.
+    """
+
+    @abc.abstractmethod
+    def repro(self, name: str, force: bool) -> tuple[int, str, str]:
+        """Reproduce a stage and return the return code, stdout, and stderr."""
+
+    async def repro_async(self, name: str, force: bool) -> tuple[int, str, str]:
+        """Reproduce a stage in the event loop of `paraffin.aio.run_workers`.
+
+        Defaults to running `repro` in a thread.
+        """
+        return await asyncio.to_thread(self.repro, name, force)
+
+    @abc.abstractmethod
+    def checkout(
+        self, stage_lock: dict, cached_job_lock_json: str, name: str
+    ) -> tuple[int, str, str]:
+        """Checkout the outputs of a stage from the lock of a cached job."""
+
+    def prefetch(self, name: str, lock_json: str) -> tuple[int, str, str]:
+        """Checkout the outputs of a stage that was run in another clone.
+
+        Defaults to doing nothing, e.g. if all workers share one clone.
+        """
+        return 0, "", ""
+
+    @abc.abstractmethod
+    def get_lock(self, name: str) -> tuple[dict, str]:
+        """Return the lock of a stage and the hash of its dependencies."""
+
+    def read_lock(self, name: str) -> tuple[dict, str]:
+        """Return the lock of a stage after it was reproduced or checked out.
+
+        Defaults to `get_lock`, backends can avoid hashing the outputs again.
+        """
+        return self.get_lock(name)
+
+
+class DVCExecutor(Executor):
+    """Run the stages with DVC in the current working directory."""
+
+    def repro(self, name: str, force: bool) -> tuple[int, str, str]:
+        return repro(name, force=force)
+
+    async def repro_async(self, name: str, force: bool) -> tuple[int, str, str]:
+        return await repro_async(name, force=force)
+
+    def checkout(
+        self, stage_lock: dict, cached_job_lock_json: str, name: str
+    ) -> tuple[int, str, str]:
+        return checkout(stage_lock, cached_job_lock_json, name)
+
+    def prefetch(self, name: str, lock_json: str) -> tuple[int, str, str]:
+        return prefetch(name, lock_json)
+
+    def get_lock(self, name: str) -> tuple[dict, str]:
+        return get_lock(name)
+
+    def read_lock(self, name: str) -> tuple[dict, str]:
+        return read_lock(name)
+
+
+class ForkServerExecutor(DVCExecutor):
+    """Reproduce the stages in forks of a warmed up server.
+
+    The modules of all ZnTrack nodes in the pipeline are imported once,
+    see `paraffin.forkserver`.
+    """
+
+    def __init__(self):
+        self._server = None
+        self._lock = threading.Lock()
+
+    def _get_server(self) -> "ForkServer":
+        with self._lock:
+            if self._server is None:
+                from paraffin.forkserver import ForkServer, get_node_modules
+                from paraffin.utils import _load_pipeline
+
+                cmds = [cmd for _, cmd in _load_pipeline().nodes(data="cmd")]
+                self._server = ForkServer(get_node_modules(cmds))
+        return self._server
+
+    def repro(self, name: str, force: bool) -> tuple[int, str, str]:
+        return repro(name, force=force, runner=self._get_server().run)
+
+    async def repro_async(self, name: str, force: bool) -> tuple[int, str, str]:
+        server = await asyncio.to_thread(self._get_server)
+        return await repro_async(name, force=force, runner=server.run_async)
+
+
+@dataclasses.dataclass
+class SimulatedExecutor(Executor):
+    """Pretend to run stages without a DVC repository.
+
+    This is meant for testing and load testing the scheduler.
+
+    Attributes
+    ----------
+    duration : float
+        The time in seconds every stage takes to run.
+    durations : dict[str, float]
+        Durations for stages matching the given glob patterns.
+    failure_rate : float
+        Probability for a stage to fail.
+    fail : list[str]
+        Glob patterns of stages that always fail.
+    lock_time : float
+        The time in seconds `get_lock`, `checkout` and `prefetch` hold a lock
+        that is shared between all threads, like the DVC repository lock.
+    lock_error_rate : float
+        Probability for these methods to raise a LockError
+        which is retried, similar to a lock held by another process.
+    seed : int | None
+        Seed for the random number generator.
+    """
+
+    duration: float = 0.0
+    durations: dict[str, float] = dataclasses.field(default_factory=dict)
+    failure_rate: float = 0.0
+    fail: list[str] = dataclasses.field(default_factory=list)
+    lock_time: float = 0.0
+    lock_error_rate: float = 0.0
+    seed: int | None = None
+
+    def __post_init__(self):
+        self._random = random.Random(self.seed)
+        self._lock = threading.Lock()
+        # the names of the prefetched stages, in order
+        self.prefetched = []
+
+    def _get_duration(self, name: str) -> float:
+        for pattern, duration in self.durations.items():
+            if fnmatch.fnmatch(name, pattern):
+                return duration
+        return self.duration
+
+    def _acquire_lock(self, name: str) -> None:
+        if self._random.random() < self.lock_error_rate:
+            raise LockError(f"Unable to acquire lock for {name}")
+        with self._lock:
+            time.sleep(self.lock_time)
+
+    def _result(self, name: str) -> tuple[int, str, str]:
+        if any(fnmatch.fnmatch(name, pattern) for pattern in self.fail) or (
+            self._random.random() < self.failure_rate
+        ):
+            return 1, "", f"ERROR: failed to reproduce '{name}': simulated failure\n"
+        return 0, f"Running stage '{name}'\n", ""
+
+    def repro(self, name: str, force: bool) -> tuple[int, str, str]:
+        time.sleep(self._get_duration(name))
+        return self._result(name)
+
+    async def repro_async(self, name: str, force: bool) -> tuple[int, str, str]:
+        await asyncio.sleep(self._get_duration(name))
+        return self._result(name)
+
+    @retry(10, (LockError,), delay=0.01)
+    def checkout(
+        self, stage_lock: dict, cached_job_lock_json: str, name: str
+    ) -> tuple[int, str, str]:
+        self._acquire_lock(name)
+        return 0, f"Checking out stage '{name}'\n", ""
+
+    @retry(10, (LockError,), delay=0.01)
+    def prefetch(self, name: str, lock_json: str) -> tuple[int, str, str]:
+        self._acquire_lock(name)
+        self.prefetched.append(name)
+        return 0, f"Prefetching stage '{name}'\n", ""
+
+    @retry(10, (LockError,), delay=0.01)
+    def get_lock(self, name: str) -> tuple[dict, str]:
+        self._acquire_lock(name)
+        stage_lock = {"cmd": name, "deps": [], "outs": []}
+        return stage_lock, _get_cache_hash(clean_lock(stage_lock), key=False)
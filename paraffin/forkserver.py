@@ -0,0 +1,160 @@
+"""Run DVC stages in processes forked from a warmed up server.
+
+Every `dvc repro` and `zntrack run` subprocess pays for starting Python and
+importing DVC, ZnTrack and the packages of the nodes, which can take longer
+than small stages themselves. With `ForkServer`, these modules are imported
+once into a `multiprocessing` fork server. Every stage is reproduced in a
+fork of it by running `dvc repro` in-process, and ZnTrack stage commands
+are run in the same process instead of a shell.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import shlex
+import sys
+import tempfile
+import traceback
+
+from paraffin.utils import detect_zntrack
+
+# imported by the fork server in addition to the modules of the ZnTrack nodes
+PRELOAD = ["dvc.cli", "dvc.repo", "zntrack", "paraffin.forkserver"]
+
+
+def get_node_modules(cmds: list) -> list[str]:
+    """Return the modules of the nodes run by `zntrack run` commands."""
+    modules = []
+    for cmd in cmds:
+        if not isinstance(cmd, str) or not detect_zntrack({"cmd": cmd}):
+            continue
+        args = shlex.split(cmd)
+        if args[:2] == ["zntrack", "run"] and len(args) > 2 and "." in args[2]:
+            module = args[2].rsplit(".", 1)[0]
+            if module not in modules:
+                modules.append(module)
+    return modules
+
+
+def _run_zntrack(original):
+    """Wrap `dvc.stage.run._run` to run ZnTrack nodes in-process."""
+    from dvc.stage.exceptions import StageCmdFailedError
+
+    def _run(executable, cmd, **kwargs):
+        args = shlex.split(cmd)
+        if args[:2] != ["zntrack", "run"]:
+            return original(executable, cmd, **kwargs)
+        import zntrack.cli
+
+        cwd = os.getcwd()
+        environ = dict(os.environ)
+        os.chdir(kwargs["cwd"])
+        os.environ.update(kwargs["env"])
+        try:
+            zntrack.cli.app(args[1:], standalone_mode=False)
+        except Exception as err:
+            traceback.print_exc()
+            raise StageCmdFailedError(cmd, 1) from err
+        finally:
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(environ)
+
+    return _run
+
+
+def _repro(args: list[str], stdout: str, stderr: str) -> None:
+    """Run `dvc` with the arguments, writing its output to the files."""
+    for fd, path in ((1, stdout), (2, stderr)):
+        file = os.open(path, os.O_WRONLY | os.O_TRUNC)
+        os.dup2(file, fd)
+        os.close(file)
+
+    import dvc.cli
+    import dvc.stage.run
+
+    dvc.stage.run._run = _run_zntrack(dvc.stage.run._run)
+    try:
+        code = dvc.cli.main(args)
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    sys.exit(code)
+
+
+class ForkServer:
+    """Reproduce stages in forks of a server with the modules preloaded.
+
+    The server is started on the first call, importing the modules given
+    to the constructor in addition to `PRELOAD`.
+    """
+
+    def __init__(self, modules: list[str]):
+        self.modules = modules
+        self._context = None
+
+    def _get_context(self):
+        if self._context is None:
+            # like `zntrack run`, the nodes are imported from the repository
+            if os.getcwd() not in sys.path:
+                sys.path.append(os.getcwd())
+            self._context = multiprocessing.get_context("forkserver")
+            self._context.set_forkserver_preload(PRELOAD + self.modules)
+        return self._context
+
+    def _start(self, command: list[str], tmp: str):
+        """Start a `dvc` command in a fork, writing its output to ``tmp``."""
+        if command[0] != "dvc":
+            raise ValueError(f"Only 'dvc' commands can be run, got {command}.")
+        args = command[1:]
+        context = self._get_context()
+        paths = [os.path.join(tmp, name) for name in ("stdout", "stderr")]
+        for path in paths:
+            open(path, "w").close()
+        process = context.Process(target=_repro, args=(args, *paths))
+        process.start()
+        return process, paths
+
+    @staticmethod
+    def _result(process, paths: list[str]) -> tuple[int, str, str]:
+        with open(paths[0]) as f:
+            stdout = f.read()
+        with open(paths[1]) as f:
+            stderr = f.read()
+        print(stdout, end="")
+        print(stderr, end="")
+        return process.exitcode, stdout, stderr
+
+    def run(self, command: list[str]) -> tuple[int, str, str]:
+        """Run a `dvc` command like `paraffin.stage.run_command`.
+
+        The output is printed once the command finished.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            process, paths = self._start(command, tmp)
+            process.join()
+            return self._result(process, paths)
+
+    async def run_async(self, command: list[str]) -> tuple[int, str, str]:
+        """Run a `dvc` command like `run` without blocking the event loop.
+
+        The fork is awaited through its sentinel, so no thread is held while
+        it runs. The fork is killed if the task is cancelled.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            # the first fork starts the server, which imports the modules
+            process, paths = await asyncio.to_thread(self._start, command, tmp)
+            loop = asyncio.get_running_loop()
+            exited = loop.create_future()
+            loop.add_reader(
+                process.sentinel, lambda: exited.done() or exited.set_result(None)
+            )
+            try:
+                await exited
+            except asyncio.CancelledError:
+                process.kill()
+                raise
+            finally:
+                loop.remove_reader(process.sentinel)
+                process.join()
+            return self._result(process, paths)
@@ -11,6 +11,20 @@ def _extract_node_name(cmd: str) -> str | None:
     return node_name_match.group(1) if node_name_match else None
 
 
+def generalize_cmd(cmd: str | list[str]) -> str | list[str]:
+    """Replace the node name in a ZnTrack command with `<node-name>`.
+
+    Commands that do not contain a node name are returned unchanged.
+    """
+    cmd_str = " ".join(cmd) if isinstance(cmd, list) else cmd
+    node_name = _extract_node_name(cmd_str)
+    if not node_name:
+        return cmd
+    # TODO: what if the list has more than one element?!
+    generalized_cmd = cmd_str.replace(f"--name {node_name}", "--name <node-name>")
+    return [generalized_cmd] if isinstance(cmd, list) else generalized_cmd
+
+
 def _process_params(params: dict, node_name: str | None) -> dict:
     """Generalize the `params` field by replacing the node name with `<node-name>`."""
     generalized_params = {}
@@ -52,15 +66,9 @@ def clean_lock(raw: dict) -> dict:
     # Extract the node name from the `cmd`
     cmd_str = " ".join(raw["cmd"]) if isinstance(raw["cmd"], list) else raw["cmd"]
     node_name = _extract_node_name(cmd_str)
-
     # Generalize `cmd`: replace the extracted node name with `<node-name>`
     #  This only applies to ZnTrack commands.
-    if node_name:
-        # TODO: what if the list has more than one element?!
-        generalized_cmd = cmd_str.replace(f"--name {node_name}", "--name <node-name>")
-        exp["cmd"] = (
-            [generalized_cmd] if isinstance(raw["cmd"], list) else generalized_cmd
-        )
+    exp["cmd"] = generalize_cmd(raw["cmd"])
 
     # Generalize `params` if present
     if "params" in exp:
@@ -0,0 +1,303 @@
+"""Worker that overlaps the bookkeeping of stages with running them.
+
+`paraffin.cli.spawn_worker` claims a stage, looks it up in the paraffin cache,
+runs it, reads its lock and stores the result one after the other. For
+pipelines of many short stages, these steps can take as long as the stages
+themselves. `spawn_pipelined_worker` claims and prepares the next stage in
+one thread while the current stage runs and stores the results of finished
+stages in another.
+"""
+
+import collections
+import datetime
+import logging
+import os
+import socket
+import threading
+import typing as t
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from paraffin.cli import MAX_WAIT, execute_job, finish_job, prepare_job
+from paraffin.db import (
+    can_make_progress,
+    close_worker,
+    complete_job,
+    get_job,
+    get_next_in_chain,
+    has_spare_stages,
+    register_worker,
+    update_worker,
+    wait_for_jobs,
+)
+from paraffin.profiling import WorkerProfiler, profile
+
+if t.TYPE_CHECKING:
+    from paraffin.db.models import Job, Stage
+    from paraffin.executor import Executor
+    from paraffin.prefetch import Prefetcher
+
+log = logging.getLogger(__name__)
+
+# a claimed stage, its job, the result of `prepare_job` and of a failed prefetch
+Claim = tuple[
+    "Stage", "Job", tuple[dict | None, str | None], tuple[int, str, str] | None
+]
+
+# returned by `_Worker._claim_ahead` if the next stage of a chain is held instead
+_SKIPPED = object()
+
+
+class _Worker:
+    """A pipelined worker, see `spawn_pipelined_worker`.
+
+    Stages are claimed and prepared by the ``claimer`` thread and their
+    results are stored by the ``bookkeeper`` thread, while the thread of
+    the worker runs them.
+    """
+
+    def __init__(
+        self,
+        worker_id: int,
+        db: str,
+        executor: "Executor",
+        prefetcher: "Prefetcher | None",
+        filters: dict,
+        affinity: bool,
+        locality_wait: float | None,
+        workers: dict,
+    ):
+        self.worker_id = worker_id
+        self.db = db
+        self.executor = executor
+        self.prefetcher = prefetcher
+        self.filters = filters
+        self.affinity = affinity
+        self.locality_wait = locality_wait
+        self.workers = workers
+        # the stages that were claimed and whose results are not stored yet,
+        #  changed by all threads and published to ``workers`` as snapshots
+        self.claimed: set[int] = set()
+        self._claimed_lock = threading.Lock()
+        # the next stages of the chains of finished stages, being prepared
+        self.chained: collections.deque[Future] = collections.deque()
+        self.claimer = ThreadPoolExecutor(
+            1, thread_name_prefix=f"paraffin-claim-{worker_id}"
+        )
+        self.bookkeeper = ThreadPoolExecutor(
+            1, thread_name_prefix=f"paraffin-bookkeeping-{worker_id}"
+        )
+        self.ahead: Future | None = None
+        # only one of a stage claimed ahead and a chained stage is held
+        self._ahead_lock = threading.Lock()
+        self.held_ahead = False
+        # set while the worker does not run a stage
+        self.idle = threading.Event()
+        self.idle.set()
+        self.finishing: list[Future] = []
+        self.running = False
+        self._update_claimed()
+
+    def _update_claimed(
+        self, add: int | None = None, discard: int | None = None
+    ) -> None:
+        """Change the claimed stages and publish a snapshot to ``workers``."""
+        with self._claimed_lock:
+            if add is not None:
+                self.claimed.add(add)
+            if discard is not None:
+                self.claimed.discard(discard)
+            self.workers[self.worker_id] = frozenset(self.claimed)
+
+    def _prepare(self, job_obj: tuple["Stage", "Job"] | None) -> Claim | None:
+        if job_obj is None:
+            return None
+        stage, job = job_obj
+        self._update_claimed(add=stage.id)
+        if self.prefetcher is not None:
+            failure = self.prefetcher.wait(stage.id)
+            if failure is not None:
+                return stage, job, (None, None), failure
+        prepared = prepare_job(stage, db=self.db, executor=self.executor)
+        return stage, job, prepared, None
+
+    def _get_job(self) -> tuple["Stage", "Job"] | None:
+        return get_job(
+            db_url=self.db,
+            worker_id=self.worker_id,
+            affinity=self.affinity,
+            locality_wait=self.locality_wait,
+            **self.filters,
+        )
+
+    def _claim(self) -> Claim | None:
+        return self._prepare(self._get_job())
+
+    def _claim_ahead(self) -> Claim | object | None:
+        # a stage claimed ahead waits for the running stage, so it is only
+        #  claimed before that finishes if no idle worker could run it now
+        if not has_spare_stages(db_url=self.db, **self.filters):
+            self.idle.wait()
+        with self._ahead_lock:
+            # the bookkeeper might have continued a chain meanwhile
+            if self.chained:
+                return _SKIPPED
+            job_obj = self._get_job()
+            self.held_ahead = job_obj is not None
+        return self._prepare(job_obj)
+
+    def _finish(self, stage: "Stage", result: tuple[int, str, str]) -> None:
+        finish_job(
+            stage, result, worker_id=self.worker_id, db=self.db, executor=self.executor
+        )
+        self._update_claimed(discard=stage.id)
+        with self._ahead_lock:
+            # the chain is left to polling if a stage was claimed ahead
+            if self.held_ahead:
+                return
+            # like `paraffin.cli.spawn_worker`, chains are run without polling
+            job_obj = get_next_in_chain(
+                db_url=self.db,
+                stage_id=stage.id,
+                worker_id=self.worker_id,
+                **self.filters,
+            )
+            if job_obj is not None:
+                self._update_claimed(add=job_obj[0].id)
+                self.chained.append(self.claimer.submit(self._prepare, job_obj))
+
+    def next_claim(self) -> Claim | None:
+        """Return the next claimed stage or None if no stage is ready."""
+        if self.chained:
+            return self.chained.popleft().result()
+        if self.ahead is None:
+            self.ahead = self.claimer.submit(self._claim)
+        claim, self.ahead = self.ahead.result(), None
+        with self._ahead_lock:
+            self.held_ahead = False
+        if claim is _SKIPPED:
+            claim = self.claimer.submit(self._claim).result()
+        return claim
+
+    def run(self, claim: Claim, profiler: WorkerProfiler | None) -> None:
+        """Run a claimed stage while the next one is claimed."""
+        stage, job, (stage_lock, cached_lock), result = claim
+        if not self.running:
+            update_worker(self.worker_id, status="running", db_url=self.db)
+            self.running = True
+        self.idle.clear()
+        if not self.chained and self.ahead is None:
+            self.ahead = self.claimer.submit(self._claim_ahead)
+        try:
+            if result is None:
+                with profile(profiler, f"job-{job.id}-{stage.name}"):
+                    result = execute_job(
+                        stage, stage_lock, cached_lock, executor=self.executor
+                    )
+        finally:
+            self.idle.set()
+        self.finishing.append(self.bookkeeper.submit(self._finish, stage, result))
+        while self.finishing and self.finishing[0].done():
+            self.finishing.pop(0).result()
+
+    def flush(self) -> bool:
+        """Wait until the results are stored and return if there were any."""
+        flushed = bool(self.finishing)
+        while self.finishing:
+            self.finishing.pop(0).result()
+        return flushed
+
+    def set_idle(self) -> None:
+        if self.running:
+            update_worker(self.worker_id, status="idle", db_url=self.db)
+            self.running = False
+
+    def close(self) -> None:
+        """Store the pending results and mark the other claimed stages as failed."""
+        self.idle.set()
+        self.bookkeeper.shutdown()
+        self.claimer.shutdown(cancel_futures=True)
+        with self._claimed_lock:
+            claimed = list(self.claimed)
+        for stage_id in claimed:
+            complete_job(
+                stage_id=stage_id,
+                status="failed",
+                lock={},
+                stdout="",
+                stderr="Worker exited.",
+                db_url=self.db,
+                worker_id=self.worker_id,
+            )
+        close_worker(id=self.worker_id, db_url=self.db)
+
+
+def spawn_pipelined_worker(
+    name: str,
+    queues: list[str],
+    experiment: str | None,
+    stage_name: str | None,
+    timeout: float,
+    db: str,
+    workers: dict,
+    profiler: WorkerProfiler | None = None,
+    executor: "Executor | None" = None,
+    affinity: bool = False,
+    locality_wait: float | None = None,
+    prefetcher: "Prefetcher | None" = None,
+    max_wait: float = MAX_WAIT,
+) -> None:
+    """Run stages like `paraffin.cli.spawn_worker`, overlapping their bookkeeping.
+
+    While a stage runs, the next ready stage is already claimed if more
+    stages are ready than workers are idle, otherwise once the stage
+    finished. Every worker holds up to one stage more than it runs. The
+    arguments are the same as for `paraffin.cli.spawn_worker`. The value
+    of the worker in ``workers`` is a frozenset of its claimed stages.
+    """
+    if executor is None:
+        from paraffin.executor import DVCExecutor
+
+        executor = DVCExecutor()
+    worker_id = register_worker(
+        name=name,
+        machine=socket.gethostname(),
+        db_url=db,
+        cwd=os.getcwd(),
+        pid=os.getpid(),
+    )
+    filters = {"queues": queues, "experiment": experiment, "stage_name": stage_name}
+    worker = _Worker(
+        worker_id, db, executor, prefetcher, filters, affinity, locality_wait, workers
+    )
+    log.info(f"Listening on queues: {queues}")
+
+    last_seen = datetime.datetime.now()
+    drained_since = None
+    try:
+        while True:
+            claim = worker.next_claim()
+            if claim is not None:
+                last_seen = datetime.datetime.now()
+                drained_since = None
+                worker.run(claim, profiler)
+                continue
+            if worker.flush():
+                # the stored results might have made new stages ready
+                continue
+            worker.set_idle()
+            if (datetime.datetime.now() - last_seen).total_seconds() >= max_wait:
+                log.info(f"No stage claimed for {max_wait} seconds - exiting.")
+                break
+            if can_make_progress(db_url=db, **filters):
+                drained_since = None
+                wait_for_jobs(db_url=db, timeout=1)
+                continue
+            # the timeout only starts once the queues are drained
+            drained_since = drained_since or datetime.datetime.now()
+            if (datetime.datetime.now() - drained_since).seconds >= timeout:
+                log.info("No more stages can be run - exiting.")
+                break
+            wait_for_jobs(db_url=db, timeout=1)
+    finally:
+        worker.close()
+        workers.pop(worker_id)
@@ -0,0 +1,151 @@
+"""Checkout the inputs of upcoming stages while the worker runs other stages.
+
+Workers in separate clones of the repository only have the outputs of the
+stages that ran in their own clone. The `Prefetcher` looks ahead at the
+stages that are ready or only wait for running stages and checks out the
+outputs of their completed parents from other clones in a background
+thread pool, so they are usually in place once a stage is claimed.
+"""
+
+import logging
+import os
+import socket
+import threading
+import typing as t
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from paraffin.db import get_upstream_locks
+
+if t.TYPE_CHECKING:
+    from paraffin.executor import Executor
+
+log = logging.getLogger(__name__)
+
+
+def _failure(func: t.Callable, *args) -> tuple[int, str, str] | None:
+    """Return the result of a prefetch if it failed, else None."""
+    try:
+        result = func(*args)
+    except Exception as err:
+        result = 1, "", str(err)
+    return result if result[0] != 0 else None
+
+
+class Prefetcher:
+    """Prefetch the outputs of stages that ran in other clones.
+
+    One prefetcher is shared by all workers in the same clone. The outputs
+    of every stage are only prefetched once, unless the prefetch failed
+    or the stage was run again.
+
+    Parameters
+    ----------
+    executor : Executor
+        Prefetches the outputs with `Executor.prefetch`.
+    db : str
+        The database URL.
+    queues, experiment, stage_name
+        Look ahead at the stages the workers select with these arguments.
+    jobs : int
+        The number of concurrent prefetches.
+    interval : float
+        The time in seconds between looking ahead, see `start`.
+    """
+
+    def __init__(
+        self,
+        executor: "Executor",
+        db: str,
+        queues: list[str],
+        experiment: str | None = None,
+        stage_name: str | None = None,
+        jobs: int = 2,
+        interval: float = 1.0,
+    ):
+        self.executor = executor
+        self.db = db
+        self.filters = {
+            "queues": queues,
+            "experiment": experiment,
+            "stage_name": stage_name,
+        }
+        self.interval = interval
+        self.machine = socket.gethostname()
+        self.cwd = os.getcwd()
+        self._pool = ThreadPoolExecutor(jobs, thread_name_prefix="paraffin-prefetch")
+        self._futures: dict[tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def _submit(self, locks: dict[str, str]) -> list[tuple[str, Future]]:
+        futures = []
+        with self._lock:
+            for name, lock in locks.items():
+                if (name, lock) not in self._futures:
+                    self._futures[(name, lock)] = self._pool.submit(
+                        self.executor.prefetch, name, lock
+                    )
+                futures.append((name, self._futures[(name, lock)]))
+        return futures
+
+    def look_ahead(self) -> None:
+        """Start prefetching the inputs of stages that are about to be ready."""
+        self._submit(
+            get_upstream_locks(
+                db_url=self.db, machine=self.machine, cwd=self.cwd, **self.filters
+            )
+        )
+
+    def _run(self) -> None:
+        while not self._closed.is_set():
+            try:
+                self.look_ahead()
+            except Exception as err:
+                log.warning(f"Unable to look ahead for stages to prefetch: {err}")
+            self._closed.wait(self.interval)
+
+    def start(self) -> "Prefetcher":
+        """Look ahead in a background thread until the prefetcher is closed."""
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def wait(self, stage_id: int) -> tuple[int, str, str] | None:
+        """Wait until the inputs of a claimed stage are checked out.
+
+        Failed prefetches are retried once in the calling thread.
+
+        Returns
+        -------
+        tuple[int, str, str] | None
+            The return code, stdout and stderr of a prefetch that failed
+            again, to fail the stage with, or None.
+        """
+        locks = get_upstream_locks(
+            db_url=self.db, machine=self.machine, cwd=self.cwd, stage_id=stage_id
+        )
+        for name, future in self._submit(locks):
+            if _failure(future.result) is None:
+                continue
+            log.warning(f"Unable to prefetch the outputs of '{name}', retrying.")
+            retry = Future()
+            try:
+                retry.set_result(self.executor.prefetch(name, locks[name]))
+            except Exception as err:
+                retry.set_exception(err)
+            failure = _failure(retry.result)
+            with self._lock:
+                if failure is None:
+                    self._futures[(name, locks[name])] = retry
+                else:
+                    # prefetched again for the next stage
+                    self._futures.pop((name, locks[name]), None)
+            if failure is not None:
+                returncode, stdout, stderr = failure
+                stderr = f"Unable to prefetch the outputs of '{name}':\n{stderr}"
+                return returncode, stdout, stderr
+        return None
+
+    def close(self) -> None:
+        """Stop looking ahead and cancel the prefetches that have not started."""
+        self._closed.set()
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,124 @@
+"""Profiling of the paraffin worker loop."""
+
+import contextlib
+import cProfile
+import datetime
+import logging
+import marshal
+import pathlib
+import signal
+import sys
+import threading
+import traceback
+
+log = logging.getLogger(__name__)
+
+# Since Python 3.12, cProfile uses `sys.monitoring`, which allows only one
+#  active profiler per process, and that profiler records all threads.
+CONCURRENT = sys.version_info < (3, 12)
+
+
+class WorkerProfiler:
+    """Record cProfile statistics of the worker threads.
+
+    Every profiled section is stored under a label, e.g. the job id and stage
+    name, and written to ``<directory>/<label>.prof`` which can be inspected
+    with ``python -m pstats`` or tools like ``snakeviz``.
+    Repeated sections with the same label accumulate into the same profile.
+    Before Python 3.12, sections can be profiled in several threads at once,
+    see `CONCURRENT`.
+
+    Parameters
+    ----------
+    directory : str | pathlib.Path
+        The directory to write the profiles to.
+    """
+
+    def __init__(self, directory: str | pathlib.Path):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._profiles: dict[str, cProfile.Profile] = {}
+        self._active: dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def profile(self, label: str, dump: bool = True):
+        """Profile the enclosed block of the current thread.
+
+        Parameters
+        ----------
+        label : str
+            The name of the profile.
+        dump : bool
+            Write the profile to disk when leaving the block. Otherwise, it is
+            only written by `dump` or `close`.
+        """
+        with self._lock:
+            if not CONCURRENT and self._active:
+                raise RuntimeError(
+                    "Only one thread can be profiled at a time on Python 3.12"
+                    f" and later, '{next(iter(self._active.values()))}' is active."
+                )
+            profile = self._profiles.setdefault(label, cProfile.Profile())
+            self._active[threading.get_ident()] = label
+        profile.enable()
+        try:
+            yield profile
+        finally:
+            profile.disable()
+            with self._lock:
+                self._active.pop(threading.get_ident(), None)
+            if dump:
+                self._write(label, self.directory / f"{label}.prof")
+
+    def _write(self, label: str, path: pathlib.Path) -> None:
+        # ``Profile.dump_stats`` would disable the profiler, which
+        #  must only happen from the thread that is being profiled.
+        profile = self._profiles[label]
+        profile.snapshot_stats()
+        with path.open("wb") as f:
+            marshal.dump(profile.stats, f)
+
+    def dump(self, *_) -> None:
+        """Write a snapshot of all profiles and the current stack of every thread.
+
+        This is meant to be used as a signal handler for a running worker.
+        """
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        with self._lock:
+            labels = list(self._profiles)
+            active = dict(self._active)
+        for label in labels:
+            self._write(label, self.directory / f"{label}-{timestamp}.prof")
+
+        threads = {thread.ident: thread.name for thread in threading.enumerate()}
+        with (self.directory / f"stacks-{timestamp}.txt").open("w") as f:
+            for ident, frame in sys._current_frames().items():
+                f.write(f"Thread {threads.get(ident, ident)}")
+                if ident in active:
+                    f.write(f" ({active[ident]})")
+                f.write("\n")
+                f.writelines(traceback.format_stack(frame))
+                f.write("\n")
+        log.info(f"Wrote profile snapshot to '{self.directory}'")
+
+    def install_signal_handler(self) -> None:
+        """Dump a snapshot when the process receives SIGUSR1."""
+        if not hasattr(signal, "SIGUSR1"):
+            log.warning("SIGUSR1 is not available - unable to install handler.")
+            return
+        signal.signal(signal.SIGUSR1, self.dump)
+
+    def close(self) -> None:
+        """Write all profiles to disk."""
+        with self._lock:
+            labels = list(self._profiles)
+        for label in labels:
+            self._write(label, self.directory / f"{label}.prof")
+
+
+def profile(profiler: WorkerProfiler | None, label: str, dump: bool = True):
+    """Profile the enclosed block if a profiler is given."""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.profile(label, dump=dump)
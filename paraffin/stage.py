@@ -1,12 +1,16 @@
 """Container for a DVC stage."""
 
+import asyncio
+import codecs
 import dataclasses
+import functools
 import json
 import logging
 import random
 import subprocess
 import threading
 import time
+import typing as t
 from pathlib import Path
 
 import dvc.api
@@ -23,9 +27,15 @@ log = logging.getLogger(__name__)
 
 @dataclasses.dataclass(frozen=True, eq=True)
 class PipelineStageDC:
-    """Container for a DVC stage."""
+    """Container for a DVC stage.
 
-    stage: PipelineStage
+    Only the name and cmd are stored, so the graph can be built from the
+    cache in `paraffin.utils.get_stage_graph`. The DVC stage itself is
+    loaded on first access.
+    """
+
+    name: str
+    cmd: str | list[str] = dataclasses.field(compare=False)
     status: str
     force: bool
 
@@ -34,15 +44,11 @@ class PipelineStageDC:
         """Check if the stage has changed."""
         return json.loads(self.status) != []
 
-    @property
-    def name(self) -> str:
-        """Return the name of the stage."""
-        return self.stage.addressing
-
-    @property
-    def cmd(self) -> str:
-        """Return the command of the stage."""
-        return self.stage.cmd
+    @functools.cached_property
+    def stage(self) -> PipelineStage:
+        """Load the DVC stage."""
+        fs = dvc.api.DVCFileSystem(url=None, rev=None)
+        return fs.repo.stage.collect(self.name)[0]
 
 
 def retry(times, exceptions, delay: float = 0, exponential: bool = True):
@@ -75,16 +81,41 @@ def retry(times, exceptions, delay: float = 0, exponential: bool = True):
     return decorator
 
 
-@retry(10, (LockError,), delay=0.5)
-def get_lock(name: str) -> tuple[dict, str]:
+def _collect(name: str) -> PipelineStage:
+    """Load a stage from `dvc.yaml` and `dvc.lock`.
+
+    The repository lock is only held while reading the files,
+    which other workers might write at the same time.
+    """
     fs = dvc.api.DVCFileSystem(url=None, rev=None)
     with fs.repo.lock:
-        stage = fs.repo.stage.collect(name)[0]
-        stage.save(allow_missing=True, run_cache=False)
-        stage_lock = to_single_stage_lockfile(stage, with_files=True)
-        dependency_hash = _get_cache_hash(clean_lock(stage_lock), key=False)
+        return fs.repo.stage.collect(name)[0]
+
+
+@retry(10, (LockError,), delay=0.5)
+def get_lock(name: str) -> tuple[dict, str]:
+    """Return the lock of a stage before it is run and the hash of its dependencies.
+
+    The dependencies are hashed outside of the repository lock. DVC keeps
+    the hashes of unchanged files in its state database, so dependencies
+    written by upstream stages are not read again.
+    """
+    stage = _collect(name)
+    stage.save_deps(allow_missing=True)
+    stage_lock = to_single_stage_lockfile(stage, with_files=True)
+    return stage_lock, _get_cache_hash(clean_lock(stage_lock), key=False)
 
-    return stage_lock, dependency_hash
+
+@retry(10, (LockError,), delay=0.5)
+def read_lock(name: str) -> tuple[dict, str]:
+    """Return the lock of a reproduced stage and the hash of its dependencies.
+
+    The outputs were already hashed by `dvc repro` or `dvc checkout`,
+    so the lock is read from `dvc.lock` instead of hashing them again.
+    """
+    stage = _collect(name)
+    stage_lock = to_single_stage_lockfile(stage, with_files=True)
+    return stage_lock, _get_cache_hash(clean_lock(stage_lock), key=False)
 
 
 def _stream_reader(pipe, callback) -> None:
@@ -137,66 +168,127 @@ def run_command(command: list[str]) -> tuple[int, str, str]:
     return return_code, "".join(stdout_lines), "".join(stderr_lines)
 
 
+async def _read_stream(stream: asyncio.StreamReader, chunks: list[str]) -> None:
+    """Read a pipe in chunks until EOF, printing them in real-time."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while data := await stream.read(2**16):
+        chunk = decoder.decode(data)
+        print(chunk, end="")
+        chunks.append(chunk)
+    chunks.append(decoder.decode(b"", final=True))
+
+
+async def run_command_async(command: list[str]) -> tuple[int, str, str]:
+    """Run a subprocess command like `run_command` without blocking the event loop.
+
+    The pipes are read by the event loop, so no threads are required.
+    The process is killed if the task is cancelled.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout_chunks = []
+    stderr_chunks = []
+    try:
+        await asyncio.gather(
+            _read_stream(process.stdout, stdout_chunks),
+            _read_stream(process.stderr, stderr_chunks),
+        )
+        return_code = await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        # reap the process, so it does not remain as a zombie
+        await process.wait()
+        raise
+    return return_code, "".join(stdout_chunks), "".join(stderr_chunks)
+
+
+def _repro_command(name: str, force: bool) -> list[str]:
+    cmd = ["dvc", "repro", "--single-item", name]
+    if force:
+        cmd.append("--force")
+    return cmd
+
+
+def _commit_locked(
+    name: str, return_code: int, repro_stdout: str, repro_stderr: str
+) -> tuple[int, str, str]:
+    """Commit a reproduced stage whose lock could not be written by `dvc repro`."""
+    stdout_lines = [repro_stdout]
+    stderr_lines = [repro_stderr]
+    for _ in range(5):
+        try:
+            print(f"Committing {name} again due to lock error")
+            commit_code, commit_stdout, commit_stderr = run_command(
+                ["dvc", "commit", name, "--force"]
+            )
+            stdout_lines.append(commit_stdout)
+            stderr_lines.append(commit_stderr)
+            if commit_code == 0:
+                return_code = 0  # we were able to commit the lock
+                break
+        except subprocess.CalledProcessError:
+            time.sleep(0.5)
+    else:
+        raise LockError(f"Unable to commit lock for {name}")
+
+    # Combine and return outputs
+    return return_code, "".join(stdout_lines), "".join(stderr_lines)
+
+
 @retry(10, (LockError,), delay=0.5)
-def repro(name: str, force: bool) -> tuple[int, str, str]:
+def repro(
+    name: str, force: bool, runner: t.Callable = run_command
+) -> tuple[int, str, str]:
     """Reproduce a DVC stage.
 
     Parameters
     ----------
         name : str
             The name of the stage to reproduce.
+        runner : Callable
+            Runs the `dvc repro` command, e.g. `paraffin.forkserver.ForkServer.run`.
 
     Returns
     -------
         Tuple[int, str, str]
             The return code, stdout, and stderr of the process.
     """
-    stdout_lines = []
-    stderr_lines = []
-
     # Run the main repro command
-    cmd = ["dvc", "repro", "--single-item", name]
-    if force:
-        cmd.append("--force")
-    return_code, repro_stdout, repro_stderr = run_command(cmd)
-    stdout_lines.append(repro_stdout)
-    stderr_lines.append(repro_stderr)
+    return_code, repro_stdout, repro_stderr = runner(_repro_command(name, force))
 
     # Handle lock errors in repro
     if "ERROR: Unable to acquire lock" in repro_stderr:
         raise LockError(f"Unable to acquire lock for {name}")
     if f"ERROR: failed to reproduce '{name}': Unable to acquire lock" in repro_stderr:
-        for _ in range(5):
-            try:
-                print(f"Committing {name} again due to lock error")
-                commit_code, commit_stdout, commit_stderr = run_command(
-                    ["dvc", "commit", name, "--force"]
-                )
-                stdout_lines.append(commit_stdout)
-                stderr_lines.append(commit_stderr)
-                if commit_code == 0:
-                    return_code = 0  # we were able to commit the lock
-                    break
-            except subprocess.CalledProcessError:
-                time.sleep(0.5)
-        else:
-            raise LockError(f"Unable to commit lock for {name}")
-
-    # Combine and return outputs
-    return return_code, "".join(stdout_lines), "".join(stderr_lines)
+        return _commit_locked(name, return_code, repro_stdout, repro_stderr)
+    return return_code, repro_stdout, repro_stderr
 
 
-@retry(10, (LockError,), delay=0.5)
-def checkout(
-    stage_lock: dict, cached_job_lock_json: str, name: str
+async def repro_async(
+    name: str, force: bool, runner: t.Callable = run_command_async
 ) -> tuple[int, str, str]:
-    log.info(f"Checking out job '{name}'")
-    cached_job_lock = json.loads(cached_job_lock_json)
-    output_lock = transform_lock(stage_lock, cached_job_lock)
+    """Reproduce a DVC stage like `repro` without blocking the event loop.
 
-    stdout_lines = []
-    stderr_lines = []
+    ``runner`` is awaited with the `dvc repro` command, e.g.
+    `paraffin.forkserver.ForkServer.run_async`. Lock errors are rare,
+    they are retried in a thread by `repro`.
+    """
+    return_code, repro_stdout, repro_stderr = await runner(_repro_command(name, force))
+    if "ERROR: Unable to acquire lock" in repro_stderr:
+        return await asyncio.to_thread(repro, name, force)
+    if f"ERROR: failed to reproduce '{name}': Unable to acquire lock" in repro_stderr:
+        try:
+            return await asyncio.to_thread(
+                _commit_locked, name, return_code, repro_stdout, repro_stderr
+            )
+        except LockError:
+            return await asyncio.to_thread(repro, name, force)
+    return return_code, repro_stdout, repro_stderr
 
+
+def _update_lockfile(name: str, stage_lock: dict) -> None:
+    """Write the lock of a stage to `dvc.lock` under the repository lock."""
     lock_file = Path("dvc.lock")
     if not lock_file.exists():
         with lock_file.open("w") as f:
@@ -212,12 +304,26 @@ def checkout(
     with fs.repo.lock:  # this can raise a LockError directly
         with lock_file.open("r") as f:
             lock = yaml.safe_load(f)
-            lock["stages"][name] = output_lock
+            lock["stages"][name] = stage_lock
 
         with lock_file.open("w") as f:
-            stdout_lines.append(f"Updating lock file 'dvc.lock' for '{name}'\n")
             yaml.dump(lock, f)
 
+
+@retry(10, (LockError,), delay=0.5)
+def checkout(
+    stage_lock: dict, cached_job_lock_json: str, name: str
+) -> tuple[int, str, str]:
+    log.info(f"Checking out job '{name}'")
+    cached_job_lock = json.loads(cached_job_lock_json)
+    output_lock = transform_lock(stage_lock, cached_job_lock)
+
+    stdout_lines = []
+    stderr_lines = []
+
+    stdout_lines.append(f"Updating lock file 'dvc.lock' for '{name}'\n")
+    _update_lockfile(name, output_lock)
+
     # Run the main repro command
     # We can use force here, because `dvc repro` would also remove the files
     stdout_lines.append(f"Checking out stage '{name}':\n")
@@ -244,3 +350,21 @@ def checkout(
     stderr_lines.append(repro_stderr)
 
     return return_code, "".join(stdout_lines), "".join(stderr_lines)
+
+
+@retry(10, (LockError,), delay=0.5)
+def prefetch(name: str, lock_json: str) -> tuple[int, str, str]:
+    """Checkout the outputs of a stage that was run in another clone.
+
+    The lock of the stage is written to `dvc.lock` and its outputs are
+    checked out from the DVC cache. If they are missing from the cache,
+    they are pulled from the DVC remote.
+    """
+    log.info(f"Prefetching the outputs of '{name}'")
+    _update_lockfile(name, json.loads(lock_json))
+    return_code, stdout, stderr = run_command(["dvc", "checkout", "--force", name])
+    if return_code != 0 and "ERROR: Unable to acquire lock" not in stderr:
+        return_code, stdout, stderr = run_command(["dvc", "pull", "--force", name])
+    if "ERROR: Unable to acquire lock" in stderr:
+        raise LockError(f"Unable to acquire lock for prefetching {name}.")
+    return return_code, stdout, stderr
@@ -8,6 +8,7 @@ from fastapi.staticfiles import StaticFiles
 
 from paraffin.db import (
     db_to_graph,
+    get_experiment_eta,
     get_job_dump,
     get_jobs,
     list_experiments,
@@ -117,6 +118,12 @@ def read_jobs(experiment: int):
     return get_jobs(experiment_id=int(experiment), db_url=db_url)
 
 
+@app.get("/api/v1/eta")
+def read_eta(experiment: int):
+    db_url = os.environ["PARAFFIN_DB"]
+    return get_experiment_eta(experiment_id=int(experiment), db_url=db_url)
+
+
 @app.get("/api/v1/workers")
 def read_workers(id: int | None = None):
     db_url = os.environ["PARAFFIN_DB"]
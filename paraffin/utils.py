@@ -1,16 +1,21 @@
 import fnmatch
+import hashlib
 import json
 import logging
+import os
 import pathlib
+import subprocess
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
-import dvc.api
 import networkx as nx
 import yaml
-from dvc.repo.status import _local_status
 
 log = logging.getLogger(__name__)
 
+# bump when the format of the cached stage graph changes
+_GRAPH_CACHE_VERSION = 1
+
 
 def get_subgraph_with_predecessors(graph, nodes) -> nx.DiGraph:
     """
@@ -29,21 +34,153 @@ def get_subgraph_with_predecessors(graph, nodes) -> nx.DiGraph:
     networkx.Graph
         A subgraph containing the specified nodes and all their predecessors.
     """
-    # Initialize a set to store nodes that will be in the subgraph
+    # Walk upstream from all nodes at once, visiting every predecessor once
     nodes_to_include = set(nodes)
-
-    # For each node in X, find all its predecessors
-    for node in nodes:
-        predecessors = nx.ancestors(graph, node)
-        nodes_to_include.update(predecessors)
+    queue = list(nodes_to_include)
+    while queue:
+        for pred in graph.predecessors(queue.pop()):
+            if pred not in nodes_to_include:
+                nodes_to_include.add(pred)
+                queue.append(pred)
 
     return graph.subgraph(nodes_to_include).copy()
 
 
-def get_stage_graph(names: list | None, force: bool, single_item: bool) -> nx.DiGraph:
+def _pipeline_hash(root: pathlib.Path) -> str | None:
+    """Hash the content of all `dvc.yaml` and `params.yaml` files in the repo.
+
+    Returns None if the files can not be listed with git.
+    """
+    try:
+        files = subprocess.run(
+            [
+                "git",
+                "ls-files",
+                "-z",
+                "--cached",
+                "--others",
+                "--exclude-standard",
+                "--",
+                ":(glob)**/dvc.yaml",
+                ":(glob)**/params.yaml",
+            ],
+            cwd=root,
+            capture_output=True,
+            check=True,
+        ).stdout.split(b"\0")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    digest = hashlib.sha256(f"{_GRAPH_CACHE_VERSION}".encode())
+    for file in sorted(filter(None, files)):
+        path = root / file.decode()
+        if path.is_file():
+            digest.update(file + b"\0" + path.read_bytes() + b"\0")
+    return digest.hexdigest()
+
+
+def _build_pipeline(repo) -> nx.DiGraph:
+    """Build the graph of stage names with their cmd from the DVC index."""
+    index_graph = repo.index.graph.reverse(copy=False)
+    graph = nx.DiGraph()
+    for stage in index_graph:
+        # stages of `.dvc` files do not have a name
+        if hasattr(stage, "name"):
+            graph.add_node(stage.addressing, cmd=stage.cmd)
+    graph.add_edges_from(
+        (parent.addressing, child.addressing)
+        for parent, child in index_graph.edges
+        if hasattr(parent, "name") and hasattr(child, "name")
+    )
+    return graph
+
+
+def _load_pipeline() -> nx.DiGraph:
+    """Return the graph of stage names with their cmd.
+
+    The graph is cached in `.dvc/tmp` until a `dvc.yaml` or `params.yaml`
+    file changes, so the DVC index does not have to be built.
+    """
+    from dvc.repo import Repo
+
+    root = pathlib.Path(Repo.find_root())
+    key = _pipeline_hash(root)
+    cache = root / Repo.DVC_DIR / "tmp" / "paraffin-graph.json"
+    if key is not None:
+        try:
+            data = json.loads(cache.read_text())
+        except (OSError, ValueError):
+            data = {}
+        if data.get("key") == key:
+            graph = nx.DiGraph()
+            graph.add_nodes_from((name, {"cmd": cmd}) for name, cmd in data["nodes"])
+            graph.add_edges_from(data["edges"])
+            return graph
+
+    with Repo(root) as repo:
+        graph = _build_pipeline(repo)
+    if key is not None:
+        data = {
+            "key": key,
+            "nodes": [[name, cmd] for name, cmd in graph.nodes(data="cmd")],
+            "edges": list(graph.edges),
+        }
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(data))
+        tmp.replace(cache)
+    return graph
+
+
+def _get_status(names: set[str], jobs: int | None = None) -> dict[str, list]:
+    """Return the DVC status of the stages, checked in parallel.
+
+    Hashing the dependencies and outputs is mostly file IO, which runs
+    concurrently in threads. The DVC state database can be used from
+    multiple threads. The results are merged in the order of the stages,
+    as in `dvc status`.
+
+    Parameters
+    ----------
+    names : set[str]
+        The addressing of the stages to check.
+    jobs : int | None
+        The number of threads, defaults to the number of CPUs.
+        With a single CPU, the stages are checked one after another.
+    """
+    import dvc.api
+
+    fs = dvc.api.DVCFileSystem(url=None, rev=None)
+    with fs.repo.lock:
+        stages = [stage for stage in fs.repo.index.stages if stage.addressing in names]
+        for stage in stages:
+            if stage.frozen:
+                log.warning(f"{stage} is frozen, its dependencies are not checked.")
+
+        def check(stage) -> dict[str, list]:
+            return stage.status(check_updates=True)
+
+        jobs = jobs or os.cpu_count() or 1
+        if jobs == 1:
+            results = list(map(check, stages))
+        else:
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                results = list(pool.map(check, stages))
+    status = {}
+    for result in results:
+        status.update(result)
+    return status
+
+
+def get_stage_graph(
+    names: list | None, force: bool, single_item: bool, jobs: int | None = None
+) -> nx.DiGraph:
     """
     Generates a subgraph of stages from a DVC repository based on provided names.
 
+    The structure of the pipeline is cached, see `_load_pipeline`.
+    With ``force``, all selected stages are rerun,
+    so their status is not computed.
+
     Attributes
     ----------
     names: list|None
@@ -52,6 +189,8 @@ def get_stage_graph(names: list | None, force: bool, single_item: bool) -> nx.Di
         Force rerun the selected stages
     single_item: bool
         only reproduce the names without upstream dependencies
+    jobs: int|None
+        Number of threads to check the status of the stages.
 
     Returns
     -------
@@ -60,13 +199,10 @@ def get_stage_graph(names: list | None, force: bool, single_item: bool) -> nx.Di
     """
     from paraffin.stage import PipelineStageDC  # avoid circular import
 
-    fs = dvc.api.DVCFileSystem(url=None, rev=None)
-    graph = fs.repo.index.graph.reverse(copy=True)
-    nodes = [x for x in graph.nodes if hasattr(x, "name")]
+    graph = _load_pipeline()
+    nodes = list(graph.nodes)
     if names is not None and len(names) > 0:
-        nodes = [
-            x for x in nodes if any(fnmatch.fnmatch(x.name, name) for name in names)
-        ]
+        nodes = [x for x in nodes if any(fnmatch.fnmatch(x, name) for name in names)]
 
     if single_item:
         # If single_item is True, only include the specified
@@ -76,41 +212,61 @@ def get_stage_graph(names: list | None, force: bool, single_item: bool) -> nx.Di
         # Otherwise, include the specified nodes and their predecessors
         subgraph = get_subgraph_with_predecessors(graph, nodes)
 
-    # remove all nodes that do not have a name
-    subgraph = nx.subgraph_view(subgraph, filter_node=lambda x: hasattr(x, "name"))
-
-    mapping = {}
-    with fs.repo.lock:
-        status = _local_status(fs.repo, check_updates=True, with_deps=True)
-        for node in nx.topological_sort(subgraph):
-            for pred in nx.ancestors(graph, node):
-                if pred in mapping:
-                    if mapping[pred].changed:
-                        status[node.name] = status.get(node.name, []) + [
-                            "changed by upstream"
-                        ]
-                        break
-
-            mapping[node] = PipelineStageDC(
-                stage=node,
-                status=json.dumps(status.get(node.name, [])),
-                force=force,
-            )
-
+    if force:
+        status = {node: ["forced"] for node in subgraph}
+    else:
+        status = _get_status(set(subgraph), jobs=jobs)
+
+    # a stage has changed if any selected upstream stage has changed
+    changed = {}
+    for node in nx.topological_sort(graph):
+        upstream = any(changed[pred] for pred in graph.predecessors(node))
+        if node in subgraph and upstream:
+            status[node] = status.get(node, []) + ["changed by upstream"]
+        changed[node] = upstream or (node in subgraph and bool(status.get(node)))
+
+    mapping = {
+        node: PipelineStageDC(
+            name=node,
+            cmd=graph.nodes[node]["cmd"],
+            status=json.dumps(status.get(node, [])),
+            force=force,
+        )
+        for node in subgraph
+    }
     return nx.relabel_nodes(subgraph, mapping, copy=True)
 
 
-def get_custom_queue():
+def _read_config() -> dict:
     try:
         with pathlib.Path("paraffin.yaml").open() as f:
-            config = yaml.safe_load(f)
-
-            return config.get("queue", {})
-
+            return yaml.safe_load(f) or {}
     except FileNotFoundError:
         return {}
 
 
+def get_custom_queue():
+    return _read_config().get("queue", {})
+
+
+def get_capture_config() -> dict[str, dict]:
+    """Read the output capture settings from `paraffin.yaml`.
+
+    Patterns are matched against the stage name or queue.
+    Each entry can disable capturing ``stdout`` or ``stderr``
+    and ``limit`` the number of characters kept from the end of each.
+
+    Examples
+    --------
+    capture:
+      "train_*":
+        stdout: false
+      gpu:
+        limit: 10000
+    """
+    return _read_config().get("capture", {})
+
+
 def build_elk_hierarchy(graph: nx.DiGraph, node_width=100, node_height=50):
     """
     Export a networkx.DiGraph to a JSON structure compatible with ELK.js,
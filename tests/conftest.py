@@ -2,11 +2,21 @@ import os
 import pathlib
 import shutil
 import subprocess
+import threading
+import uuid
 
 import dvc.cli
 import git
+import networkx as nx
 import pytest
 import zntrack.examples
+from sqlalchemy import create_engine, make_url, text
+from sqlmodel import Session, select
+
+from paraffin.cli import spawn_worker
+from paraffin.db import save_graph_to_db
+from paraffin.db.app import get_engine
+from paraffin.db.models import Stage
 
 
 @pytest.fixture
@@ -28,6 +38,100 @@ def check_finished():
     return func
 
 
+@pytest.fixture(scope="session")
+def postgres_url(tmp_path_factory) -> str:
+    """URL of a PostgreSQL server for testing.
+
+    Uses the server given by the ``PARAFFIN_TEST_POSTGRES`` environment variable
+    or starts a local server via ``pgserver``.
+    """
+    if url := os.environ.get("PARAFFIN_TEST_POSTGRES"):
+        yield url
+        return
+    pgserver = pytest.importorskip("pgserver")
+    server = pgserver.get_server(
+        tmp_path_factory.mktemp("postgres"), cleanup_mode="stop"
+    )
+    yield server.get_uri().replace("postgresql://", "postgresql+psycopg://", 1)
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def db_url(request, tmp_path) -> str:
+    """URL of an empty database for each of the supported backends."""
+    if request.param == "sqlite":
+        return f"sqlite:///{tmp_path / 'paraffin.db'}"
+    url = request.getfixturevalue("postgres_url")
+    name = f"paraffin_{uuid.uuid4().hex}"
+    engine = create_engine(url, isolation_level="AUTOCOMMIT")
+    with engine.connect() as connection:
+        connection.execute(text(f"CREATE DATABASE {name}"))
+    engine.dispose()
+    return make_url(url).set(database=name).render_as_string(hide_password=False)
+
+
+@pytest.fixture
+def submit(db_url):
+    """Submit a graph of `paraffin.executor.SimulatedStage` as a new experiment."""
+
+    def func(
+        graph: nx.DiGraph, queues: dict | None = None, cache: bool = False, **kwargs
+    ):
+        return save_graph_to_db(
+            graph,
+            queues=queues or {},
+            commit="HEAD",
+            origin="local",
+            machine="local",
+            cache=cache,
+            db_url=db_url,
+            **kwargs,
+        )
+
+    return func
+
+
+@pytest.fixture
+def run_worker(db_url):
+    """Run workers in threads until they exit and return their ``workers`` dict.
+
+    The keyword arguments are passed to the ``target``, e.g. the executor.
+    """
+
+    def func(
+        threads: int = 1,
+        queues: tuple[str, ...] = ("default",),
+        experiment: int | None = None,
+        stage_name: str | None = None,
+        timeout: float = 0,
+        target=spawn_worker,
+        **kwargs,
+    ) -> dict:
+        workers = {}
+        args = ("test", list(queues), experiment, stage_name, timeout, db_url, workers)
+        running = [
+            threading.Thread(target=target, args=args, kwargs=kwargs)
+            for _ in range(threads)
+        ]
+        for thread in running:
+            thread.start()
+        for thread in running:
+            thread.join()
+        return workers
+
+    return func
+
+
+@pytest.fixture
+def stage_status(db_url):
+    """Return the status of every stage by name."""
+
+    def func() -> dict[str, str]:
+        with Session(get_engine(db_url)) as session:
+            return {x.name: x.status for x in session.exec(select(Stage)).all()}
+
+    return func
+
+
 @pytest.fixture
 def proj_path(tmp_path, request) -> pathlib.Path:
     """temporary directory for testing DVC calls
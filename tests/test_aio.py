@@ -0,0 +1,150 @@
+import asyncio
+import signal
+import sys
+import time
+from unittest import mock
+
+import networkx as nx
+from sqlmodel import Session, select
+
+from paraffin.aio import run_workers
+from paraffin.db import get_job_dump
+from paraffin.db.app import get_engine
+from paraffin.db.models import Worker
+from paraffin.executor import ForkServerExecutor, SimulatedExecutor, SimulatedStage
+from paraffin.forkserver import ForkServer
+from paraffin.stage import run_command_async
+
+
+def test_run_command_async():
+    code = "import sys; print('out'); print('err', file=sys.stderr); sys.exit(3)"
+    result = asyncio.run(run_command_async([sys.executable, "-c", code]))
+    assert result == (3, "out\n", "err\n")
+
+
+def test_run_command_async_cancel():
+    processes = []
+    create = asyncio.create_subprocess_exec
+
+    async def create_subprocess_exec(*args, **kwargs):
+        processes.append(await create(*args, **kwargs))
+        return processes[-1]
+
+    async def main():
+        task = asyncio.create_task(
+            run_command_async([sys.executable, "-c", "import time; time.sleep(60)"])
+        )
+        while not processes:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    with mock.patch("asyncio.create_subprocess_exec", create_subprocess_exec):
+        asyncio.run(main())
+    # the killed process was reaped
+    assert processes[0].returncode == -signal.SIGKILL
+
+
+def test_async_worker(db_url, submit, stage_status):
+    root = SimulatedStage("root")
+    leaves = [SimulatedStage(f"leaf_{idx}") for idx in range(40)]
+    submit(nx.DiGraph([(root, leaf) for leaf in leaves]))
+    workers = {}
+    start = time.perf_counter()
+    run_workers(
+        "test",
+        ["default"],
+        None,
+        None,
+        0,
+        db_url,
+        jobs=40,
+        workers=workers,
+        executor=SimulatedExecutor(duration=0.5, fail=["leaf_0"]),
+    )
+    # the leaves run concurrently, one after the other would take 20 seconds
+    assert time.perf_counter() - start < 10
+    assert workers == {}
+
+    with Session(get_engine(db_url)) as session:
+        assert {x.status for x in session.exec(select(Worker)).all()} == {"offline"}
+    status = stage_status()
+    assert status.pop("leaf_0") == "failed"
+    assert set(status.values()) == {"completed"}
+
+
+def test_async_worker_error(db_url, submit, stage_status):
+    graph = nx.DiGraph()
+    graph.add_nodes_from(SimulatedStage(name) for name in "ABC")
+    submit(graph)
+    executor = SimulatedExecutor()
+    read_lock = executor.read_lock
+
+    def broken_read_lock(name):
+        if name == "B":
+            raise RuntimeError("unable to read the lock")
+        return read_lock(name)
+
+    workers = {}
+    with mock.patch.object(executor, "read_lock", side_effect=broken_read_lock):
+        run_workers(
+            "test",
+            ["default"],
+            None,
+            None,
+            0,
+            db_url,
+            jobs=2,
+            workers=workers,
+            executor=executor,
+        )
+    assert workers == {}
+    # only the stage with the error failed, the worker ran the others
+    assert stage_status() == {"A": "completed", "B": "failed", "C": "completed"}
+    dump = get_job_dump("B", experiment_id=1, db_url=db_url)
+    assert "unable to read the lock" in dump["stderr"]
+
+
+def test_async_single_flight(db_url, submit, stage_status, monkeypatch):
+    graph = nx.DiGraph()
+    graph.add_node(SimulatedStage("A", cmd="zntrack run module.A --name A"))
+    for _ in range(2):
+        submit(graph, cache=True)
+    # waiting for the identical stage must not hold the only thread
+    monkeypatch.setattr("paraffin.aio.THREADS", 1)
+    executor = SimulatedExecutor(duration=0.5)
+    executor.repro_async = mock.AsyncMock(wraps=executor.repro_async)
+    executor.checkout = mock.Mock(wraps=executor.checkout)
+    run_workers(
+        "test",
+        ["default"],
+        None,
+        None,
+        0,
+        db_url,
+        jobs=2,
+        workers={},
+        executor=executor,
+    )
+
+    assert executor.repro_async.await_count == 1
+    assert executor.checkout.call_count == 1
+    assert set(stage_status().values()) == {"completed"}
+
+
+def test_forkserver_repro_async():
+    executor = ForkServerExecutor()
+    executor._server = ForkServer([])
+    with mock.patch.object(
+        executor._server, "run_async", return_value=(0, "", "")
+    ) as run_async:
+        assert asyncio.run(executor.repro_async("A", force=True)) == (0, "", "")
+    # the fork is awaited in the event loop instead of a thread
+    run_async.assert_awaited_once_with(
+        ["dvc", "repro", "--single-item", "A", "--force"]
+    )
+
+
+def test_forkserver_run_async():
+    result = asyncio.run(ForkServer([]).run_async(["dvc", "--version"]))
+    assert result[0] == 0
@@ -0,0 +1,135 @@
+import threading
+import time
+
+import networkx as nx
+import pytest
+from sqlmodel import Session, update
+
+from paraffin.cli import spawn_worker
+from paraffin.db import (
+    can_make_progress,
+    close_worker,
+    get_job,
+    register_worker,
+    update_job_status,
+)
+from paraffin.db.app import get_engine
+from paraffin.db.models import Stage
+from paraffin.executor import SimulatedExecutor, SimulatedStage
+from paraffin.pipelined import spawn_pipelined_worker
+
+
+def test_blocked_stages(db_url, submit, run_worker, stage_status):
+    a, b, c, d, e = (SimulatedStage(name) for name in "ABCDE")
+    # E depends on both failing stages
+    submit(nx.DiGraph([(a, b), (b, c), (a, d), (d, e), (b, e)]))
+    run_worker(executor=SimulatedExecutor(fail=["B", "D"]))
+    assert stage_status() == {
+        "A": "completed",
+        "B": "failed",
+        "C": "blocked",
+        "D": "failed",
+        "E": "blocked",
+    }
+
+    # queueing B again unblocks C, E still has a failed ancestor
+    update_job_status("B", 1, "pending", db_url, force=False)
+    assert stage_status()["C"] == "pending"
+    assert stage_status()["E"] == "blocked"
+
+    update_job_status("D", 1, "pending", db_url, force=False)
+    run_worker(executor=SimulatedExecutor())
+    assert set(stage_status().values()) == {"completed"}
+
+
+def test_blocked_cached_stages(db_url, submit, stage_status):
+    a, b = SimulatedStage("A"), SimulatedStage("B")
+    c = SimulatedStage("C", changed=False)
+    submit(nx.DiGraph([(a, b), (b, c)]))
+
+    update_job_status("A", 1, "failed", db_url, force=False)
+    assert stage_status() == {"A": "failed", "B": "blocked", "C": "blocked"}
+    assert not can_make_progress(db_url)
+    # the cached child is restored once its ancestor is queued again
+    update_job_status("A", 1, "pending", db_url, force=False)
+    assert stage_status() == {"A": "pending", "B": "pending", "C": "cached"}
+
+
+def test_can_make_progress(db_url, submit):
+    a, b, c, d = (SimulatedStage(name) for name in "ABCD")
+    submit(nx.DiGraph([(a, b), (a, c), (d, c)]), queues={"C": "slow"})
+
+    def set_status(**status):
+        with Session(get_engine(db_url)) as session:
+            for name, value in status.items():
+                session.execute(
+                    update(Stage).where(Stage.name == name).values(status=value)
+                )
+            session.commit()
+
+    # A and D are ready, C waits for them
+    assert can_make_progress(db_url, queues=["default"])
+    assert not can_make_progress(db_url, queues=["slow"])
+    set_status(A="running", D="running")
+    assert can_make_progress(db_url, queues=["default"])
+    assert can_make_progress(db_url, queues=["slow"])
+    set_status(D="failed")
+    assert not can_make_progress(db_url, queues=["slow"])
+    assert can_make_progress(db_url, stage_name="B")
+    assert not can_make_progress(db_url, stage_name="C")
+    # the same for a cached child of the failed stage
+    set_status(C="cached")
+    assert not can_make_progress(db_url, queues=["slow"])
+    # nobody is running A
+    set_status(A="pending")
+    assert not can_make_progress(db_url, stage_name="B", queues=["slow"])
+    set_status(A="completed", B="completed", C="completed", D="completed")
+    assert not can_make_progress(db_url)
+
+
+def test_worker_waits_for_upstream(db_url, submit, stage_status):
+    a, b = SimulatedStage("A"), SimulatedStage("B")
+    submit(nx.DiGraph([(a, b)]), queues={"B": "slow"})
+    executor = SimulatedExecutor(duration=0.5)
+    threads = [
+        threading.Thread(
+            target=spawn_worker,
+            args=("test", [queue], None, None, 0, db_url, {}),
+            kwargs={"executor": executor},
+        )
+        for queue in ["default", "slow"]
+    ]
+    threads[0].start()
+    while not can_make_progress(db_url, queues=["slow"]):
+        time.sleep(0.01)
+    threads[1].start()
+    for thread in threads:
+        thread.join()
+
+    # the worker of the slow queue did not exit while A was running
+    assert set(stage_status().values()) == {"completed"}
+
+
+def test_can_make_progress_closed_worker(db_url, submit):
+    a, b = SimulatedStage("A"), SimulatedStage("B")
+    submit(nx.DiGraph([(a, b)]), queues={"B": "slow"})
+    worker_id = register_worker("other", "node-1", db_url, cwd="", pid=0)
+    stage, _ = get_job(db_url, worker_id=worker_id)
+    assert stage.name == "A"
+    assert can_make_progress(db_url, queues=["slow"])
+    # the worker of A is gone, so A never finishes
+    close_worker(worker_id, db_url=db_url)
+    assert not can_make_progress(db_url, queues=["slow"])
+
+
+@pytest.mark.parametrize("target", [spawn_worker, spawn_pipelined_worker])
+def test_worker_max_wait(db_url, submit, run_worker, stage_status, target):
+    a, b = SimulatedStage("A"), SimulatedStage("B")
+    submit(nx.DiGraph([(a, b)]), queues={"B": "slow"})
+    worker_id = register_worker("other", "node-1", db_url, cwd="", pid=0)
+    get_job(db_url, worker_id=worker_id)
+    start = time.perf_counter()
+    run_worker(queues=("slow",), target=target, max_wait=1)
+    # the worker did not wait for A forever
+    assert time.perf_counter() - start < 10
+    assert stage_status() == {"A": "running", "B": "pending"}
@@ -0,0 +1,59 @@
+from unittest import mock
+
+import networkx as nx
+from sqlmodel import Session, select
+
+from paraffin.db import get_job, update_experiment
+from paraffin.db.app import get_engine
+from paraffin.db.models import Stage
+from paraffin.executor import SimulatedExecutor, SimulatedStage
+
+
+def test_chains(db_url, submit, run_worker, stage_status):
+    a, b, c, d, e, f, w, x, y, z = (SimulatedStage(name) for name in "ABCDEFWXYZ")
+    graph = nx.DiGraph([(a, b), (b, c), (c, d), (c, e), (e, f), (x, y), (z, y), (y, w)])
+    submit(graph, queues={"W": "slow"})
+    with Session(get_engine(db_url)) as session:
+        stages = {x.name: x for x in session.exec(select(Stage)).all()}
+    chains = {name: stage.chain_id for name, stage in stages.items()}
+    assert chains == {
+        "A": stages["A"].id,
+        "B": stages["A"].id,
+        "C": stages["A"].id,
+        "D": None,
+        "E": stages["E"].id,
+        "F": stages["E"].id,
+        "X": None,
+        "Y": None,
+        "Z": None,
+        "W": None,
+    }
+
+    with mock.patch("paraffin.db.get_job", wraps=get_job) as wrapped:
+        run_worker(queues=("default", "slow"), executor=SimulatedExecutor())
+    # B, C and F were claimed directly after their parent
+    assert wrapped.call_count == 10 + 1 - 3
+    assert set(stage_status().values()) == {"completed"}
+
+
+def test_chains_after_update(db_url, submit):
+    a, b = SimulatedStage("A"), SimulatedStage("B")
+    submit(nx.DiGraph([(a, b)]))
+    c, d = SimulatedStage("C"), SimulatedStage("D")
+    update_experiment(
+        nx.DiGraph([(a, b), (b, c), (a, d)]),
+        experiment_id=1,
+        queues={},
+        commit="HEAD",
+        cache=False,
+        db_url=db_url,
+    )
+    with Session(get_engine(db_url)) as session:
+        stages = {x.name: x for x in session.exec(select(Stage)).all()}
+    # A has two children now, so B starts a new chain with C
+    assert {name: stage.chain_id for name, stage in stages.items()} == {
+        "A": None,
+        "B": stages["B"].id,
+        "C": stages["B"].id,
+        "D": None,
+    }
@@ -0,0 +1,79 @@
+import datetime
+
+import networkx as nx
+from sqlmodel import Session, select
+
+from paraffin.db import get_experiment_eta, register_worker
+from paraffin.db.app import get_engine
+from paraffin.db.models import Job, Stage
+from paraffin.executor import SimulatedStage
+
+
+def _finish(db_url: str, experiment: int, durations: dict[str, float]) -> None:
+    worker_id = register_worker("test", "local", db_url, cwd="", pid=0)
+    now = datetime.datetime.now()
+    with Session(get_engine(db_url)) as session:
+        for name, duration in durations.items():
+            stage = session.exec(
+                select(Stage)
+                .where(Stage.experiment_id == experiment)
+                .where(Stage.name == name)
+            ).one()
+            stage.status = "completed"
+            session.add(stage)
+            session.add(
+                Job(
+                    stage_id=stage.id,
+                    worker_id=worker_id,
+                    started_at=now - datetime.timedelta(seconds=duration),
+                    finished_at=now,
+                )
+            )
+        session.commit()
+
+
+def test_eta(db_url, submit):
+    a = SimulatedStage("A", "zntrack run module.A --name A")
+    b = SimulatedStage("B", "zntrack run module.B --name B")
+    c = SimulatedStage("C", "zntrack run module.B --name C")
+    d = SimulatedStage("D", "zntrack run module.D --name D")
+    graph = nx.DiGraph([(a, b), (a, c), (b, d), (c, d)])
+
+    submit(graph)
+    assert get_experiment_eta(db_url, experiment_id=1)["remaining"] is None
+
+    _finish(db_url, experiment=1, durations={"A": 10, "B": 20, "C": 30, "D": 40})
+    submit(graph)
+    eta = get_experiment_eta(db_url, experiment_id=2)
+
+    assert eta["estimates"] == {"A": 10, "B": 20, "C": 30, "D": 40}
+    assert eta["critical_path"] == ["A", "C", "D"]
+    assert eta["critical_path_duration"] == 80
+    assert eta["work"] == 100
+    # a single worker has to run all the stages sequentially
+    assert eta["workers"] == 1
+    assert eta["remaining"] == 100
+
+    _finish(db_url, experiment=2, durations={"A": 10})
+    eta = get_experiment_eta(db_url, experiment_id=2)
+    assert eta["critical_path"] == ["C", "D"]
+    assert eta["work"] == 90
+    # with two workers, the critical path is the bottleneck
+    assert eta["workers"] == 2
+    assert eta["remaining"] == 70
+
+
+def test_eta_from_similar_stages(db_url, submit):
+    a = SimulatedStage("A", "zntrack run module.A --name A")
+    submit(nx.DiGraph([(a, SimulatedStage("B", "zntrack run module.B --name B"))]))
+    _finish(db_url, experiment=1, durations={"A": 5, "B": 15})
+
+    # "C" has never run, but shares the ZnTrack Node class with "B"
+    submit(nx.DiGraph([(a, SimulatedStage("C", "zntrack run module.B --name C"))]))
+    eta = get_experiment_eta(db_url, experiment_id=2)
+    assert eta["estimates"] == {"A": 5, "C": 15}
+
+    # without any similar stages, the median of all jobs is used
+    submit(nx.DiGraph([(a, SimulatedStage("E", "echo hello"))]))
+    eta = get_experiment_eta(db_url, experiment_id=3)
+    assert eta["estimates"] == {"A": 5, "E": 10}
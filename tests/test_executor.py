@@ -0,0 +1,129 @@
+import json
+from unittest import mock
+
+import networkx as nx
+import pytest
+from sqlmodel import Session, select
+
+from paraffin.db import app, get_job_dump, wait_for_jobs
+from paraffin.db.app import get_engine
+from paraffin.db.models import Stage
+from paraffin.executor import Executor, SimulatedExecutor, SimulatedStage
+from paraffin.forkserver import get_node_modules
+
+
+def test_simulated_executor(db_url, submit, run_worker, stage_status):
+    a, b, c, d, e = (SimulatedStage(name) for name in "ABCDE")
+    submit(nx.DiGraph([(a, b), (b, c), (a, d), (d, e)]))
+
+    executor = SimulatedExecutor(
+        duration=0.01, fail=["D"], lock_time=0.001, lock_error_rate=0.2, seed=42
+    )
+    workers = run_worker(threads=4, executor=executor)
+    assert stage_status() == {
+        "A": "completed",
+        "B": "completed",
+        "C": "completed",
+        "D": "failed",
+        "E": "blocked",
+    }
+    assert workers == {}
+
+    dump = get_job_dump("D", experiment_id=1, db_url=db_url)
+    assert dump["stderr"] == "ERROR: failed to reproduce 'D': simulated failure\n"
+    assert dump["stdout"] == ""
+    dump = get_job_dump("A", experiment_id=1, db_url=db_url)
+    assert json.loads(dump["lockfile_content"]) == {"cmd": "A", "deps": [], "outs": []}
+
+
+def test_simulated_executor_lock():
+    executor = SimulatedExecutor(lock_error_rate=0.5, seed=0)
+    lock, dependency_hash = executor.get_lock("A")
+    assert lock["cmd"] == "A"
+    assert executor.get_lock("A")[1] == dependency_hash
+    assert executor.get_lock("B")[1] != dependency_hash
+
+
+def test_incomplete_executor():
+    class ReproExecutor(Executor):
+        def repro(self, name: str, force: bool) -> tuple[int, str, str]:
+            return 0, "", ""
+
+    with pytest.raises(TypeError, match="checkout.*get_lock"):
+        ReproExecutor()
+
+
+def test_concurrent_claims(db_url, submit, run_worker):
+    graph = nx.DiGraph()
+    root = SimulatedStage("root")
+    for idx in range(50):
+        graph.add_edge(root, SimulatedStage(f"leaf_{idx}"))
+    submit(graph)
+    run_worker(threads=8, timeout=1, executor=SimulatedExecutor(duration=0.01))
+
+    with Session(get_engine(db_url)) as session:
+        stages = session.exec(select(Stage)).all()
+        assert all(stage.status == "completed" for stage in stages)
+        # every stage was claimed by exactly one worker
+        assert all(len(stage.jobs) == 1 for stage in stages)
+
+
+def test_targeted_stage(db_url, submit, run_worker, stage_status):
+    # A -> B -> C, A -> D -> C, E
+    a, b, c, d, e = (SimulatedStage(name) for name in "ABCDE")
+    graph = nx.DiGraph([(a, b), (b, c), (a, d), (d, c)])
+    graph.add_node(e)
+    submit(graph)
+
+    executor = SimulatedExecutor()
+    run_worker(experiment=1, stage_name="B", executor=executor)
+    assert stage_status() == {
+        "A": "completed",
+        "B": "completed",
+        "C": "pending",
+        "D": "pending",
+        "E": "pending",
+    }
+
+    # the cached ancestors are updated for a new experiment
+    submit(graph)
+    run_worker(stage_name="C", executor=executor)
+    with Session(get_engine(db_url)) as session:
+        stages = session.exec(select(Stage).where(Stage.name != "E")).all()
+        assert all(stage.status == "completed" for stage in stages)
+
+
+def test_ancestors(db_url, submit):
+    a, b, c = (SimulatedStage(name) for name in "ABC")
+    submit(nx.DiGraph([(a, b), (b, c)]))
+    with Session(get_engine(db_url)) as session:
+        assert len(session.exec(app._ancestors(1, "C")).all()) == 3
+        assert len(session.exec(app._ancestors(None, "B")).all()) == 2
+    # the statement is reused for every poll
+    assert app._ancestors(1, "C") is app._ancestors(1, "C")
+
+
+def test_get_node_modules():
+    cmds = [
+        "zntrack run pkg.nodes.A --name A",
+        "python script.py",
+        "zntrack run pkg.nodes.B --name B",
+        "zntrack run other.C --name C --method run",
+        ["zntrack run multi.D --name D"],
+    ]
+    assert get_node_modules(cmds) == ["pkg.nodes", "other"]
+
+
+def test_wait_for_jobs_error(db_url):
+    engine = get_engine(db_url)
+    if engine.dialect.name != "postgresql":
+        pytest.skip("only PostgreSQL listens for notifications")
+    with mock.patch("psycopg.Connection.notifies", side_effect=RuntimeError):
+        with pytest.raises(RuntimeError):
+            wait_for_jobs(db_url, timeout=0.1)
+    connection = engine.raw_connection()
+    try:
+        assert connection.driver_connection.autocommit is False
+    finally:
+        connection.close()
+    wait_for_jobs(db_url, timeout=0.1)
@@ -0,0 +1,224 @@
+import datetime
+import gzip
+import json
+import zlib
+
+import networkx as nx
+import pytest
+from sqlmodel import Session, select, text, update
+from typer.testing import CliRunner
+
+from paraffin.cli import app, spawn_worker
+from paraffin.db import (
+    find_cached_job,
+    get_job,
+    get_job_dump,
+    register_worker,
+    save_graph_to_db,
+)
+from paraffin.db.app import get_engine
+from paraffin.db.blobs import compress, decompress
+from paraffin.db.gc import (
+    archive_experiments,
+    delete_experiments,
+    delete_offline_workers,
+    delete_unused_blobs,
+    find_experiments,
+    prune_logs,
+    vacuum,
+)
+from paraffin.db.models import Blob, CacheEntry, Experiment, Job, Stage, Worker
+from paraffin.executor import SimulatedExecutor, SimulatedStage
+
+runner = CliRunner()
+
+
+def _run(db_url: str, capture: dict | None = None) -> None:
+    a, b, c = (SimulatedStage(name) for name in "ABC")
+    save_graph_to_db(
+        nx.DiGraph([(a, b), (a, c)]),
+        queues={"C": "slow"},
+        commit="HEAD",
+        origin="local",
+        machine="local",
+        cache=False,
+        db_url=db_url,
+        capture=capture,
+    )
+    executor = SimulatedExecutor(fail=["C"])
+    spawn_worker("test", ["default", "slow"], None, None, 0, db_url, {}, None, executor)
+
+
+def test_compress():
+    raw = b"Running stage 'A'\n" * 100
+    assert zlib.decompress(compress(raw)) == raw
+    pytest.importorskip("zstandard")
+    assert compress(raw, zstd=True).startswith(b"\x28\xb5\x2f\xfd")
+    assert decompress(compress(raw, zstd=True)) == raw
+
+
+def test_capture_config(db_url):
+    _run(db_url, capture={"B": {"stdout": False}, "slow": {"limit": 10}})
+
+    assert get_job_dump("A", experiment_id=1, db_url=db_url)["stdout"] == (
+        "Running stage 'A'\n"
+    )
+    assert get_job_dump("B", experiment_id=1, db_url=db_url)["stdout"] == ""
+    stderr = get_job_dump("C", experiment_id=1, db_url=db_url)["stderr"]
+    assert stderr == "[40 characters truncated]\nd failure\n"
+
+
+def test_gc(db_url, tmp_path):
+    _run(db_url)
+    _run(db_url)
+    engine = get_engine(db_url)
+    with Session(engine) as session:
+        session.execute(
+            update(Experiment)
+            .where(Experiment.id == 1)
+            .values(created_at=datetime.datetime.now() - datetime.timedelta(days=60))
+        )
+        session.commit()
+
+    before = datetime.datetime.now() - datetime.timedelta(days=30)
+    assert prune_logs(db_url, before) == 3
+    # the logs of the second experiment are identical and still referenced
+    assert delete_unused_blobs(db_url) == 0
+    with Session(engine) as session:
+        jobs = session.exec(select(Job).order_by(Job.id)).all()
+        pruned = [job.stdout_hash is job.stderr_hash is None for job in jobs]
+        assert pruned == [True] * 3 + [False] * 3
+
+    assert prune_logs(db_url, datetime.datetime.now()) == 3
+    assert delete_unused_blobs(db_url) == 3
+    # the lockfiles are kept
+    with Session(engine) as session:
+        assert len(session.exec(select(Blob)).all()) == 3
+    assert get_job_dump("A", experiment_id=1, db_url=db_url)["lockfile_content"]
+
+    vacuum(db_url)
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as connection:
+            assert connection.execute(text("PRAGMA auto_vacuum")).scalar() == 2
+            assert connection.execute(text("PRAGMA freelist_count")).scalar() == 0
+
+
+def test_find_experiments(db_url):
+    _run(db_url)
+    _run(db_url)
+    with Session(get_engine(db_url)) as session:
+        session.execute(update(Experiment).where(Experiment.id == 2).values(base="X"))
+        session.commit()
+
+    now = datetime.datetime.now()
+    assert find_experiments(db_url, before=now - datetime.timedelta(days=1)) == []
+    assert find_experiments(db_url, before=now) == [1, 2]
+    assert find_experiments(db_url, origin="local", commits={"HEAD"}) == [2]
+    assert find_experiments(db_url, origin="other", commits={"HEAD"}) == []
+
+
+def test_delete_experiments(db_url, tmp_path):
+    _run(db_url)
+    _run(db_url)
+    engine = get_engine(db_url)
+    with Session(engine) as session:
+        hashes = {
+            stage.name: stage.dependency_hash
+            for stage in session.exec(select(Stage).where(Stage.experiment_id == 1))
+        }
+
+    archive = tmp_path / "archive.jsonl.gz"
+    archive_experiments(db_url, [1], archive)
+    with gzip.open(archive, "rt") as f:
+        (data,) = [json.loads(line) for line in f]
+    assert data["id"] == 1
+    stages = {stage["name"]: stage for stage in data["stages"]}
+    assert stages["A"]["lock"] == {"cmd": "A", "deps": [], "outs": []}
+    assert stages["B"]["parents"] == ["A"]
+    assert stages["A"]["jobs"][0]["stdout"] == "Running stage 'A'\n"
+    assert stages["C"]["jobs"][0]["worker"]["name"] == "test"
+
+    assert delete_experiments(db_url, [1], batch_size=2) == 1
+    with Session(engine) as session:
+        assert session.get(Experiment, 1) is None
+        assert {stage.experiment_id for stage in session.exec(select(Stage))} == {2}
+        assert len(session.exec(select(Job)).all()) == 3
+        # the cache of completed stages is kept
+        assert len(session.exec(select(CacheEntry)).all()) == 2
+    # only the worker of the first experiment has no jobs left
+    assert delete_offline_workers(db_url, datetime.datetime.now()) == 1
+    # the logs are identical to those of the second experiment
+    assert delete_unused_blobs(db_url) == 0
+
+    assert delete_experiments(db_url, [2]) == 1
+    assert delete_offline_workers(db_url, datetime.datetime.now()) == 1
+    assert find_cached_job(db_url, hashes["A"]) == json.dumps(
+        {"cmd": "A", "deps": [], "outs": []}
+    )
+    assert find_cached_job(db_url, hashes["C"]) is None
+    # only the cached lockfiles are kept
+    assert delete_unused_blobs(db_url) == 4
+    with Session(engine) as session:
+        assert len(session.exec(select(Blob)).all()) == 2
+        assert session.exec(select(Worker)).all() == []
+
+
+def test_delete_running_experiment(db_url):
+    _run(db_url)
+    with Session(get_engine(db_url)) as session:
+        session.execute(update(Stage).where(Stage.name == "C").values(status="running"))
+        session.commit()
+    assert delete_experiments(db_url, [1]) == 0
+    with Session(get_engine(db_url)) as session:
+        assert len(session.exec(select(Stage)).all()) == 3
+
+
+def test_gc_cli(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db_url = "sqlite:///paraffin.db"
+    _run(db_url)
+
+    result = runner.invoke(app, ["gc", "--older-than", "0"])
+    assert result.exit_code == 0, result.output
+    assert "Removed the logs of 3 jobs and 3 unused blobs." in result.output
+
+    result = runner.invoke(app, ["gc", "--delete", "--archive", "archive.jsonl.gz"])
+    assert result.exit_code == 0, result.output
+    assert "Deleted 0 experiments and 0 offline workers." in result.output
+
+    result = runner.invoke(
+        app,
+        ["gc", "--delete", "--older-than", "0", "--archive", "archive.jsonl.gz"],
+    )
+    assert result.exit_code == 0, result.output
+    assert "Deleted 1 experiments and 1 offline workers." in result.output
+    with gzip.open(tmp_path / "archive.jsonl.gz", "rt") as f:
+        assert len(f.readlines()) == 1
+
+
+def test_delete_experiment_interrupted(db_url, monkeypatch):
+    a, b, c = (SimulatedStage(name) for name in "ABC")
+    save_graph_to_db(
+        nx.DiGraph([(a, b), (b, c)]),
+        queues={},
+        commit="HEAD",
+        origin="local",
+        machine="local",
+        cache=False,
+        db_url=db_url,
+    )
+    calls = []
+
+    def keep_cache_entries(session, stages):
+        calls.append(stages)
+        if len(calls) == 2:
+            raise RuntimeError("interrupted")
+
+    monkeypatch.setattr("paraffin.db.gc.keep_cache_entries", keep_cache_entries)
+    with pytest.raises(RuntimeError):
+        delete_experiments(db_url, [1], batch_size=2)
+    # the remaining stage can not be claimed without its deleted parent
+    worker_id = register_worker("test", "local", db_url, cwd="", pid=0)
+    assert get_job(db_url, worker_id=worker_id) is None
+    with Session(get_engine(db_url)) as session:
+        assert [x.status for x in session.exec(select(Stage))] == ["blocked"]
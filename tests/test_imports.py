@@ -0,0 +1,32 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+# dependencies of the web UI, the submission, and the execution of stages
+HEAVY = {"dvc", "fastapi", "uvicorn", "git", "zntrack"}
+
+
+def _imported(code: str) -> set[str]:
+    """Return the top-level modules imported by running the code."""
+    code += "\nimport json, sys; print(json.dumps(list(sys.modules)))"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    modules = json.loads(result.stdout.splitlines()[-1])
+    return {module.split(".")[0] for module in modules}
+
+
+@pytest.mark.parametrize("command", [[], ["worker"], ["submit"]])
+def test_cli_help_imports(command):
+    code = (
+        "from paraffin.cli import app\n"
+        f"app({command + ['--help']}, standalone_mode=False)"
+    )
+    assert _imported(code) & (HEAVY | {"sqlmodel", "networkx"}) == set()
+
+
+def test_db_imports():
+    # workers only need the database until they claim a stage
+    assert _imported("import paraffin.db") & HEAVY == set()
@@ -0,0 +1,76 @@
+import datetime
+from unittest import mock
+
+import networkx as nx
+
+from paraffin.db import (
+    close_worker,
+    complete_job,
+    get_job,
+    register_worker,
+    update_job_status,
+)
+from paraffin.db.app import get_engine
+from paraffin.executor import SimulatedStage
+
+
+def test_affinity(db_url, submit):
+    a_x, b_x, b_y, a_y, a_z = (
+        SimulatedStage(name) for name in ["a_X", "b_X", "b_Y", "a_Y", "a_Z"]
+    )
+    graph = nx.DiGraph([(a_x, a_z)])
+    graph.add_nodes_from([b_x, b_y, a_y])
+    submit(graph)
+    first = register_worker("first", "node-1", db_url, cwd="", pid=0)
+    second = register_worker("second", "node-2", db_url, cwd="", pid=0)
+
+    def run(worker_id):
+        stage, _ = get_job(db_url, worker_id=worker_id, affinity=True)
+        complete_job(
+            stage.id, lock={"cmd": stage.name}, db_url=db_url, worker_id=worker_id
+        )
+        return stage.name
+
+    assert run(first) == "a_X"
+    assert run(second) == "b_X"
+    # the child of the last stage of the worker
+    assert run(first) == "a_Z"
+    # a stage of a group that ran on the machine
+    assert run(first) == "a_Y"
+    assert run(second) == "b_Y"
+
+
+class _SkewedDatetime(datetime.datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return super().now(tz) + datetime.timedelta(hours=1)
+
+
+def test_locality_wait(db_url, submit):
+    a, b, c = (SimulatedStage(name) for name in "ABC")
+    graph = nx.DiGraph([(a, b)])
+    graph.add_node(c)
+    submit(graph)
+    first = register_worker("first", "node-1", db_url, cwd="", pid=0)
+    second = register_worker("second", "node-2", db_url, cwd="", pid=0)
+
+    def claim(worker_id, wait):
+        job_obj = get_job(db_url, worker_id=worker_id, locality_wait=wait)
+        return None if job_obj is None else job_obj[0]
+
+    stage = claim(first, 60)
+    assert stage.name == "A"
+    complete_job(stage.id, lock={"cmd": "A"}, db_url=db_url, worker_id=first)
+    # B is left to the machine that produced its input
+    assert claim(second, 60).name == "C"
+    assert claim(second, 60) is None
+    if get_engine(db_url).dialect.name == "postgresql":
+        # the clock of the second machine is ahead, the database clock is used
+        with mock.patch("datetime.datetime", _SkewedDatetime):
+            assert claim(second, 60) is None
+    assert claim(second, 0).name == "B"
+
+    update_job_status("B", 1, "pending", db_url, force=False)
+    # there is nobody left to run B on the first machine
+    close_worker(first, db_url=db_url)
+    assert claim(second, 60).name == "B"
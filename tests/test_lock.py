@@ -1,7 +1,13 @@
+import pathlib
+
+import dvc.api
+import dvc.cli
 import pytest
 from dvc.stage.cache import _get_cache_hash
+from dvc.stage.serialize import to_single_stage_lockfile
 
 from paraffin.lock import clean_lock, transform_lock
+from paraffin.stage import get_lock, read_lock
 
 
 @pytest.fixture()
@@ -338,3 +344,32 @@ def test_clean_lockAB(lock_a_b):
 def test_transform_lock01(lock_input_ref_output):
     inp, ref, out = lock_input_ref_output
     assert transform_lock(inp, ref) == out
+
+
+def test_get_and_read_lock(proj_path):
+    pathlib.Path("params.yaml").write_text("a: 1\n")
+    pathlib.Path("in.txt").write_text("data")
+    stages = {
+        "A": ["-p", "a", "-d", "in.txt", "-o", "outs", "mkdir outs; cp in.txt outs"],
+        "B": ["-d", "outs", "-o", "b.txt", "ls outs > b.txt"],
+    }
+    for name, args in stages.items():
+        assert dvc.cli.main(["stage", "add", "-n", name, *args]) == 0
+
+    for name in stages:
+        _, dependency_hash = get_lock(name)
+        assert dvc.cli.main(["repro", "--single-item", name]) == 0
+        stage_lock, read_hash = read_lock(name)
+        assert read_hash == dependency_hash
+
+        # identical to hashing the outputs again, except for the size of
+        #  the files in directories, which is not part of the DVC cache
+        stage = dvc.api.DVCFileSystem().repo.stage.collect(name)[0]
+        stage.save(run_cache=False)
+        saved_lock = to_single_stage_lockfile(stage, with_files=True)
+        for item in saved_lock["deps"] + saved_lock["outs"]:
+            for entry in item.get("files", []):
+                entry.pop("size")
+        assert stage_lock == saved_lock
+    assert [dep["path"] for dep in stage_lock["deps"]] == ["outs"]
+    assert stage_lock["deps"][0]["files"][0]["relpath"] == "in.txt"
@@ -0,0 +1,245 @@
+import json
+
+import pytest
+from sqlalchemy import (
+    Column,
+    MetaData,
+    String,
+    Table,
+    create_engine,
+    insert,
+    inspect,
+    or_,
+    select,
+    text,
+)
+from sqlmodel import Session, SQLModel
+
+from paraffin.db.blobs import get_blob
+from paraffin.db.migrations import MIGRATIONS, get_version, migrate
+from paraffin.db.models import (
+    Blob,
+    Experiment,
+    Job,
+    Stage,
+    StageDependency,
+    Worker,
+)
+
+# columns that were stored inline before the blob table was added
+_INLINE_COLUMNS = {
+    "lockfile_hash": "lockfile_content",
+    "stdout_hash": "stdout",
+    "stderr_hash": "stderr",
+}
+# columns that were added by migrations
+_NEW_COLUMNS = {"capture_limit", "chain_id", "unblocked_status"}
+
+
+def _create_unmigrated(db_url: str):
+    """Create a database like paraffin did before migrations were added."""
+    metadata = MetaData()
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name in ["schemaversion", "blob"]:
+            continue
+        columns = []
+        for column in table.columns:
+            if column.name in _NEW_COLUMNS:
+                continue
+            if column.name in _INLINE_COLUMNS:
+                column = Column(_INLINE_COLUMNS[column.name], String, default="")
+            else:
+                column = column._copy()
+                column.index = None
+            columns.append(column)
+        Table(table.name, metadata, *columns)
+
+    engine = create_engine(db_url)
+    metadata.create_all(engine)
+    stage, job = metadata.tables["stage"], metadata.tables["job"]
+    lock = json.dumps({"cmd": "true"})
+    with engine.begin() as connection:
+        connection.execute(insert(Experiment).values(id=1, base="HEAD"))
+        connection.execute(insert(Worker).values(id=1, name="test", machine="local"))
+        connection.execute(
+            insert(stage),
+            [
+                {
+                    "id": 1,
+                    "name": "A",
+                    "cmd": "true",
+                    "experiment_id": 1,
+                    "lockfile_content": "",
+                },
+                {
+                    "id": 2,
+                    "name": "B",
+                    "cmd": "true",
+                    "experiment_id": 1,
+                    "lockfile_content": lock,
+                },
+                {
+                    "id": 3,
+                    "name": "C",
+                    "cmd": "true",
+                    "experiment_id": 1,
+                    "lockfile_content": lock,
+                },
+            ],
+        )
+        connection.execute(
+            insert(job).values(
+                id=1, stage_id=2, worker_id=1, stdout="Running B\n", stderr=""
+            )
+        )
+    return engine
+
+
+def _indexes(engine) -> dict[str, set[str]]:
+    inspector = inspect(engine)
+    return {
+        table: {
+            col for idx in inspector.get_indexes(table) for col in idx["column_names"]
+        }
+        for table in ["stage", "job", "stagedependency", "experiment", "worker"]
+    }
+
+
+def test_migrate(db_url):
+    engine = _create_unmigrated(db_url)
+    assert _indexes(engine)["stage"] == set()
+
+    migrate(engine)
+    indexes = _indexes(engine)
+    assert indexes["stage"] == {
+        "experiment_id",
+        "status",
+        "queue",
+        "name",
+        "dependency_hash",
+        "chain_id",
+    }
+    assert indexes["job"] == {"stage_id", "worker_id"}
+    assert indexes["stagedependency"] == {"child_id"}
+    assert indexes["experiment"] == {"base"}
+    with engine.connect() as connection:
+        assert get_version(connection) == len(MIGRATIONS)
+        names = connection.execute(select(Stage.name).order_by(Stage.id)).scalars()
+        assert names.all() == ["A", "B", "C"]
+
+    # migrating again is a no-op
+    migrate(engine)
+    with engine.connect() as connection:
+        assert get_version(connection) == len(MIGRATIONS)
+
+
+def test_migrate_blobs(db_url):
+    engine = _create_unmigrated(db_url)
+    migrate(engine)
+    assert not {"lockfile_content", "stdout", "stderr"} & {
+        column["name"]
+        for table in ["stage", "job"]
+        for column in inspect(engine).get_columns(table)
+    }
+    with Session(engine) as session:
+        stages = session.scalars(select(Stage).order_by(Stage.id)).all()
+        assert stages[0].lockfile_hash is None
+        # identical lockfiles are stored once
+        assert stages[1].lockfile_hash == stages[2].lockfile_hash
+        assert json.loads(get_blob(session, stages[1].lockfile_hash)) == {"cmd": "true"}
+        job = session.get(Job, 1)
+        assert get_blob(session, job.stdout_hash) == "Running B\n"
+        assert job.stderr_hash is None
+        assert len(session.scalars(select(Blob)).all()) == 2
+
+
+def test_migrate_new(db_url):
+    engine = create_engine(db_url)
+    migrate(engine)
+    with engine.connect() as connection:
+        assert get_version(connection) == len(MIGRATIONS)
+    assert _indexes(engine)["job"] == {"stage_id", "worker_id"}
+
+
+@pytest.fixture
+def large_db(db_url):
+    """A database with 100 experiments of 100 stages each."""
+    engine = create_engine(db_url)
+    migrate(engine)
+    n_experiments, n_stages = 100, 100
+    with engine.begin() as connection:
+        connection.execute(insert(Worker).values(id=1, name="test", machine="local"))
+        connection.execute(
+            insert(Experiment),
+            [{"id": idx, "base": f"commit-{idx}"} for idx in range(n_experiments)],
+        )
+        connection.execute(
+            insert(Stage),
+            [
+                {
+                    "id": exp * n_stages + idx,
+                    "name": f"stage_{idx}",
+                    "cmd": "true",
+                    "experiment_id": exp,
+                    "status": "completed" if exp < n_experiments - 1 else "pending",
+                    "queue": "default" if idx % 2 else "other",
+                    "dependency_hash": f"{exp}-{idx}",
+                }
+                for exp in range(n_experiments)
+                for idx in range(n_stages)
+            ],
+        )
+        connection.execute(
+            insert(StageDependency),
+            [
+                {
+                    "parent_id": exp * n_stages + idx - 1,
+                    "child_id": exp * n_stages + idx,
+                }
+                for exp in range(n_experiments)
+                for idx in range(1, n_stages)
+            ],
+        )
+        connection.execute(
+            insert(Job),
+            [
+                {"stage_id": idx, "worker_id": 1}
+                for idx in range((n_experiments - 1) * n_stages)
+            ],
+        )
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as connection:
+            connection.execute(text("ANALYZE"))
+    return engine
+
+
+QUERIES = {
+    "pending": select(Stage)
+    .where(or_(Stage.status == "pending", Stage.status == "cached"))
+    .where(Stage.experiment_id == 42)
+    .where(Stage.queue.in_(["default"])),
+    "by_name": select(Stage)
+    .where(Stage.experiment_id == 42)
+    .where(Stage.name == "stage_7"),
+    "cached_job": select(Stage).where(Stage.dependency_hash == "42-7"),
+    "parents": select(StageDependency).where(StageDependency.child_id == 4207),
+    "children": select(StageDependency).where(StageDependency.parent_id == 4207),
+    "jobs_of_stage": select(Job).where(Job.stage_id == 4207),
+    "jobs_of_worker": select(Job).where(Job.worker_id == 2),
+    "experiments": select(Experiment).where(Experiment.base == "commit-42"),
+}
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_query_uses_index(large_db, query):
+    sql = QUERIES[query].compile(large_db, compile_kwargs={"literal_binds": True})
+    with large_db.connect() as connection:
+        if large_db.dialect.name == "sqlite":
+            plan = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+            details = [row[-1] for row in plan]
+            assert all(x.startswith("SEARCH") for x in details), details
+        else:
+            # small tables are always scanned, unless there is no alternative
+            connection.execute(text("SET enable_seqscan = off"))
+            plan = connection.execute(text(f"EXPLAIN {sql}")).scalars().all()
+            assert not any("Seq Scan" in x for x in plan), plan
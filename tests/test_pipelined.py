@@ -0,0 +1,109 @@
+import time
+
+import networkx as nx
+import pytest
+from sqlmodel import Session, select
+
+from paraffin.db import register_worker
+from paraffin.db.app import get_engine
+from paraffin.db.models import Stage
+from paraffin.executor import SimulatedExecutor, SimulatedStage
+from paraffin.pipelined import spawn_pipelined_worker
+
+
+class _SlowLockExecutor(SimulatedExecutor):
+    """Record when the stages run and when their locks were read."""
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.events = []
+
+    def repro(self, name: str, force: bool) -> tuple[int, str, str]:
+        self.events.append(f"run {name}")
+        return super().repro(name, force)
+
+    def read_lock(self, name: str) -> tuple[dict, str]:
+        time.sleep(0.5)
+        self.events.append(f"stored {name}")
+        return super().read_lock(name)
+
+
+def test_pipelined_worker(submit, run_worker, stage_status):
+    a, b, c, d, e, x = (SimulatedStage(name) for name in "ABCDEX")
+    graph = nx.DiGraph([(a, b), (b, c), (a, d), (d, e)])
+    graph.add_node(x)
+    submit(graph)
+    executor = _SlowLockExecutor(duration=0.01, fail=["D"])
+    workers = run_worker(target=spawn_pipelined_worker, executor=executor)
+
+    assert stage_status() == {
+        "A": "completed",
+        "B": "completed",
+        "C": "completed",
+        "D": "failed",
+        "E": "blocked",
+        "X": "completed",
+    }
+    assert workers == {}
+    # X was claimed while A ran and ran while the lock of A was read
+    assert executor.events[:3] == ["run A", "run X", "stored A"]
+
+
+class _StatusExecutor(SimulatedExecutor):
+    """Record the status of the other stages after a stage ran."""
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.db_url = None
+        self.status = {}
+
+    def repro(self, name: str, force: bool) -> tuple[int, str, str]:
+        result = super().repro(name, force)
+        with Session(get_engine(self.db_url)) as session:
+            self.status[name] = {
+                x.name: x.status for x in session.exec(select(Stage)).all()
+            }
+        return result
+
+
+@pytest.mark.parametrize("idle", [False, True])
+def test_pipelined_worker_claim_ahead(db_url, submit, run_worker, idle):
+    graph = nx.DiGraph()
+    graph.add_nodes_from([SimulatedStage("A"), SimulatedStage("X")])
+    submit(graph)
+    if idle:
+        register_worker("idle", "local", db_url, cwd="", pid=0)
+    executor = _StatusExecutor(durations={"A": 0.5})
+    executor.db_url = db_url
+    workers = run_worker(target=spawn_pipelined_worker, executor=executor)
+    assert workers == {}
+    # X is only claimed while A runs if no other worker is idle
+    assert executor.status["A"]["X"] == ("pending" if idle else "running")
+
+
+class _HeldExecutor(_SlowLockExecutor):
+    """Record the stages the worker holds when a stage finished running."""
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.workers = {}
+        self.held = {}
+
+    def repro(self, name: str, force: bool) -> tuple[int, str, str]:
+        result = super().repro(name, force)
+        (self.held[name],) = self.workers.values()
+        return result
+
+
+def test_pipelined_worker_chain_ahead(db_url, submit, stage_status):
+    a, b, x, y = (SimulatedStage(name) for name in "ABXY")
+    graph = nx.DiGraph([(a, b)])
+    graph.add_nodes_from([x, y])
+    submit(graph)
+    executor = _HeldExecutor(durations={"X": 1})
+    spawn_pipelined_worker(
+        "test", ["default"], None, None, 0, db_url, executor.workers, executor=executor
+    )
+    assert set(stage_status().values()) == {"completed"}
+    # Y was claimed while X ran, so the chain of A was not continued as well
+    assert len(executor.held["X"]) == 2
@@ -0,0 +1,79 @@
+import os
+import socket
+from unittest import mock
+
+import networkx as nx
+import pytest
+from sqlmodel import Session, select
+
+from paraffin.db import (
+    complete_job,
+    get_job,
+    get_job_dump,
+    get_upstream_locks,
+    register_worker,
+)
+from paraffin.db.app import get_engine
+from paraffin.db.models import Stage
+from paraffin.executor import SimulatedExecutor, SimulatedStage
+from paraffin.prefetch import Prefetcher
+
+
+def _run_in_other_clone(db_url: str, name: str) -> None:
+    """Run a stage in another clone on the same machine."""
+    machine = socket.gethostname()
+    other = register_worker("other", machine, db_url, cwd="/other/clone", pid=0)
+    stage, _ = get_job(db_url, queues=["other"], worker_id=other)
+    assert stage.name == name
+    complete_job(stage.id, lock={"cmd": name}, db_url=db_url, worker_id=other)
+
+
+def test_prefetch(db_url, submit, run_worker):
+    a, b, c, d = (SimulatedStage(name) for name in "ABCD")
+    submit(nx.DiGraph([(a, b), (a, c), (b, d)]), queues={"A": "other"})
+    machine, cwd = socket.gethostname(), os.getcwd()
+    assert get_upstream_locks(db_url, machine, cwd) == {}
+
+    _run_in_other_clone(db_url, "A")
+    assert get_upstream_locks(db_url, machine, cwd) == {"A": '{"cmd": "A"}'}
+    assert get_upstream_locks(db_url, machine, "/other/clone") == {}
+    with Session(get_engine(db_url)) as session:
+        d_id = session.exec(select(Stage.id).where(Stage.name == "D")).one()
+    assert get_upstream_locks(db_url, machine, cwd, stage_id=d_id) == {}
+
+    executor = SimulatedExecutor()
+    prefetcher = Prefetcher(executor, db_url, ["default"]).start()
+    try:
+        run_worker(executor=executor, prefetcher=prefetcher)
+    finally:
+        prefetcher.close()
+    # the outputs of B were produced in this clone
+    assert executor.prefetched == ["A"]
+    assert get_job_dump("D", experiment_id=1, db_url=db_url)["status"] == "completed"
+
+
+@pytest.mark.parametrize("failures", [1, 4])
+def test_prefetch_error(db_url, submit, run_worker, stage_status, failures):
+    a, b, c = (SimulatedStage(name) for name in "ABC")
+    submit(nx.DiGraph([(a, b), (a, c)]), queues={"A": "other"})
+    _run_in_other_clone(db_url, "A")
+
+    executor = SimulatedExecutor()
+    results = [(1, "", "unable to fetch\n")] * failures + [(0, "", "")]
+    with mock.patch.object(executor, "prefetch", side_effect=results) as prefetch:
+        prefetcher = Prefetcher(executor, db_url, ["default"])
+        try:
+            run_worker(executor=executor, prefetcher=prefetcher)
+        finally:
+            prefetcher.close()
+    if failures == 1:
+        # the prefetch is retried once and not repeated for the other child
+        assert stage_status() == {"A": "completed", "B": "completed", "C": "completed"}
+        assert prefetch.call_count == 2
+    else:
+        # both children failed instead of running without their input
+        assert stage_status() == {"A": "completed", "B": "failed", "C": "failed"}
+        dump = get_job_dump("B", experiment_id=1, db_url=db_url)
+        assert dump["stderr"] == (
+            "Unable to prefetch the outputs of 'A':\nunable to fetch\n"
+        )
@@ -0,0 +1,84 @@
+import pstats
+import threading
+
+import pytest
+import zntrack.examples
+from typer.testing import CliRunner
+
+from paraffin.cli import app
+from paraffin.profiling import CONCURRENT, WorkerProfiler
+
+runner = CliRunner()
+
+
+def test_worker_profile(proj_path, check_finished):
+    project = zntrack.Project()
+
+    with project:
+        zntrack.examples.ParamsToOuts(params=1)
+
+    project.build()
+
+    result = runner.invoke(app, "submit")
+    assert result.exit_code == 0
+    result = runner.invoke(app, ["worker", "--profile", "profiles"])
+    assert result.exit_code == 0
+    assert check_finished()
+
+    profiles = sorted(x.name for x in (proj_path / "profiles").iterdir())
+    assert profiles == ["job-1-ParamsToOuts.prof", "worker-1-poll.prof"]
+
+    stats = pstats.Stats(str(proj_path / "profiles" / "job-1-ParamsToOuts.prof"))
+    functions = {name for _, _, name in stats.stats}
+    assert "read_lock" in functions
+    assert "complete_job" in functions
+
+
+def test_profile_dump(tmp_path):
+    profiler = WorkerProfiler(tmp_path)
+    with profiler.profile("job-1", dump=False):
+        profiler.dump()
+    profiler.close()
+
+    files = sorted(x.name for x in tmp_path.iterdir())
+    assert len(files) == 3
+    assert files[0].startswith("job-1-")
+    assert files[1] == "job-1.prof"
+    assert files[2].startswith("stacks-")
+    assert "(job-1)" in (tmp_path / files[2]).read_text()
+
+
+def test_profile_threads(tmp_path):
+    profiler = WorkerProfiler(tmp_path)
+    started, done = threading.Event(), threading.Event()
+
+    def run():
+        with profiler.profile("job-1"):
+            started.set()
+            done.wait()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait()
+    try:
+        if CONCURRENT:
+            with profiler.profile("job-2"):
+                pass
+        else:
+            # only one profiler can be active since Python 3.12
+            with pytest.raises(RuntimeError, match="'job-1' is active"):
+                with profiler.profile("job-2"):
+                    pass
+    finally:
+        done.set()
+        thread.join()
+
+    files = sorted(x.name for x in tmp_path.iterdir())
+    assert files == (["job-1.prof", "job-2.prof"] if CONCURRENT else ["job-1.prof"])
+
+
+def test_profile_jobs_python312(monkeypatch):
+    monkeypatch.setattr("paraffin.cli.CONCURRENT", False)
+    result = runner.invoke(app, ["worker", "--profile", "profiles", "--jobs", "2"])
+    assert result.exit_code == 2
+    assert "only be used with '--jobs 1'" in result.output
@@ -8,6 +8,7 @@ import zntrack.examples
 from typer.testing import CliRunner
 
 from paraffin.cli import app
+from paraffin.db import get_job_dump
 
 runner = CliRunner()
 
@@ -69,6 +70,29 @@ def test_run_all_multi_jobs(proj01, caplog, check_finished):
     assert check_finished()
 
 
+def test_run_all_forkserver(proj01, check_finished):
+    result = runner.invoke(app, "submit")
+    assert result.exit_code == 0
+    result = runner.invoke(app, ["worker", "--forkserver", "--jobs", "2"])
+    assert result.exit_code == 0, result.output
+
+    assert check_finished()
+    dump = get_job_dump(
+        "A_X_ParamsToOuts", experiment_id=1, db_url="sqlite:///paraffin.db"
+    )
+    assert "Running stage 'A_X_ParamsToOuts'" in dump["stdout"]
+
+
+@pytest.mark.parametrize("options", [[], ["--forkserver"]])
+def test_run_all_async(proj01, check_finished, options):
+    result = runner.invoke(app, "submit")
+    assert result.exit_code == 0
+    result = runner.invoke(app, ["worker", "--async", "--jobs", "4", *options])
+    assert result.exit_code == 0, result.output
+
+    assert check_finished()
+
+
 def test_run_selection(proj01, caplog, check_finished):
     result = runner.invoke(app, ["submit", "A_X_ParamsToOuts"])
     assert result.exit_code == 0
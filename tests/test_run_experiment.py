@@ -60,3 +60,35 @@ def test_run_job_submit_twice(proj_path, check_finished):
     assert result.exit_code == 0
     assert check_finished([d.name])
     assert not check_finished([e.name])
+
+
+def test_submit_update(proj_path, check_finished):
+    project = zntrack.Project()
+
+    with project:
+        a = zntrack.examples.ParamsToOuts(params=1)
+        b = zntrack.examples.ParamsToOuts(params=2)
+        c = zntrack.examples.AddNodeNumbers(numbers=[a, b])
+
+    project.build()
+
+    result = runner.invoke(app, "submit")
+    assert result.exit_code == 0
+    result = runner.invoke(app, "worker --experiment 1")
+    assert result.exit_code == 0
+    assert check_finished()
+
+    project = zntrack.Project()
+    with project:
+        a = zntrack.examples.ParamsToOuts(params=10)
+        b = zntrack.examples.ParamsToOuts(params=2)
+        c = zntrack.examples.AddNodeNumbers(numbers=[a, b])
+    project.build()
+
+    result = runner.invoke(app, "submit --update 1")
+    assert result.exit_code == 0
+    assert "0 added, 2 reset and 0 removed stages" in result.output
+    result = runner.invoke(app, "worker --experiment 1")
+    assert result.exit_code == 0
+    assert check_finished()
+    assert c.from_rev().sum == 12
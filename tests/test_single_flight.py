@@ -0,0 +1,106 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+from unittest import mock
+
+import networkx as nx
+from sqlmodel import Session, select, update
+
+from paraffin.cli import spawn_worker
+from paraffin.db import (
+    claim_dependency_hash,
+    close_worker,
+    get_job,
+    register_worker,
+)
+from paraffin.db.app import get_engine
+from paraffin.db.models import InFlight, Stage, Worker
+from paraffin.executor import SimulatedExecutor, SimulatedStage
+
+
+def test_single_flight(db_url, submit, stage_status):
+    graph = nx.DiGraph()
+    graph.add_node(SimulatedStage("A", cmd="zntrack run module.A --name A"))
+    for _ in range(2):
+        submit(graph, cache=True)
+
+    executor = SimulatedExecutor(duration=0.5)
+    executor.repro = mock.Mock(wraps=executor.repro)
+    executor.checkout = mock.Mock(wraps=executor.checkout)
+    # one worker for each experiment
+    threads = [
+        threading.Thread(
+            target=spawn_worker,
+            args=("test", ["default"], experiment, None, 0, db_url, {}),
+            kwargs={"executor": executor},
+        )
+        for experiment in (1, 2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # the identical stage waited for the first one and checked out its result
+    assert executor.repro.call_count == 1
+    assert executor.checkout.call_count == 1
+    assert set(stage_status().values()) == {"completed"}
+    with Session(get_engine(db_url)) as session:
+        assert session.exec(select(InFlight)).all() == []
+
+
+def _set_running(db_url: str) -> None:
+    with Session(get_engine(db_url)) as session:
+        session.execute(update(Stage).values(status="running"))
+        session.commit()
+
+
+def test_claim_dependency_hash(db_url, submit):
+    submit(nx.DiGraph([(SimulatedStage("A"), SimulatedStage("B"))]), cache=True)
+    _set_running(db_url)
+
+    assert claim_dependency_hash(db_url, "hash", stage_id=1)
+    assert claim_dependency_hash(db_url, "hash", stage_id=1)
+    assert not claim_dependency_hash(db_url, "hash", stage_id=2)
+
+    # the claim of a stage that is no longer running is replaced
+    with Session(get_engine(db_url)) as session:
+        session.execute(update(Stage).where(Stage.id == 1).values(status="failed"))
+        session.commit()
+    assert claim_dependency_hash(db_url, "hash", stage_id=2)
+    with Session(get_engine(db_url)) as session:
+        assert session.get(InFlight, "hash").stage_id == 2
+
+
+def test_claim_dependency_hash_exited_worker(db_url, submit):
+    submit(nx.DiGraph([(SimulatedStage("A"), SimulatedStage("B"))]), cache=True)
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    machine = socket.gethostname()
+    owner = register_worker("owner", machine, db_url, cwd="", pid=os.getpid())
+    stage, _ = get_job(db_url, worker_id=owner)
+    _set_running(db_url)
+    assert claim_dependency_hash(db_url, "hash", stage_id=stage.id)
+    # the owner is still running
+    assert not claim_dependency_hash(db_url, "hash", stage_id=stage.id + 1)
+
+    # the process of the owner was killed and the stage is still running
+    with Session(get_engine(db_url)) as session:
+        session.execute(
+            update(Worker).where(Worker.id == owner).values(pid=process.pid)
+        )
+        session.commit()
+    assert claim_dependency_hash(db_url, "hash", stage_id=stage.id + 1)
+
+    # the owner on another machine exited
+    assert claim_dependency_hash(db_url, "other", stage_id=stage.id)
+    with Session(get_engine(db_url)) as session:
+        session.execute(
+            update(Worker).where(Worker.id == owner).values(machine="other", pid=1)
+        )
+        session.commit()
+    assert not claim_dependency_hash(db_url, "other", stage_id=stage.id + 1)
+    close_worker(owner, db_url=db_url)
+    assert claim_dependency_hash(db_url, "other", stage_id=stage.id + 1)
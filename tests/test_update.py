@@ -0,0 +1,80 @@
+import networkx as nx
+import pytest
+from sqlmodel import Session, select
+
+from paraffin.cli import spawn_worker
+from paraffin.db import update_experiment
+from paraffin.db.app import get_engine
+from paraffin.db.models import CacheEntry, Stage, StageDependency
+from paraffin.executor import SimulatedExecutor, SimulatedStage
+
+
+def test_update_experiment(db_url, submit, stage_status):
+    a, b, c, d = (SimulatedStage(name) for name in "ABCD")
+    submit(nx.DiGraph([(a, b), (b, c), (a, d)]))
+    executor = SimulatedExecutor()
+    spawn_worker("test", ["default"], 1, None, 0, db_url, {}, executor=executor)
+    assert set(stage_status().values()) == {"completed"}
+
+    # B changed, which resets C, D was removed and E was added
+    a, c = SimulatedStage("A", changed=False), SimulatedStage("C", changed=False)
+    b, e = SimulatedStage("B", cmd="new"), SimulatedStage("E")
+    result = update_experiment(
+        nx.DiGraph([(a, b), (b, c), (a, e)]),
+        experiment_id=1,
+        queues={"E": "other"},
+        commit="NEW",
+        cache=False,
+        db_url=db_url,
+    )
+    assert result == {"added": ["E"], "reset": ["B", "C"], "removed": ["D"]}
+    assert stage_status() == {
+        "A": "completed",
+        "B": "pending",
+        "C": "pending",
+        "E": "pending",
+    }
+    with Session(get_engine(db_url)) as session:
+        names = {x.id: x.name for x in session.exec(select(Stage)).all()}
+        edges = {
+            (names[x.parent_id], names[x.child_id])
+            for x in session.exec(select(StageDependency)).all()
+        }
+        assert edges == {("A", "B"), ("B", "C"), ("A", "E")}
+        assert session.exec(select(Stage.queue).where(Stage.name == "E")).one() == (
+            "other"
+        )
+        # the previous results of B, C and D remain available as cache
+        assert len(session.exec(select(CacheEntry)).all()) == 3
+
+    spawn_worker("test", ["default"], 1, None, 0, db_url, {}, executor=executor)
+    assert stage_status()["C"] == "completed"
+    assert stage_status()["E"] == "pending"
+
+    # nothing changed
+    b = SimulatedStage("B", cmd="new", changed=False)
+    result = update_experiment(
+        nx.DiGraph([(a, b), (b, c)]),
+        experiment_id=1,
+        queues={},
+        commit="NEW",
+        cache=False,
+        db_url=db_url,
+        remove_missing=False,
+    )
+    assert result == {"added": [], "reset": [], "removed": []}
+
+
+def test_update_missing_experiment(db_url, submit, stage_status):
+    submit(nx.DiGraph([(SimulatedStage("A"), SimulatedStage("B"))]))
+    with pytest.raises(ValueError, match="Experiment 2 does not exist"):
+        update_experiment(
+            nx.DiGraph([(SimulatedStage("C"), SimulatedStage("D"))]),
+            experiment_id=2,
+            queues={},
+            commit="NEW",
+            cache=False,
+            db_url=db_url,
+        )
+    # no stages were added to the missing experiment
+    assert stage_status() == {"A": "pending", "B": "pending"}
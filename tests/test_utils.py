@@ -1,4 +1,21 @@
-from paraffin.utils import get_group, replace_node_working_dir
+import json
+import pathlib
+
+import dvc.api
+import dvc.cli
+import pytest
+import yaml
+
+from paraffin.utils import get_group, get_stage_graph, replace_node_working_dir
+
+
+def _write_pipeline(*names: str) -> None:
+    stages = {}
+    for parent, name in zip((None,) + names, names):
+        stages[name] = {"cmd": f"echo {name} > {name}.txt", "outs": [f"{name}.txt"]}
+        if parent is not None:
+            stages[name]["deps"] = [f"{parent}.txt"]
+    pathlib.Path("dvc.yaml").write_text(yaml.safe_dump({"stages": stages}))
 
 
 def test_get_group():
@@ -50,3 +67,56 @@ def test_replace_node_working_dir():
         replace_node_working_dir(ref_path, ref_nwd, inp_nwd).as_posix()
         == "nodes/grp/MyNode/node-meta.json"
     )
+
+
+def test_get_stage_graph_cache(proj_path, monkeypatch):
+    _write_pipeline("A", "B")
+    graph = get_stage_graph(names=None, force=False, single_item=False)
+    assert sorted((a.name, b.name) for a, b in graph.edges) == [("A", "B")]
+    assert all(node.changed for node in graph)
+    assert next(iter(graph)).stage.cmd == next(iter(graph)).cmd
+
+    cache = proj_path / ".dvc" / "tmp" / "paraffin-graph.json"
+    assert json.loads(cache.read_text())["edges"] == [["A", "B"]]
+
+    # an unchanged pipeline is loaded from the cache and with
+    #  force, the DVC repository is not opened at all.
+    def fail(*args, **kwargs):
+        raise AssertionError("the DVC repository should not be opened")
+
+    monkeypatch.setattr(dvc.api, "DVCFileSystem", fail)
+    monkeypatch.setattr("dvc.repo.Repo.__init__", fail)
+    graph = get_stage_graph(names=["B"], force=True, single_item=False)
+    assert {node.name: node.cmd for node in graph} == {
+        "A": "echo A > A.txt",
+        "B": "echo B > B.txt",
+    }
+    assert all(node.changed and node.force for node in graph)
+
+    _write_pipeline("A", "B", "C")
+    with pytest.raises(AssertionError):
+        get_stage_graph(names=None, force=True, single_item=False)
+    monkeypatch.undo()
+    graph = get_stage_graph(names=["C"], force=False, single_item=True)
+    assert [node.name for node in graph] == ["C"]
+
+
+def test_get_stage_graph_status(proj_path):
+    _write_pipeline("A", "B", "C")
+    pathlib.Path("D.txt").write_text("D")
+    dvc.cli.main(["stage", "add", "-n", "D", "-d", "D.txt", "cat D.txt"])
+    assert dvc.cli.main(["repro", "--quiet"]) == 0
+    pathlib.Path("B.txt").write_text("modified")
+
+    status = {}
+    for jobs in (1, 4):
+        graph = get_stage_graph(names=None, force=False, single_item=False, jobs=jobs)
+        status[jobs] = {node.name: json.loads(node.status) for node in graph}
+    assert status[1] == status[4]
+    assert status[4]["A"] == []
+    assert status[4]["B"] == [{"changed outs": {"B.txt": "modified"}}]
+    assert status[4]["C"] == [
+        {"changed deps": {"B.txt": "modified"}},
+        "changed by upstream",
+    ]
+    assert status[4]["D"] == []